@@ -171,6 +171,8 @@ def parse_build_log():
     f.addStep(logs.SetupPropertys())
     # pers the build log for info qa errors
     f.addStep(logs.SetupParserBuildLoger())
+    # add the pattern stats from the log parser to the db
+    f.addStep(logs.setPatternStats())
     #f.addStep(logs.ParserBuildLog())
     # pers the log from pkg check
     #f.addStep(logs.ParserPkgCheckLog())
@@ -179,6 +181,8 @@ def parse_build_log():
     # check the sum log if we need to make a issue/bug/pr report
     # set it SUCCESS/FAILURE/WARNINGS
     f.addStep(logs.MakeIssue())
+    # add the sum log (and the build log) to the search index
+    f.addStep(logs.setSearchIndex())
     # add sum log to buildbot log
     f.addStep(logs.setBuildbotLog())
     # pers the emerge info
@@ -187,6 +191,10 @@ def parse_build_log():
     f.addStep(logs.setEmergeInfoLog())
     # add package info to log and db
     f.addStep(logs.setPackageInfoLog())
+    # learn the info lines that is in every successful build
+    f.addStep(logs.setPatternNoise())
+    # recompress the build log with zstd
+    f.addStep(logs.CompressBuildLog())
     # set BuildStatus
     f.addStep(logs.setBuildStatus())
     # setup things for the irc bot
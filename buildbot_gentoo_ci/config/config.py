@@ -92,7 +92,8 @@ class GentooCiConfig(util.ComparableMixin):
     _known_config_keys = set([
         "db_url",
         "project",
-        "repository_basedir"
+        "repository_basedir",
+        "object_store"
     ])
 
     compare_attrs = list(_known_config_keys)
@@ -118,6 +119,7 @@ class GentooCiConfig(util.ComparableMixin):
         try:
             config.load_db(config_dict)
             config.load_project(config_dict)
+            config.load_object_store(config_dict)
         finally:
             _errors = None
 
@@ -149,3 +151,9 @@ class GentooCiConfig(util.ComparableMixin):
             self.project['repository_basedir'] = config_dict['repository_basedir']
         else:
             self.project['repository_basedir'] = DEFAULT_REPOSITORY_BASEDIR
+
+    def load_object_store(self, config_dict):
+        # no object store if we don't have it in the config
+        self.object_store = config_dict.get('object_store', {})
+        if self.object_store.get('type') not in [None, 'minio', 'local']:
+            error("object_store type must be minio or local")
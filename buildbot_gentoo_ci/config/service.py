@@ -1,8 +1,16 @@
 # Copyright 2021 Gentoo Authors
 # Distributed under the terms of the GNU General Public License v2
 
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
 from twisted.python import log
+from twisted.python import threadpool
 from twisted.internet import defer
+from twisted.internet import threads
+from twisted.internet import task
 
 from buildbot import config as master_config
 from buildbot.db import exceptions
@@ -12,6 +20,39 @@ from buildbot import version
 
 from buildbot_gentoo_ci.db import connector as dbconnector
 from buildbot_gentoo_ci.config import config
+from buildbot_gentoo_ci.utils.pattern import getCompiledPattern, getPatternDict
+from buildbot_gentoo_ci.utils.search_index import SearchIndex
+from buildbot_gentoo_ci.utils.object_store import getObjectStore
+from buildbot_gentoo_ci.utils.artifacts import ArtifactStore
+from buildbot_gentoo_ci.utils.log_result import readLogParserResult
+from buildbot_gentoo_ci.utils.compression import LogCompressor, ZSTD_LEVEL, ZSTD_THREADS, ZSTD_DICT_DAYS, ZSTD_LOG_DAYS
+
+# max threads for the log and file work on the master (result
+# documents, search index, zstd and the artifact store)
+LOG_PARSER_THREADS = 2
+# result documents we keep in memory, the log steps of a build use the
+# same result one after the other
+LOG_PARSER_RESULT_CACHE = 8
+# seconds we use the pattern version we have before we look in the db,
+# the master bump it when it change the pattern so that is only for
+# edits from the outside
+PATTERN_VERSION_CHECK = 60
+# days we keep builds in the search index, 0 = no index
+SEARCH_INDEX_DAYS = 0
+# seconds between we remove old builds from the search index
+SEARCH_INDEX_EXPIRE = 3600
+# seconds between we recompress the old build logs
+LOG_COMPRESS_EVERY = 3600
+# uploads to the object store at the same time and max uploads running
+# or waiting before putFileToObjectStore() wait
+OBJECT_STORE_THREADS = 2
+OBJECT_STORE_MAX_PENDING = 8
+# retrys and the seconds we wait before the first retry, doubled after
+# every retry
+OBJECT_STORE_RETRY = 3
+OBJECT_STORE_RETRY_DELAY = 5
+# seconds a presigned url is valid
+OBJECT_STORE_EXPIRES = 3600
 
 class GentooCiService(BuildbotService):
 
@@ -23,12 +64,22 @@ class GentooCiService(BuildbotService):
             master_config.error("Can't find buildbot.tac in basedir")
             return
 
-    @defer.inlineCallbacks
     def reconfigService(self, **kwargs):
+        # the pattern can have changed
+        self.log_search_pattern_cache = {}
+        self.log_search_pattern_version = None
         return defer.succeed(None)
 
     @defer.inlineCallbacks
     def startService(self):
+        self.log_parser_threadpool = None
+        self.object_store = None
+        self.object_store_threadpool = None
+        self.object_store_semaphore = None
+        self.log_search_pattern_cache = {}
+        self.log_search_pattern_version = None
+        self.log_search_pattern_checked = 0
+        self.log_parser_result_cache = OrderedDict()
         self.config_loader = config.FileLoader(self.basedir, 'gentooci.cfg')
         self.config = self.config_loader.loadConfig()
         self.db = dbconnector.DBConnector(self.basedir)
@@ -41,3 +92,188 @@ class GentooCiService(BuildbotService):
             # (message was already logged)
             self.master.reactor.stop()
             return
+        # the log parsing is cpu bound, run it in a thread pool so it don't
+        # block the reactor
+        self.log_parser_threadpool = threadpool.ThreadPool(
+                                        minthreads=0,
+                                        maxthreads=int(self.config.project['project'].get('log_parser_threads', LOG_PARSER_THREADS)),
+                                        name='gentooci-log-parser')
+        self.log_parser_threadpool.start()
+        # full-text index of the build summaries
+        self.search_index = None
+        self.search_index_expired = 0
+        if int(self.config.project['project'].get('search_index_days', SEARCH_INDEX_DAYS)) > 0:
+            try:
+                self.search_index = yield self.deferToLogParserThread(SearchIndex, os.path.join(self.basedir, 'search_index.sqlite'))
+            except sqlite3.OperationalError as e:
+                # the trigram tokenizer need sqlite 3.34 or newer
+                log.msg("Search index disabled, sqlite {} failed with: {}".format(sqlite3.sqlite_version, e))
+        # recompress the build logs with zstd and a dictionary trained on
+        # our logs
+        self.log_compressor = None
+        self.log_compressed = 0
+        self.log_compress_running = False
+        if self.config.project['project'].get('log_zstd', False):
+            self.log_compressor = LogCompressor(os.path.join(self.basedir, 'zstd'),
+                                        level=int(self.config.project['project'].get('log_zstd_level', ZSTD_LEVEL)),
+                                        threads=int(self.config.project['project'].get('log_zstd_threads', ZSTD_THREADS)),
+                                        dict_days=int(self.config.project['project'].get('log_zstd_dict_days', ZSTD_DICT_DAYS)))
+        # the files from the builds by sha256, remove the blobs we don't
+        # have any build dir for
+        self.artifact_store = ArtifactStore(os.path.join(self.basedir, 'artifacts'))
+        if self.config.project['project'].get('artifact_store', False):
+            removed = yield self.deferToLogParserThread(self.artifact_store.removeUnused)
+            log.msg("Removed {} unused blobs from the artifact store".format(removed))
+        # one object store client for all the uploads, the uploads is
+        # blocking so they run in a thread pool
+        if self.config.object_store.get('type') is not None:
+            self.object_store = getObjectStore(self.config.object_store, self.basedir)
+            self.object_store_threadpool = threadpool.ThreadPool(
+                                        minthreads=0,
+                                        maxthreads=int(self.config.object_store.get('upload_threads', OBJECT_STORE_THREADS)),
+                                        name='gentooci-object-store')
+            self.object_store_threadpool.start()
+            self.object_store_semaphore = defer.DeferredSemaphore(int(self.config.object_store.get('max_pending', OBJECT_STORE_MAX_PENDING)))
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        if self.log_parser_threadpool is not None:
+            # wait on the running parsers
+            self.log_parser_threadpool.stop()
+            self.log_parser_threadpool = None
+        if self.object_store_threadpool is not None:
+            # wait on the running uploads
+            self.object_store_threadpool.stop()
+            self.object_store_threadpool = None
+        yield super().stopService()
+
+    def deferToLogParserThread(self, f, *args, **kwargs):
+        # run f in the log parser thread pool, only maxthreads run at
+        # the same time and the rest wait in the queue
+        return threads.deferToThreadPool(self.master.reactor, self.log_parser_threadpool, f, *args, **kwargs)
+
+    @defer.inlineCallbacks
+    def getLogParserResult(self, result_file):
+        # (summary_log_dict, pattern_stats) of the result document, we read
+        # the file once for the build and the steps after get the cached
+        # one, don't change it
+        if result_file in self.log_parser_result_cache:
+            self.log_parser_result_cache.move_to_end(result_file)
+            return self.log_parser_result_cache[result_file]
+        result = yield self.deferToLogParserThread(readLogParserResult, result_file)
+        self.log_parser_result_cache[result_file] = result
+        while len(self.log_parser_result_cache) > LOG_PARSER_RESULT_CACHE:
+            self.log_parser_result_cache.popitem(last=False)
+        return result
+
+    @defer.inlineCallbacks
+    def putFileToObjectStore(self, bucket, target, filename):
+        # upload the file and retry if it fail, we wait here when
+        # max_pending uploads is running or waiting so the uploads
+        # can't take over the master
+        # return False if all the trys did fail
+        retry = int(self.config.object_store.get('retry', OBJECT_STORE_RETRY))
+        yield self.object_store_semaphore.acquire()
+        try:
+            for i in range(retry + 1):
+                try:
+                    yield threads.deferToThreadPool(self.master.reactor, self.object_store_threadpool, self.object_store.putFile, bucket, target, filename)
+                    return True
+                except FileNotFoundError as e:
+                    log.msg("Object store upload of {} failed: {}".format(filename, e))
+                    return False
+                except Exception as e:
+                    log.msg("Object store upload of {} failed ({}/{}): {}".format(filename, i + 1, retry + 1, e))
+                if i < retry:
+                    yield task.deferLater(self.master.reactor, OBJECT_STORE_RETRY_DELAY * 2 ** i, lambda: None)
+            return False
+        finally:
+            self.object_store_semaphore.release()
+
+    def getObjectStoreUploadUrl(self, bucket, target):
+        # presigned url so the worker can upload the file to the bucket
+        expires = int(self.config.object_store.get('presigned_expires', OBJECT_STORE_EXPIRES))
+        return threads.deferToThreadPool(self.master.reactor, self.object_store_threadpool, self.object_store.getPresignedPutUrl, bucket, target, expires)
+
+    def setSearchIndexBuild(self, build_id, project_uuid, cpv, summary_log_dict, log_lines=None):
+        # add or replace the build in the search index and remove the
+        # old builds now and then
+        days = int(self.config.project['project'].get('search_index_days', SEARCH_INDEX_DAYS))
+        def thd():
+            self.search_index.addBuild(build_id, project_uuid, cpv, summary_log_dict, log_lines=log_lines)
+            if time.monotonic() - self.search_index_expired > SEARCH_INDEX_EXPIRE:
+                self.search_index_expired = time.monotonic()
+                self.search_index.expire(days)
+        return self.deferToLogParserThread(thd)
+
+    def compressBuildLogs(self):
+        # recompress the old build logs now and then, return False if we
+        # don't, the build don't wait on it as it can take a while
+        if self.log_compress_running or time.monotonic() - self.log_compressed < LOG_COMPRESS_EVERY:
+            return False
+        self.log_compress_running = True
+        self.log_compressed = time.monotonic()
+        days = int(self.config.project['project'].get('log_zstd_days', ZSTD_LOG_DAYS))
+        d = self.deferToLogParserThread(self.log_compressor.compressOldLogs, os.path.join(self.basedir, 'workers'), days)
+        def done(compressed):
+            log.msg("Recompressed {} build logs with zstd".format(compressed))
+        def failed(failure):
+            log.err(failure, "Failed to recompress the build logs")
+        def finished(result):
+            self.log_compress_running = False
+        d.addCallbacks(done, failed)
+        d.addBoth(finished)
+        return True
+
+    def searchBuildLogs(self, text, project_uuid=None, days=None, log=False, limit=100, raw=False):
+        # lines in the build summaries (or the build logs if log) with
+        # text in them, newest build first
+        # [{ build_id, project_uuid, cpv, created_at, line_index, text }]
+        if self.search_index is None:
+            return defer.succeed([])
+        return self.deferToLogParserThread(self.search_index.search, text, project_uuid=project_uuid, days=days, log=log, limit=limit, raw=raw)
+
+    @defer.inlineCallbacks
+    def getLogSearchPattern(self, project_uuid, default_uuid):
+        # compiled log search pattern for the project and default project
+        # we make them once and use them until projects_pattern_version
+        # is bumped or we reconfig
+        version = yield self.getLogSearchPatternVersion()
+        cache_key = (project_uuid, default_uuid)
+        log_search_pattern = self.log_search_pattern_cache.get(cache_key)
+        if log_search_pattern is not None and log_search_pattern['version'] == version:
+            return log_search_pattern
+        project_pattern_list = getCompiledPattern((yield self.db.projects.getProjectLogSearchPatternByUuid(project_uuid)))
+        default_pattern_list = getCompiledPattern((yield self.db.projects.getProjectLogSearchPatternByUuid(default_uuid)))
+        log_search_pattern = {}
+        log_search_pattern['version'] = version
+        # we don't use the default pattern the project ignore
+        project_pattern_ignore = set(project_pattern['search'] for project_pattern in project_pattern_list if project_pattern['status'] == 'ignore')
+        default_pattern_list = [default_pattern for default_pattern in default_pattern_list if default_pattern['search'] not in project_pattern_ignore]
+        # the pattern by type for the pattern bundle
+        log_search_pattern['pattern_by_type'] = {}
+        log_search_pattern['pattern_by_type']['ignore'] = []
+        log_search_pattern['pattern_by_type']['default'] = []
+        log_search_pattern['pattern_by_type']['test'] = []
+        for search_pattern in project_pattern_list + default_pattern_list:
+            if search_pattern['type'] == 'ignore':
+                log_search_pattern['pattern_by_type']['ignore'].append(getPatternDict(search_pattern))
+            elif search_pattern['type'] == 'test':
+                log_search_pattern['pattern_by_type']['test'].append(getPatternDict(search_pattern))
+            else:
+                log_search_pattern['pattern_by_type']['default'].append(getPatternDict(search_pattern))
+        self.log_search_pattern_cache[cache_key] = log_search_pattern
+        return log_search_pattern
+
+    @defer.inlineCallbacks
+    def getLogSearchPatternVersion(self):
+        # the db version of the pattern, we only look it up every
+        # PATTERN_VERSION_CHECK seconds and not for every build
+        if self.log_search_pattern_version is None or time.monotonic() - self.log_search_pattern_checked > PATTERN_VERSION_CHECK:
+            self.log_search_pattern_version = yield self.db.projects.getProjectPatternVersion()
+            self.log_search_pattern_checked = time.monotonic()
+        return self.log_search_pattern_version
+
+    def setLogSearchPatternChanged(self):
+        # we did change the pattern, look up the version on the next build
+        self.log_search_pattern_version = None
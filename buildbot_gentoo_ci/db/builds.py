@@ -76,3 +76,56 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
                 conn.execute(q, updated_at=updated_at,
                                 buildbot_build_id=buildbot_build_id)
         yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def addBuildFingerprint(self, id, project_uuid, fingerprint, phase, error_line):
+        created_at = int(self.master.reactor.seconds())
+        def thd(conn, no_recurse=False):
+            tbl = self.db.model.projects_builds_fingerprint
+            q = tbl.insert()
+            conn.execute(q, dict(build_id=id,
+                                 project_uuid=project_uuid,
+                                 fingerprint=fingerprint,
+                                 phase=phase,
+                                 error_line=error_line,
+                                 created_at=created_at))
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def setBuildFingerprintBug(self, id, bug_id):
+        def thd(conn, no_recurse=False):
+            tbl = self.db.model.projects_builds_fingerprint
+            q = tbl.update()
+            q = q.where(tbl.c.build_id == id)
+            conn.execute(q, bug_id=bug_id)
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def getBuildsByFingerprint(self, fingerprint, package_uuid):
+        # the builds of the package that did fail with the same error,
+        # newest first
+        def thd(conn):
+            tbl = self.db.model.projects_builds_fingerprint
+            builds_tbl = self.db.model.projects_builds
+            versions_tbl = self.db.model.versions
+            q = sa.select([tbl])
+            q = q.select_from(tbl.join(builds_tbl, builds_tbl.c.id == tbl.c.build_id).join(versions_tbl, versions_tbl.c.uuid == builds_tbl.c.version_uuid))
+            q = q.where(tbl.c.fingerprint == fingerprint)
+            q = q.where(versions_tbl.c.package_uuid == package_uuid)
+            q = q.order_by(tbl.c.id.desc())
+            return [self._row2dict_projects_builds_fingerprint(conn, row)
+                for row in conn.execute(q).fetchall()]
+        res = yield self.db.pool.do(thd)
+        return res
+
+    def _row2dict_projects_builds_fingerprint(self, conn, row):
+        return dict(
+            id=row.id,
+            build_id=row.build_id,
+            project_uuid=row.project_uuid,
+            fingerprint=row.fingerprint,
+            phase=row.phase,
+            error_line=row.error_line,
+            bug_id=row.bug_id,
+            created_at=row.created_at
+            )
@@ -231,6 +231,25 @@ class Model(base.DBConnectorComponent):
         sa.Column('deleted_at', sa.Integer, nullable=True),
     )
 
+    # the error fingerprint for failed builds, sha256 of the phase and
+    # the first error line with paths, versions, line numbers and
+    # addresses masked
+    projects_builds_fingerprint = sautils.Table(
+        "projects_builds_fingerprint", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('build_id', sa.Integer,
+                  sa.ForeignKey('projects_builds.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('project_uuid', sa.String(36),
+                  sa.ForeignKey('projects.uuid', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('fingerprint', sa.String(64), nullable=False),
+        sa.Column('phase', sa.String(50), nullable=False),
+        sa.Column('error_line', sa.Text, nullable=True),
+        sa.Column('bug_id', sa.Integer, nullable=True),
+        sa.Column('created_at', sa.Integer, nullable=True),
+    )
+
     projects_pattern = sautils.Table(
         "projects_pattern", metadata,
         sa.Column('id', sa.Integer, primary_key=True),
@@ -245,6 +264,60 @@ class Model(base.DBConnectorComponent):
         sa.Column('search_type', sa.Enum('in', 'startswith', 'endswith', 'search'), default='in'),
     )
 
+    # bump version when projects_pattern change so the master
+    # make new compiled pattern
+    projects_pattern_version = sautils.Table(
+        "projects_pattern_version", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('version', sa.Integer, default=0),
+        sa.Column('updated_at', sa.Integer, nullable=True),
+    )
+
+    # evaluations, hits and match time in seconds from the log parser
+    projects_pattern_stats = sautils.Table(
+        "projects_pattern_stats", metadata,
+        sa.Column('pattern_id', sa.Integer,
+                  sa.ForeignKey('projects_pattern.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('evaluations', sa.BigInteger, default=0),
+        sa.Column('hits', sa.BigInteger, default=0),
+        sa.Column('match_time', sa.Float, default=0),
+        sa.Column('runs', sa.Integer, default=0),
+        sa.Column('updated_at', sa.Integer, nullable=True),
+        sa.Column('last_hit_at', sa.Integer, nullable=True),
+    )
+
+    # successful builds by project we have learned noise from
+    projects_pattern_noise_builds = sautils.Table(
+        "projects_pattern_noise_builds", metadata,
+        sa.Column('project_uuid', sa.String(36),
+                  sa.ForeignKey('projects.uuid', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('builds', sa.Integer, default=0),
+        sa.Column('updated_at', sa.Integer, nullable=True),
+    )
+
+    # templates of the auto info lines in the summary of successful
+    # builds, search is a regex for the template and builds the number
+    # of builds it was in since builds_first
+    projects_pattern_noise = sautils.Table(
+        "projects_pattern_noise", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_uuid', sa.String(36),
+                  sa.ForeignKey('projects.uuid', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('template_hash', sa.String(64), nullable=False),
+        sa.Column('search', sa.Text, nullable=False),
+        sa.Column('example', sa.Text, nullable=True),
+        sa.Column('builds', sa.Integer, default=0),
+        sa.Column('builds_first', sa.Integer, default=0),
+        sa.Column('status', sa.Enum('tracking', 'proposed', 'applied', 'rejected'), default='tracking'),
+        sa.Column('pattern_id', sa.Integer,
+                  sa.ForeignKey('projects_pattern.id', ondelete='SET NULL'),
+                  nullable=True),
+        sa.Column('last_seen_at', sa.Integer, nullable=True),
+    )
+
     projects_workers = sautils.Table(
         "projects_workers", metadata,
         sa.Column('id', sa.Integer, primary_key=True),
@@ -355,7 +428,14 @@ class Model(base.DBConnectorComponent):
     # Indexes
     # -------
 
-   
+    sa.Index('projects_builds_fingerprint_fingerprint',
+             projects_builds_fingerprint.c.fingerprint)
+    sa.Index('projects_builds_fingerprint_build_id',
+             projects_builds_fingerprint.c.build_id)
+    sa.Index('projects_pattern_noise_template',
+             projects_pattern_noise.c.project_uuid,
+             projects_pattern_noise.c.template_hash, unique=True)
+
 
     # MySQL creates indexes for foreign keys, and these appear in the
     # reflection.  This is a list of (table, index) names that should be
@@ -201,6 +201,179 @@ class ProjectsConnectorComponent(base.DBConnectorComponent):
         res = yield self.db.pool.do(thd)
         return res
 
+    @defer.inlineCallbacks
+    def getProjectPatternVersion(self):
+        def thd(conn):
+            tbl = self.db.model.projects_pattern_version
+            q = tbl.select()
+            q = q.where(tbl.c.id == 1)
+            res = conn.execute(q)
+            row = res.fetchone()
+            if not row:
+                return 0
+            return row.version
+        res = yield self.db.pool.do(thd)
+        return res
+
+    def _bumpProjectPatternVersion(self, conn, updated_at):
+        # in the same transaction as the change of projects_pattern
+        tbl = self.db.model.projects_pattern_version
+        q = tbl.update()
+        q = q.where(tbl.c.id == 1)
+        r = conn.execute(q.values(version=tbl.c.version + 1,
+                                updated_at=updated_at))
+        if r.rowcount == 0:
+            q = tbl.insert()
+            conn.execute(q, dict(id=1,
+                                version=1,
+                                updated_at=updated_at))
+
+    @defer.inlineCallbacks
+    def bumpProjectPatternVersion(self):
+        updated_at = int(self.master.reactor.seconds())
+        def thd(conn, no_recurse=False):
+            self._bumpProjectPatternVersion(conn, updated_at)
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def addProjectPatternStats(self, pattern_stats):
+        # pattern_stats is {pattern_id : [evaluations, hits, match_time]}
+        # from one log parser run, add it to the stats we have
+        updated_at = int(self.master.reactor.seconds())
+        def thd(conn, no_recurse=False):
+            # skip the pattern that is removed, a failed insert abort
+            # the transaction on PostgreSQL
+            pattern_tbl = self.db.model.projects_pattern
+            q = sa.select([pattern_tbl.c.id])
+            q = q.where(pattern_tbl.c.id.in_([int(pattern_id) for pattern_id in pattern_stats]))
+            pattern_ids = set(row.id for row in conn.execute(q).fetchall())
+            tbl = self.db.model.projects_pattern_stats
+            for pattern_id, stats in pattern_stats.items():
+                if int(pattern_id) not in pattern_ids:
+                    continue
+                evaluations, hits, match_time = stats
+                values = dict(evaluations=tbl.c.evaluations + evaluations,
+                                hits=tbl.c.hits + hits,
+                                match_time=tbl.c.match_time + match_time,
+                                runs=tbl.c.runs + 1,
+                                updated_at=updated_at)
+                if hits > 0:
+                    values['last_hit_at'] = updated_at
+                update_q = tbl.update()
+                update_q = update_q.where(tbl.c.pattern_id == int(pattern_id))
+                r = conn.execute(update_q.values(values))
+                if r.rowcount > 0:
+                    continue
+                try:
+                    # a other build can add the pattern at the same time
+                    with conn.begin_nested():
+                        q = tbl.insert()
+                        conn.execute(q, dict(pattern_id=int(pattern_id),
+                                             evaluations=evaluations,
+                                             hits=hits,
+                                             match_time=match_time,
+                                             runs=1,
+                                             updated_at=updated_at,
+                                             last_hit_at=updated_at if hits > 0 else None))
+                except sa.exc.IntegrityError:
+                    conn.execute(update_q.values(values))
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def addProjectNoiseBuild(self, project_uuid, template_dict):
+        # template_dict is {template_hash : (search, example)} for the
+        # auto info lines in one successful build
+        updated_at = int(self.master.reactor.seconds())
+        def thd(conn, no_recurse=False):
+            # insert first and update if a other build did add the row,
+            # a other build can add it at the same time
+            tbl = self.db.model.projects_pattern_noise_builds
+            try:
+                with conn.begin_nested():
+                    q = tbl.insert()
+                    conn.execute(q, dict(project_uuid=project_uuid,
+                                        builds=1,
+                                        updated_at=updated_at))
+            except sa.exc.IntegrityError:
+                q = tbl.update()
+                q = q.where(tbl.c.project_uuid == project_uuid)
+                conn.execute(q.values(builds=tbl.c.builds + 1,
+                                    updated_at=updated_at))
+            q = sa.select([tbl.c.builds]).where(tbl.c.project_uuid == project_uuid)
+            builds = conn.execute(q).fetchone().builds
+            tbl = self.db.model.projects_pattern_noise
+            for template_hash, template in template_dict.items():
+                try:
+                    with conn.begin_nested():
+                        q = tbl.insert()
+                        conn.execute(q, dict(project_uuid=project_uuid,
+                                            template_hash=template_hash,
+                                            search=template[0],
+                                            example=template[1],
+                                            builds=1,
+                                            builds_first=builds,
+                                            status='tracking',
+                                            last_seen_at=updated_at))
+                except sa.exc.IntegrityError:
+                    q = tbl.update()
+                    q = q.where(tbl.c.project_uuid == project_uuid)
+                    q = q.where(tbl.c.template_hash == template_hash)
+                    conn.execute(q.values(builds=tbl.c.builds + 1,
+                                        last_seen_at=updated_at))
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def getProjectNoiseCandidates(self, project_uuid, threshold, min_builds):
+        # the tracked templates that was in threshold (0-1) of the
+        # successful builds since we did see them the first time
+        def thd(conn):
+            tbl = self.db.model.projects_pattern_noise_builds
+            q = sa.select([tbl.c.builds]).where(tbl.c.project_uuid == project_uuid)
+            row = conn.execute(q).fetchone()
+            if not row:
+                return []
+            builds = row.builds
+            tbl = self.db.model.projects_pattern_noise
+            q = tbl.select()
+            q = q.where(tbl.c.project_uuid == project_uuid)
+            q = q.where(tbl.c.status == 'tracking')
+            q = q.where(tbl.c.builds >= min_builds)
+            noise_list = []
+            for row in conn.execute(q).fetchall():
+                if row.builds >= threshold * (builds - row.builds_first + 1):
+                    noise_list.append(self._row2dict_projects_pattern_noise(conn, row))
+            return noise_list
+        res = yield self.db.pool.do(thd)
+        return res
+
+    @defer.inlineCallbacks
+    def setProjectNoiseStatus(self, noise_id, status, pattern_id=None):
+        def thd(conn, no_recurse=False):
+            tbl = self.db.model.projects_pattern_noise
+            q = tbl.update()
+            q = q.where(tbl.c.id == noise_id)
+            conn.execute(q.values(status=status,
+                                pattern_id=pattern_id))
+        yield self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def addProjectPattern(self, project_uuid, search, search_type, status, type):
+        updated_at = int(self.master.reactor.seconds())
+        def thd(conn, no_recurse=False):
+            tbl = self.db.model.projects_pattern
+            q = tbl.insert()
+            r = conn.execute(q, dict(project_uuid=project_uuid,
+                                    search=search,
+                                    search_type=search_type,
+                                    start=0,
+                                    end=0,
+                                    status=status,
+                                    type=type))
+            self._bumpProjectPatternVersion(conn, updated_at)
+            return r.inserted_primary_key[0]
+        res = yield self.db.pool.do(thd)
+        return res
+
     @defer.inlineCallbacks
     def getWorkersByProjectUuid(self, uuid):
         def thd(conn):
@@ -299,6 +472,20 @@ class ProjectsConnectorComponent(base.DBConnectorComponent):
             preserved_libs=row.preserved_libs
             )
 
+    def _row2dict_projects_pattern_noise(self, conn, row):
+        return dict(
+            id=row.id,
+            project_uuid=row.project_uuid,
+            template_hash=row.template_hash,
+            search=row.search,
+            example=row.example,
+            builds=row.builds,
+            builds_first=row.builds_first,
+            status=row.status,
+            pattern_id=row.pattern_id,
+            last_seen_at=row.last_seen_at
+            )
+
     def _row2dict_projects_pattern(self, conn, row):
         return dict(
             id=row.id,
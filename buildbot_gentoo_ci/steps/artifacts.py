@@ -0,0 +1,77 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+from twisted.internet import defer
+
+from buildbot.process import remotecommand
+from buildbot.process.buildstep import BuildStep
+from buildbot.process.results import SUCCESS
+from buildbot.process.results import WARNINGS
+from buildbot.plugins import steps
+
+class UploadArtifact(BuildStep):
+
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = True
+    warnOnWarnings = True
+
+    def __init__(self, workersrc, masterdest, url=None, urlText=None, **kwargs):
+        self.workersrc = workersrc
+        self.masterdest = masterdest
+        self.url = url
+        self.urlText = urlText
+        super().__init__(**kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        # hash the file on the worker and only upload it if we don't
+        # have it in the artifact store
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        cmd = remotecommand.RemoteShellCommand('/', ['sha256sum', self.workersrc], collectStdout=True)
+        yield self.runCommand(cmd)
+        if not cmd.didFail() and cmd.stdout != '':
+            sha256 = cmd.stdout.split()[0]
+            linked = yield self.gentooci.deferToLogParserThread(self.gentooci.artifact_store.linkBlob, sha256, self.masterdest)
+            if linked:
+                if self.url is not None:
+                    yield self.addURL(self.urlText, self.url)
+                self.descriptionDone = 'Deduplicated'
+                return SUCCESS
+        # the worker send it and we add it to the store
+        aftersteps_list = []
+        aftersteps_list.append(steps.FileUpload(
+            name = self.name,
+            mode = 0o644,
+            workersrc = self.workersrc,
+            masterdest = self.masterdest,
+            url = self.url,
+            urlText = self.urlText
+        ))
+        aftersteps_list.append(AddArtifact(self.masterdest))
+        yield self.build.addStepsAfterCurrentStep(aftersteps_list)
+        return SUCCESS
+
+class AddArtifact(BuildStep):
+
+    name = 'AddArtifact'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = False
+    warnOnWarnings = True
+
+    def __init__(self, masterdest, **kwargs):
+        self.masterdest = masterdest
+        super().__init__(**kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        sha256 = yield self.gentooci.deferToLogParserThread(self.gentooci.artifact_store.addFile, self.masterdest)
+        if sha256 is None:
+            return WARNINGS
+        return SUCCESS
@@ -19,6 +19,8 @@ from bugz.log import log_error, log_info
 
 from portage.versions import cpv_getversion, pkgsplit, catpkgsplit
 
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
+
 # Origins: bugz.cli
 # Modifyed by Gentoo Authors.
 # main
@@ -83,28 +85,55 @@ class GetBugs(BuildStep):
 
     @defer.inlineCallbacks
     def find_match(self, buglist):
-        log = yield self.addLog('Bugs')
-        yield log.addStdout('Open Bugs\n')
-        match = False
-        for bug in buglist:
-            yield log.addStdout('Bug: ' + str(bug['id']) + ' Summary: ' + bug['summary'] +'\n')
-            if re.search(self.getProperty('error_dict')['title_issue'][:20], bug['summary']):
-                print('Bug found')
-                print(bug)
-                match = {}
-                match['id'] = bug['id']
-                match['summary'] = bug['summary']
-        if match:
-            yield log.addStdout('Match bug found\n')
-            yield log.addStdout('Bug: ' + str(match['id']) + ' Summary: ' + match['summary'] +'\n')
+        log = yield addBufferedLog(self, 'Bugs')
+        try:
+            yield log.addStdout('Open Bugs\n')
+            match = False
+            for bug in buglist:
+                yield log.addStdout('Bug: ' + str(bug['id']) + ' Summary: ' + bug['summary'] +'\n')
+                if re.search(self.getProperty('error_dict')['title_issue'][:20], bug['summary']):
+                    print('Bug found')
+                    print(bug)
+                    match = {}
+                    match['id'] = bug['id']
+                    match['summary'] = bug['summary']
+            if match:
+                yield log.addStdout('Match bug found\n')
+                yield log.addStdout('Bug: ' + str(match['id']) + ' Summary: ' + match['summary'] +'\n')
+                self.setProperty("bgo", match, 'bgo')
+                # so the next build with the same error fingerprint get the bug
+                yield self.gentooci.db.builds.setBuildFingerprintBug(self.getProperty('project_build_data')['id'], match['id'])
+                return
+            yield log.addStdout('NO Match bug found\n')
+            self.setProperty("bgo", False, 'bgo')
+        finally:
+            yield log.finish()
+
+    @defer.inlineCallbacks
+    def set_fingerprint_match(self, bug_id):
+        # we have a bug for the same failure in the package, no need
+        # to search bugzilla for it
+        log = yield addBufferedLog(self, 'Bugs')
+        try:
+            yield log.addStdout('Fingerprint bug found\n')
+            yield log.addStdout('Bug: ' + str(bug_id) + '\n')
+            match = {}
+            match['id'] = bug_id
+            match['summary'] = None
             self.setProperty("bgo", match, 'bgo')
-            return
-        yield log.addStdout('NO Match bug found\n')
-        self.setProperty("bgo", False, 'bgo')
+            yield self.gentooci.db.builds.setBuildFingerprintBug(self.getProperty('project_build_data')['id'], bug_id)
+        finally:
+            yield log.finish()
 
     @defer.inlineCallbacks
     def run(self):
-        # self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        # the bugs of the builds with the same error fingerprint in the
+        # package, newest first
+        fingerprint_bugs = self.getProperty('error_dict').get('fingerprint_bugs', [])
+        if fingerprint_bugs != []:
+            yield self.set_fingerprint_match(fingerprint_bugs[0])
+            return SUCCESS
         cpv = self.getProperty('error_dict')['cpv']
         c = yield catpkgsplit(cpv)[0]
         p = yield catpkgsplit(cpv)[1]
@@ -120,5 +149,5 @@ class GetBugs(BuildStep):
         print(args)
         buglist = search_bugz(args)
         print(buglist)
-        self.find_match(buglist)
+        yield self.find_match(buglist)
         return SUCCESS
@@ -19,9 +19,20 @@ from buildbot.process.results import SKIPPED
 from buildbot.process.results import WARNINGS
 from buildbot.plugins import steps, util
 
+from buildbot_gentoo_ci.steps import logs
+from buildbot_gentoo_ci.steps import minio
+from buildbot_gentoo_ci.steps import artifacts
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
+
 #FIXME: should be set in config
 hosturl = 'http://90.231.13.235:8000'
 
+# the build logs emerge make and where log_parser.py --follow (or -o
+# with log_parser_worker) write the result documents for them on the
+# build worker
+follow_log_dir = '/var/cache/portage/logs/build'
+follow_output_dir = '/tmp/log_parser'
+
 def PersOutputOfEmerge(rc, stdout, stderr):
     emerge_output = {}
     emerge_output['rc'] = rc
@@ -361,6 +372,31 @@ class RunEmerge(BuildStep):
         self.name = 'Setup emerge for ' + self.step + ' step'
         self.build_timeout = 0
 
+    @defer.inlineCallbacks
+    def getFollowSteps(self, project_data):
+        # parse the build logs on the worker while emerge is running
+        default_project_data = yield self.gentooci.db.projects.getProjectByName(self.gentooci.config.project['project']['update_db'])
+        bundle_file, mastersrc_bundle = yield logs.getPatternBundle(self.gentooci, self.master.basedir, project_data['uuid'], default_project_data['uuid'])
+        follow_steps_list = logs.getLogParserSteps(self.master.basedir, bundle_file, mastersrc_bundle)
+        command = []
+        command.append('python3')
+        command.append('log_parser.py')
+        command.append('--follow')
+        command.append(follow_log_dir)
+        command.append('-p')
+        command.append(os.path.join('patterns', bundle_file))
+        command.append('-o')
+        command.append(follow_output_dir)
+        if self.gentooci.config.project['project'].get('log_parser_pattern_stats', False):
+            command.append('-s')
+        follow_steps_list.append(steps.ShellCommand(
+                                                name = 'Start log parser follow',
+                                                haltOnFailure = False,
+                                                flunkOnFailure = False,
+                                                command=command
+                                                ))
+        return follow_steps_list
+
     @defer.inlineCallbacks
     def run(self):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
@@ -537,6 +573,10 @@ class RunEmerge(BuildStep):
             aftersteps_list.append(CheckEmergeLogs('pre-build'))
 
         if self.step == 'build':
+            log_parser_follow = self.gentooci.config.project['project'].get('log_parser_follow', False)
+            if log_parser_follow:
+                follow_steps_list = yield self.getFollowSteps(project_data)
+                aftersteps_list.extend(follow_steps_list)
             if projects_emerge_options['oneshot']:
                 shell_commad_list.append('-1')
             shell_commad_list.append('=' + self.getProperty('cpv'))
@@ -556,7 +596,19 @@ class RunEmerge(BuildStep):
                         extract_fn=PersOutputOfEmerge,
                         workdir='/',
                         env=self.getProperty("build_env"),
-                        timeout=self.build_timeout
+                        timeout=self.build_timeout,
+                        # stream the matches from the follower to the master
+                        logfiles={'live summary' : os.path.join(follow_output_dir, 'live.log')} if log_parser_follow else {},
+                        lazylogfiles=True
+                ))
+            if log_parser_follow:
+                # wait on the follower to parse the rest of the logs
+                aftersteps_list.append(steps.ShellCommand(
+                        name = 'Stop log parser follow',
+                        haltOnFailure = False,
+                        flunkOnFailure = False,
+                        alwaysRun = True,
+                        command=['python3', 'log_parser.py', '--follow-stop', '-o', follow_output_dir]
                 ))
             aftersteps_list.append(CheckEmergeLogs('build'))
             if projects_emerge_options['preserved_libs']:
@@ -579,6 +631,16 @@ class CheckElogLogs(BuildStep):
         self.aftersteps_list = []
 
     def addFileUploade(self, sourcefile, destfile, name, url, urlText):
+        # the elogs is often the same in many builds
+        if self.gentooci.config.project['project'].get('artifact_store', False):
+            self.aftersteps_list.append(artifacts.UploadArtifact(
+                sourcefile,
+                destfile,
+                name = name,
+                url = url,
+                urlText = urlText
+            ))
+            return
         self.aftersteps_list.append(steps.FileUpload(
             name = name,
             mode = 0o644,
@@ -590,6 +652,7 @@ class CheckElogLogs(BuildStep):
 
     @defer.inlineCallbacks
     def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
         elog_ls_output = self.getProperty('elog_ls_output')
         workdir = yield os.path.join('/', 'var', 'cache', 'portage', 'logs', 'elog')
         for elogfile in elog_ls_output['elog_ls']:
@@ -625,13 +688,24 @@ class CheckBuildWorkDirs(BuildStep):
     def run(self):
         cpv = self.getProperty('faild_cpv')
         cpv_build_dir = yield os.path.join('/', 'var', 'tmp', 'portage', self.getProperty('cpv_build_dir'))
-        compressed_log_file = cpv.replace('/', '_') + '.' + str(self.getProperty("buildnumber")) + '.logs.tar.bz2'
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        # zstd use all the cpus and is a lot faster then bzip2
+        log_zstd = self.gentooci.config.project['project'].get('log_zstd', False)
+        if log_zstd:
+            compressed_log_file = cpv.replace('/', '_') + '.' + str(self.getProperty("buildnumber")) + '.logs.tar.zst'
+        else:
+            compressed_log_file = cpv.replace('/', '_') + '.' + str(self.getProperty("buildnumber")) + '.logs.tar.bz2'
         masterdest_file = yield os.path.join(self.getProperty('masterdest'), compressed_log_file)
         # cpv_build_work_dir = yield os.path.join(cpv_build_dir, 'work')
         if self.getProperty('build_workdir_find_output')['build_workdir_find'] != []:
             shell_commad_list = []
             shell_commad_list.append('tar')
-            shell_commad_list.append('-cjpf')
+            if log_zstd:
+                shell_commad_list.append('-I')
+                shell_commad_list.append('zstd -T0 -' + str(self.gentooci.config.project['project'].get('log_zstd_level', 10)))
+                shell_commad_list.append('-cpf')
+            else:
+                shell_commad_list.append('-cjpf')
             shell_commad_list.append(compressed_log_file)
             for find_line in sorted(self.getProperty('build_workdir_find_output')['build_workdir_find']):
                 print(find_line)
@@ -671,6 +745,7 @@ class CheckEmergeLogs(BuildStep):
         self.aftersteps_list = []
         self.log_data = {}
         self.faild_cpv = False
+        self.log_parser_bundle = None
 
     @defer.inlineCallbacks
     def getVersionData(self, cpv):
@@ -693,7 +768,19 @@ class CheckEmergeLogs(BuildStep):
         if not Path(check_dir).is_dir():
             yield Path(check_dir).mkdir(parents=True)
 
-    def addFileUploade(self, sourcefile, destfile, name, url, urlText):
+    def addFileUploade(self, sourcefile, destfile, name, url, urlText, artifact=True):
+        # emerge_info.txt, emerge.log and world is often the same in many
+        # builds on the same image, the worker send the sha256 first and
+        # we only upload files we don't have in the artifact store
+        if artifact and self.gentooci.config.project['project'].get('artifact_store', False):
+            self.aftersteps_list.append(artifacts.UploadArtifact(
+                sourcefile,
+                destfile,
+                name = name,
+                url = url,
+                urlText = urlText
+            ))
+            return
         self.aftersteps_list.append(steps.FileUpload(
             name = name,
             mode = 0o644,
@@ -711,7 +798,60 @@ class CheckEmergeLogs(BuildStep):
         name = 'Upload build log'
         url = '/'.join([hosturl, self.getProperty('workername'), str(self.getProperty("buildnumber")), file])
         urlText = file
-        self.addFileUploade(sourcefile, destfile, name, url, urlText)
+        # the build log is never the same
+        self.addFileUploade(sourcefile, destfile, name, url, urlText, artifact=False)
+        # the build worker upload the log to the object store
+        if self.gentooci.config.object_store.get('presigned', False):
+            bucket = self.getProperty('project_data')['uuid'] + '-' + 'logs'
+            self.aftersteps_list.append(minio.putFileToMinioFromWorker(sourcefile, file, bucket))
+        # parse the log on the build worker after emerge so the master
+        # don't need to send it to a log worker
+        if self.gentooci.config.project['project'].get('log_parser_worker', False) and not self.gentooci.config.project['project'].get('log_parser_follow', False):
+            yield self.getLogParserSteps(file, sourcefile, destfile)
+        # the result document from log_parser.py --follow or -o, if we
+        # don't have it the log is parsed by parse_build_log
+        if self.gentooci.config.project['project'].get('log_parser_follow', False) or self.gentooci.config.project['project'].get('log_parser_worker', False):
+            self.aftersteps_list.append(steps.FileUpload(
+                name = 'Upload log parser result',
+                mode = 0o644,
+                haltOnFailure = False,
+                flunkOnFailure = False,
+                workersrc = os.path.join(follow_output_dir, file + '.summary.gz'),
+                masterdest = destfile + '.summary.gz'
+            ))
+
+    @defer.inlineCallbacks
+    def getLogParserSteps(self, file, sourcefile, destfile):
+        project_data = self.getProperty('project_data')
+        # the pattern bundle and log_parser.py is only downloaded once
+        if self.log_parser_bundle is None:
+            default_project_data = yield self.gentooci.db.projects.getProjectByName(self.gentooci.config.project['project']['update_db'])
+            bundle_file, mastersrc_bundle = yield logs.getPatternBundle(self.gentooci, self.master.basedir, project_data['uuid'], default_project_data['uuid'])
+            self.aftersteps_list.extend(logs.getLogParserSteps(self.master.basedir, bundle_file, mastersrc_bundle))
+            self.aftersteps_list.append(steps.MakeDirectory(dir=os.path.basename(follow_output_dir),
+                                workdir=os.path.dirname(follow_output_dir)))
+            self.log_parser_bundle = bundle_file
+        command = []
+        command.append('python3')
+        command.append('log_parser.py')
+        command.append('-f')
+        command.append(sourcefile)
+        command.append('-u')
+        command.append(project_data['uuid'])
+        command.append('-p')
+        command.append(os.path.join('patterns', self.log_parser_bundle))
+        command.append('-o')
+        command.append(os.path.join(follow_output_dir, file + '.summary.gz'))
+        if self.gentooci.config.project['project'].get('log_parser_pattern_stats', False):
+            command.append('-s')
+        # parse_build_log parse the log if this fail
+        self.aftersteps_list.append(steps.ShellCommand(
+            name = 'Run log parser',
+            haltOnFailure = False,
+            flunkOnFailure = False,
+            command = command,
+            timeout = 3600
+        ))
 
     @defer.inlineCallbacks
     def getElogFiles(self, cpv):
@@ -829,29 +969,32 @@ class CheckEmergeLogs(BuildStep):
                     separator = '\n'
                     separator2 = ' '
                     change_use_list = []
-                    log = yield self.addLog('change_use')
-                    for cpv, v in emerge_output['change_use'].items():
-                        c = yield catpkgsplit(cpv)[0]
-                        p = yield catpkgsplit(cpv)[1]
-                        change_use_list.append(c + '/' + p)
-                        for use_flag in v:
-                            if use_flag.startswith('+'):
-                                change_use_list.append(use_flag.replace('+', ''))
-                            else:
-                                change_use_list.append(use_flag)
-                    change_use_string = separator2.join(change_use_list)
-                    self.aftersteps_list.append(
-                        steps.StringDownload(change_use_string + separator,
-                            name = 'Update package.use flags',
-                            workerdest='zz_autouse' + str(self.getProperty('rerun')),
-                            workdir='/etc/portage/package.use/'
+                    log = yield addBufferedLog(self, 'change_use')
+                    try:
+                        for cpv, v in emerge_output['change_use'].items():
+                            c = yield catpkgsplit(cpv)[0]
+                            p = yield catpkgsplit(cpv)[1]
+                            change_use_list.append(c + '/' + p)
+                            for use_flag in v:
+                                if use_flag.startswith('+'):
+                                    change_use_list.append(use_flag.replace('+', ''))
+                                else:
+                                    change_use_list.append(use_flag)
+                        change_use_string = separator2.join(change_use_list)
+                        self.aftersteps_list.append(
+                            steps.StringDownload(change_use_string + separator,
+                                name = 'Update package.use flags',
+                                workerdest='zz_autouse' + str(self.getProperty('rerun')),
+                                workdir='/etc/portage/package.use/'
+                                )
                             )
-                        )
-                    yield log.addStdout('File: ' + 'zz_autouse' + str(self.getProperty('rerun')) + '\n')
-                    yield log.addStdout(change_use_string + '\n')
-                    # rerun
-                    self.aftersteps_list.append(RunEmerge(step='pre-build'))
-                    self.setProperty('rerun', self.getProperty('rerun') + 1, 'rerun')
+                        yield log.addStdout('File: ' + 'zz_autouse' + str(self.getProperty('rerun')) + '\n')
+                        yield log.addStdout(change_use_string + '\n')
+                        # rerun
+                        self.aftersteps_list.append(RunEmerge(step='pre-build'))
+                        self.setProperty('rerun', self.getProperty('rerun') + 1, 'rerun')
+                    finally:
+                        yield log.finish()
 
                 # * Error: circular dependencies:
                 if emerge_output['circular_deps'] is True:
@@ -1242,64 +1385,67 @@ class SetupStepts(BuildStep):
         projectrepository_data = self.getProperty('projectrepository_data')
         build = False
         aftersteps_list = []
-        log = yield self.addLog('match')
-        package_dict = self.getProperty('emerge_output')['packages']
-        stderr = self.getProperty('emerge_output')['stderr']
-        print(self.getProperty('cpv_build'))
-        print(package_dict)
-        print(stderr)
-        c = yield catpkgsplit(self.getProperty("cpv"))[0]
-        p = yield catpkgsplit(self.getProperty("cpv"))[1]
-        cp = c + '/' + p
-        yield log.addStdout('Package to match: ' + self.getProperty('cpv') + '\n')
-        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
-        packages_excludes = yield self.gentooci.db.projects.getProjectPortagePackageByUuidAndExclude(self.getProperty('project_data')['uuid'])
-        # Check if package is on the exclude list
-        if packages_excludes != []:
-            print(packages_excludes)
-            for package_exclude in packages_excludes:
-                if '/' in package_exclude['package']:
-                    if package_exclude['package'] == c + '/' + p:
-                        yield log.addStdout('Package ' + package_exclude['package'] + ' is in exclude list\n')
-                        yield log.addStdout('Runing Update: NO\n')
-                        yield log.addStdout('Runing Pkgcheck: NO\n')
-                        yield log.addStdout('Runing Build: NO\n')
-                        return SKIPPED
-        if not self.getProperty('cpv_build'):
-            # check what version
-            if package_dict == {}:
-                yield log.addStdout('No package to match\n')
-            else:
-                for cpv, v in package_dict.items():
-                    if re.search(cp, cpv):
-                        yield log.addStdout('Got'  + cpv + '\n')
-                        yield log.addStdout('Match: NO\n')
-            # check for error
-            if stderr != []:
-                yield log.addStdout('Error: YES\n')
-                for error in stderr:
-                    yield log.addStdout(error + '\n')
-                return WARNINGS
-            else:
-                yield log.addStdout('Error: NO\n')
-            return SKIPPED
-        build = True
-        yield log.addStdout('Got ' + self.getProperty("cpv") + '\n')
-        yield log.addStdout('Match: YES\n')
-        # update packages before any tests
-        if build:
-            yield log.addStdout('Runing Update: YES\n')
-            aftersteps_list.append(RunUpdate())
-        if projectrepository_data['pkgcheck']:
-            yield log.addStdout('Runing Pkgcheck: YES\n')
-            aftersteps_list.append(RunPkgCheck())
-        if build:
-            yield log.addStdout('Runing Build: YES\n')
-            aftersteps_list.append(RunBuild())
-        # run eclean pkg and dist
-        #if build:
-        #f.addStep(builders.RunEclean(step='pkg')
-        #f.addStep(builders.RunEclean(step='dist')
-        if aftersteps_list != []:
-            yield self.build.addStepsAfterCurrentStep(aftersteps_list)
-        return SUCCESS
+        log = yield addBufferedLog(self, 'match')
+        try:
+            package_dict = self.getProperty('emerge_output')['packages']
+            stderr = self.getProperty('emerge_output')['stderr']
+            print(self.getProperty('cpv_build'))
+            print(package_dict)
+            print(stderr)
+            c = yield catpkgsplit(self.getProperty("cpv"))[0]
+            p = yield catpkgsplit(self.getProperty("cpv"))[1]
+            cp = c + '/' + p
+            yield log.addStdout('Package to match: ' + self.getProperty('cpv') + '\n')
+            self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+            packages_excludes = yield self.gentooci.db.projects.getProjectPortagePackageByUuidAndExclude(self.getProperty('project_data')['uuid'])
+            # Check if package is on the exclude list
+            if packages_excludes != []:
+                print(packages_excludes)
+                for package_exclude in packages_excludes:
+                    if '/' in package_exclude['package']:
+                        if package_exclude['package'] == c + '/' + p:
+                            yield log.addStdout('Package ' + package_exclude['package'] + ' is in exclude list\n')
+                            yield log.addStdout('Runing Update: NO\n')
+                            yield log.addStdout('Runing Pkgcheck: NO\n')
+                            yield log.addStdout('Runing Build: NO\n')
+                            return SKIPPED
+            if not self.getProperty('cpv_build'):
+                # check what version
+                if package_dict == {}:
+                    yield log.addStdout('No package to match\n')
+                else:
+                    for cpv, v in package_dict.items():
+                        if re.search(cp, cpv):
+                            yield log.addStdout('Got'  + cpv + '\n')
+                            yield log.addStdout('Match: NO\n')
+                # check for error
+                if stderr != []:
+                    yield log.addStdout('Error: YES\n')
+                    for error in stderr:
+                        yield log.addStdout(error + '\n')
+                    return WARNINGS
+                else:
+                    yield log.addStdout('Error: NO\n')
+                return SKIPPED
+            build = True
+            yield log.addStdout('Got ' + self.getProperty("cpv") + '\n')
+            yield log.addStdout('Match: YES\n')
+            # update packages before any tests
+            if build:
+                yield log.addStdout('Runing Update: YES\n')
+                aftersteps_list.append(RunUpdate())
+            if projectrepository_data['pkgcheck']:
+                yield log.addStdout('Runing Pkgcheck: YES\n')
+                aftersteps_list.append(RunPkgCheck())
+            if build:
+                yield log.addStdout('Runing Build: YES\n')
+                aftersteps_list.append(RunBuild())
+            # run eclean pkg and dist
+            #if build:
+            #f.addStep(builders.RunEclean(step='pkg')
+            #f.addStep(builders.RunEclean(step='dist')
+            if aftersteps_list != []:
+                yield self.build.addStepsAfterCurrentStep(aftersteps_list)
+            return SUCCESS
+        finally:
+            yield log.finish()
@@ -2,9 +2,6 @@
 # Distributed under the terms of the GNU General Public License v2
 
 import os
-import re
-import gzip
-import io
 import hashlib
 import json
 
@@ -23,27 +20,113 @@ from buildbot.plugins import steps
 from buildbot_gentoo_ci.steps import minio
 from buildbot_gentoo_ci.steps import master as master_steps
 from buildbot_gentoo_ci.steps import bugs
-
-def PersOutputOfLogParser(rc, stdout, stderr):
-    build_summery_output = {}
-    build_summery_output['rc'] = rc
-    summary_log_dict = {}
-    # split the lines
-    for line in stdout.split('\n'):
-        #FIXME: check if line start with {"[1-9]": {
-        if line.startswith('{'):
-            for k, v in json.loads(line).items():
-                summary_log_dict[int(k)] = {
-                                    'text' : v['text'],
-                                    'type' : v['type'],
-                                    'status' : v['status'],
-                                    'id' : v['id'],
-                                    'search_pattern' : v['search_pattern']
-                                    }
-    build_summery_output['summary_log_dict'] = summary_log_dict
-    #FIXME: Handling of stderr output
+from buildbot_gentoo_ci.utils.pattern import getNoiseSearch
+from buildbot_gentoo_ci.utils import log_format
+from buildbot_gentoo_ci.utils.log_format import ANSI_ESCAPE_RE, PATTERN_BUNDLE_VERSION
+from buildbot_gentoo_ci.utils.fingerprint import getErrorFingerprint, getErrorPhase, getErrorTitle, NO_ERROR_TITLE
+from buildbot_gentoo_ci.utils.compression import openBuildLog, getBuildLogFile, LogCompressor
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
+
+# bytes of the build log we read and filter at once
+READ_SIZE = 1024 * 1024
+
+# the share of the successful builds a auto info line template need to
+# be in and the min builds before it is noise
+NOISE_THRESHOLD = 0.9
+NOISE_BUILDS = 20
+# max chars of projects_pattern search
+PATTERN_SEARCH_SIZE = 50
+# the logparser.json settings log_parser.py use on the workers
+WORKER_LOG_PARSER_CONFIG = ['core', 'chunk', 'socket', 'daemon_timeout', 'follow_chunk', 'follow_timeout']
+
+@defer.inlineCallbacks
+def getPatternBundle(gentooci, basedir, project_uuid, default_uuid):
+    # write the pattern bundle for the project if we don't have it
+    # the file is named after the sha256 of the content
+    log_search_pattern = yield gentooci.getLogSearchPattern(project_uuid, default_uuid)
+    # we make the bundle once for the cached pattern
+    if 'bundle' not in log_search_pattern:
+        bundle = {}
+        bundle['version'] = PATTERN_BUNDLE_VERSION
+        bundle['project_uuid'] = project_uuid
+        bundle['default_uuid'] = default_uuid
+        bundle['log_search_pattern'] = log_search_pattern['pattern_by_type']
+        bundle_data = json.dumps(bundle, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        log_search_pattern['bundle'] = (hashlib.sha256(bundle_data).hexdigest() + '.json', bundle_data)
+    bundle_file, bundle_data = log_search_pattern['bundle']
+    bundle_dir = yield os.path.join(basedir, 'patterns')
+    mastersrc_bundle = yield os.path.join(bundle_dir, bundle_file)
+    if not os.path.isfile(mastersrc_bundle):
+        os.makedirs(bundle_dir, exist_ok=True)
+        with open(mastersrc_bundle + '.tmp', 'wb') as f:
+            f.write(bundle_data)
+        os.replace(mastersrc_bundle + '.tmp', mastersrc_bundle)
+    return bundle_file, mastersrc_bundle
+
+def getWorkerLogParserConfig(basedir, config_log_py):
+    # the log parser config for the workers, only the settings they use
+    # so the db url and password and what we add later stay on the master,
+    # they get the pattern in the bundle and never open the db
+    with open(os.path.join(basedir, config_log_py), encoding='utf-8') as f:
+        config = json.load(f)
+    return json.dumps({ key : value for key, value in config.items() if key in WORKER_LOG_PARSER_CONFIG })
+
+def getLogParserSteps(basedir, bundle_file, mastersrc_bundle):
+    # the steps to upload the log parser, the config and the pattern
+    # bundle to the worker
+    log_py = 'log_parser.py'
+    config_log_py = 'logparser.json'
+    workerdest_bundle = os.path.join('patterns', bundle_file)
+    steps_list = []
+    # Upload log parser py code
+    steps_list.append(steps.FileDownload(
+                                        mastersrc=os.path.join(basedir, log_py),
+                                        workerdest=log_py
+                                        ))
+    # Upload the formats log_parser.py share with the master
+    steps_list.append(steps.FileDownload(
+                                        mastersrc=log_format.__file__,
+                                        workerdest='log_format.py'
+                                        ))
+    # Upload log parser py config, it replace a old one with the db in it
+    steps_list.append(steps.StringDownload(
+                                        getWorkerLogParserConfig(basedir, config_log_py),
+                                        name = 'Upload log parser config',
+                                        workerdest=config_log_py
+                                        ))
+    # Upload the pattern bundle if the worker don't have it
+    steps_list.append(steps.SetPropertyFromCommand(
+                                                name = 'Check pattern bundle',
+                                                command=['test', '-f', workerdest_bundle],
+                                                extract_fn=PersOutputOfPatternBundle,
+                                                decodeRC={0 : SUCCESS, 1 : SUCCESS}
+                                                ))
+    steps_list.append(steps.FileDownload(
+                                        name = 'Upload pattern bundle',
+                                        mastersrc=mastersrc_bundle,
+                                        workerdest=workerdest_bundle,
+                                        doStepIf=lambda step: not step.getProperty('pattern_bundle_cached'),
+                                        hideStepIf=lambda results, step: results == SKIPPED
+                                        ))
+    return steps_list
+
+def getLogTextLines(file_path, dict_dir):
+    # (index, text) for the lines in the build log without the ansi
+    # escape sequences, index start at 1 as in the summary
+    index = 1
+    with openBuildLog(file_path, dict_dir) as f:
+        while True:
+            text_lines = f.readlines(READ_SIZE)
+            if text_lines == []:
+                break
+            for text_line in ANSI_ESCAPE_RE.sub(b'', b''.join(text_lines)).splitlines():
+                yield index, text_line.decode('utf-8', errors='replace')
+                index = index + 1
+
+def PersOutputOfPatternBundle(rc, stdout, stderr):
+    # test -f rc
     return {
-        'build_summery_output' : build_summery_output
+        'pattern_bundle_cached' : rc == 0
         }
 
 def PersOutputOfEmergeInfo(rc, stdout, stderr):
@@ -108,46 +191,79 @@ class SetupParserBuildLoger(BuildStep):
 
     @defer.inlineCallbacks
     def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
         self.aftersteps_list = []
         workdir = yield os.path.join(self.master.basedir, 'workers', self.getProperty('build_workername'), str(self.getProperty("project_build_data")['buildbot_build_id']))
         log_cpv = self.getProperty('log_build_data')[self.getProperty('log_cpv')]
-        mastersrc_log = yield os.path.join(workdir, log_cpv['full_logname'])
+        # the .log.zst if the master have recompressed the log
+        mastersrc_log = yield getBuildLogFile(os.path.join(workdir, log_cpv['full_logname']))
+        workerdest_log = os.path.basename(mastersrc_log)
+        # the log parser write the result document to this file
+        result_file = log_cpv['full_logname'] + '.summary.gz'
+        masterdest_result = yield os.path.join(workdir, result_file)
+        self.setProperty('log_parser_result', masterdest_result, 'log_parser_result')
+        # the build worker did parse the log while emerge was running
+        if os.path.isfile(masterdest_result):
+            self.descriptionDone = 'Log parsed on the build worker'
+            return SUCCESS
         log_py = 'log_parser.py'
-        config_log_py = 'logparser.json'
-        mastersrc_py = yield os.path.join(self.master.basedir, log_py)
-        mastersrc_config = yield os.path.join(self.master.basedir, config_log_py)
+        bundle_file, mastersrc_bundle = yield getPatternBundle(self.gentooci, self.master.basedir, self.getProperty('project_data')['uuid'], self.getProperty('default_project_data')['uuid'])
+        workerdest_bundle = yield os.path.join('patterns', bundle_file)
         # Upload logfile to worker
         self.aftersteps_list.append(steps.FileDownload(
                                                     mastersrc=mastersrc_log,
-                                                    workerdest=log_cpv['full_logname']
+                                                    workerdest=workerdest_log
                                                     ))
-        # Upload log parser py code
-        self.aftersteps_list.append(steps.FileDownload(
-                                                    mastersrc=mastersrc_py,
-                                                    workerdest=log_py
+        self.aftersteps_list.extend(getLogParserSteps(self.master.basedir, bundle_file, mastersrc_bundle))
+        # and the zstd dictionary the log was compressed with
+        workerdest_dict_dir = 'zstd'
+        if mastersrc_log.endswith('.zst'):
+            mastersrc_dict = yield LogCompressor(os.path.join(self.master.basedir, 'zstd')).getDictionaryFile(mastersrc_log)
+            if mastersrc_dict is not None:
+                self.aftersteps_list.append(steps.FileDownload(
+                                                    name = 'Upload zstd dictionary',
+                                                    mastersrc=mastersrc_dict,
+                                                    workerdest=os.path.join(workerdest_dict_dir, os.path.basename(mastersrc_dict))
                                                     ))
-        # Upload log parser py config
-        self.aftersteps_list.append(steps.FileDownload(
-                                                    mastersrc=mastersrc_config,
-                                                    workerdest=config_log_py
+        # Start the log parser daemon if it is not running
+        self.aftersteps_list.append(steps.ShellCommand(
+                                                    name = 'Start log parser daemon',
+                                                    haltOnFailure = False,
+                                                    flunkOnFailure = False,
+                                                    command=['python3', log_py, '--daemon']
                                                     ))
         # Run the log parser code
         command = []
         command.append('python3')
         command.append(log_py)
         command.append('-f')
-        command.append(log_cpv['full_logname'])
+        command.append(workerdest_log)
+        command.append('--zstd-dict-dir')
+        command.append(workerdest_dict_dir)
         command.append('-u')
         command.append(self.getProperty('project_data')['uuid'])
-        self.aftersteps_list.append(steps.SetPropertyFromCommand(
-                                                            name = 'RunBuildLogParser',
-                                                            haltOnFailure = True,
-                                                            flunkOnFailure = True,
-                                                            command=command,
-                                                            strip=False,
-                                                            extract_fn=PersOutputOfLogParser,
-                                                            timeout=3600
-                                                            ))
+        command.append('-p')
+        command.append(workerdest_bundle)
+        command.append('-o')
+        command.append(result_file)
+        # collect evaluations, hits and match time for the pattern
+        if self.gentooci.config.project['project'].get('log_parser_pattern_stats', False):
+            command.append('-s')
+        self.aftersteps_list.append(steps.ShellCommand(
+                                                    name = 'RunBuildLogParser',
+                                                    haltOnFailure = True,
+                                                    flunkOnFailure = True,
+                                                    command=command,
+                                                    timeout=3600
+                                                    ))
+        # Download the result document to the master
+        self.aftersteps_list.append(steps.FileUpload(
+                                                    name = 'Download log parser result',
+                                                    haltOnFailure = True,
+                                                    flunkOnFailure = True,
+                                                    workersrc=result_file,
+                                                    masterdest=masterdest_result
+                                                    ))
         yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
         return SUCCESS
 
@@ -161,147 +277,38 @@ class ParserBuildLog(BuildStep):
     flunkOnFailure = True
 
     def __init__(self, **kwargs):
-        self.logfile_text_dict = {}
-        self.summery_dict = {}
-        self.index = 1
-        self.log_search_pattern_list = []
-        self.max_text_lines = 0
         super().__init__(**kwargs)
 
-    #FIXME: ansifilter
-    def ansiFilter(self, text):
-        return text
-
     @defer.inlineCallbacks
-    def get_log_search_pattern(self):
-        # get pattern from the projects
-        # add that to log_search_pattern_list
-        for project_pattern in (yield self.gentooci.db.projects.getProjectLogSearchPatternByUuid(self.getProperty('project_data')['uuid'])):
-            # check if the search pattern is vaild
-            try:
-                re.compile(project_pattern['search'])
-            except re.error:
-                print("Non valid regex pattern")
-                print(project_pattern)
-            else:
-                self.log_search_pattern_list.append(project_pattern)
-        # get the default project pattern
-        # add if not pattern is in project ignore
-        self.project_pattern_ignore = yield self.gentooci.db.projects.getProjectLogSearchPatternByUuidAndIgnore(self.getProperty('project_data')['uuid'])
-        for project_pattern in (yield self.gentooci.db.projects.getProjectLogSearchPatternByUuid(self.getProperty('default_project_data')['uuid'])):
-            if not project_pattern['search'] in self.project_pattern_ignore:
-                # check if the search pattern is vaild
-                try:
-                    re.compile(project_pattern['search'])
-                except re.error:
-                    print("Non valid regex pattern")
-                    print(project_pattern)
-                else:
-                    self.log_search_pattern_list.append(project_pattern)
-
-    def search_buildlog(self, tmp_index):
-        # get text line to search
-        text_line = self.ansiFilter(self.logfile_text_dict[tmp_index])
-        # loop true the pattern list for match
-        for search_pattern in self.log_search_pattern_list:
-            search_hit = False
-            if search_pattern['search_type'] == 'in':
-                if search_pattern['search'] in text_line:
-                    search_hit = True
-            if search_pattern['search_type'] == 'startswith':
-                if text_line.startswith(search_pattern['search']):
-                    search_hit = True
-            if search_pattern['search_type'] == 'endswith':
-                if text_line.endswith(search_pattern['search']):
-                    search_hit = True
-            if search_pattern['search_type'] == 'search':
-                if re.search(search_pattern['search'], text_line):
-                    search_hit = True
-            # add the line if the pattern match
-            if search_hit:
-                print(text_line)
-                print(search_pattern)
-                print(tmp_index)
-                self.summery_dict[tmp_index] = {}
-                self.summery_dict[tmp_index]['text'] = text_line
-                self.summery_dict[tmp_index]['type'] = search_pattern['type']
-                self.summery_dict[tmp_index]['status'] = search_pattern['status']
-                self.summery_dict[tmp_index]['search_pattern_id'] = search_pattern['id']
-                # add upper text lines if requested
-                # max 5
-                if search_pattern['start'] != 0:
-                    i = tmp_index - search_pattern['start'] - 1
-                    match = True
-                    while match:
-                        i = i + 1
-                        if i < (tmp_index - 9) or i == tmp_index:
-                            match = False
-                        else:
-                            if not i in self.summery_dict:
-                                self.summery_dict[i] = {}
-                                self.summery_dict[i]['text'] = self.ansiFilter(self.logfile_text_dict[i])
-                                self.summery_dict[i]['type'] = 'info'
-                                self.summery_dict[i]['status'] = 'info'
-                # add lower text lines if requested
-                # max 5
-                if search_pattern['end'] != 0:
-                    i = tmp_index
-                    end = tmp_index + search_pattern['end']
-                    match = True
-                    while match:
-                        i = i + 1
-                        if i > self.max_text_lines or i > end:
-                            match = False
-                        else:
-                            if not i in self.summery_dict:
-                                self.summery_dict[i] = {}
-                                self.summery_dict[i]['text'] = self.ansiFilter(self.logfile_text_dict[i])
-                                self.summery_dict[i]['type'] = 'info'
-                                self.summery_dict[i]['status'] = 'info'
-            else:
-                # we add all line that start with ' * ' as info
-                # we add all line that start with '>>>' but not '>>> /' as info
-                if text_line.startswith(' * ') or (text_line.startswith('>>>') and not text_line.startswith('>>> /')):
-                    if not tmp_index in self.summery_dict:
-                        self.summery_dict[tmp_index] = {}
-                        self.summery_dict[tmp_index]['text'] = text_line
-                        self.summery_dict[tmp_index]['type'] = 'info'
-                        self.summery_dict[tmp_index]['status'] = 'info'
+    def run(self):
+        # read the log parser result document, we only have the search
+        # and the context lines in log_parser.py so the summary is the
+        # same on the master and the workers, the steps after get it
+        # from the service
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
+        return SUCCESS
+
+class setPatternStats(BuildStep):
+
+    name = 'setPatternStats'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
     @defer.inlineCallbacks
     def run(self):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
-        yield self.get_log_search_pattern()
-        # open the log file
-        # read it to a buffer
-        # make a dict of the buffer
-        # maybe use mulitiprocces to speed up the search
-        print(self.getProperty('log_build_data'))
-        if self.getProperty('faild_cpv'):
-            log_cpv = self.getProperty('log_build_data')[self.getProperty('faild_cpv')]
-        else:
-            log_cpv = self.getProperty('log_build_data')[self.getProperty('cpv')]
-        file_path = yield os.path.join(self.master.basedir, 'workers', self.getProperty('build_workername'), str(self.getProperty("project_build_data")['buildbot_build_id']) ,log_cpv['full_logname'])
-        #FIXME: decode it to utf-8
-        with io.TextIOWrapper(io.BufferedReader(gzip.open(file_path, 'rb'))) as f:
-            for text_line in f:
-                self.logfile_text_dict[self.index] = text_line.strip('\n')
-                # run the parse patten on the line
-                # have a buffer on 10 before we run pattern check
-                if self.index >= 10:
-                    yield self.search_buildlog(self.index - 9)
-                # remove text line that we don't need any more
-                if self.index >= 20:
-                    del self.logfile_text_dict[self.index - 19]
-                self.index = self.index + 1
-                self.max_text_lines = self.index
-            f.close()
-        # check last 10 lines in logfile_text_dict
-        yield self.search_buildlog(self.index - 10)
-        print(self.summery_dict)
-        # remove all lines with ignore in the dict
-        # setProperty summery_dict
-        self.setProperty("summary_log_dict", self.summery_dict, 'summary_log_dict')
+        # we only have pattern stats if the log parser did run with -s
+        summary_log_dict, pattern_stats = yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
+        if pattern_stats is None:
+            return SKIPPED
+        yield self.gentooci.db.projects.addProjectPatternStats(pattern_stats)
         return SUCCESS
 
 class MakeIssue(BuildStep):
@@ -320,61 +327,75 @@ class MakeIssue(BuildStep):
     def logIssue(self):
         separator1 = '\n'
         separator2 = ' '
-        log = yield self.addLog('issue')
-        self.error_dict['cpv'] = self.getProperty('log_cpv')
-        yield log.addStdout('Title:' + '\n')
-        yield log.addStdout(separator2.join([self.getProperty('log_cpv'), '-', self.error_dict['title']]) + separator1)
-        yield log.addStdout('Summary:' + '\n')
-        for line in self.summary_log_list:
-            yield log.addStdout(line + '\n')
-        yield log.addStdout('Attachments:' + '\n')
-        yield log.addStdout('emerge_info.log' + '\n')
-        log_cpv = self.getProperty('log_build_data')[self.getProperty('log_cpv')]
-        yield log.addStdout(log_cpv['full_logname'] + '\n')
-        yield log.addStdout('world.log' + '\n')
+        log = yield addBufferedLog(self, 'issue')
+        try:
+            self.error_dict['cpv'] = self.getProperty('log_cpv')
+            yield log.addStdout('Title:' + '\n')
+            yield log.addStdout(separator2.join([self.getProperty('log_cpv'), '-', self.error_dict['title']]) + separator1)
+            yield log.addStdout('Summary:' + '\n')
+            for line in self.summary_log_list:
+                yield log.addStdout(line + '\n')
+            yield log.addStdout('Attachments:' + '\n')
+            yield log.addStdout('emerge_info.log' + '\n')
+            log_cpv = self.getProperty('log_build_data')[self.getProperty('log_cpv')]
+            yield log.addStdout(log_cpv['full_logname'] + '\n')
+            yield log.addStdout('world.log' + '\n')
+            yield log.addStdout('Fingerprint:' + '\n')
+            yield log.addStdout(str(self.error_dict['fingerprint']) + '\n')
+            for build in self.fingerprint_builds:
+                yield log.addStdout(separator2.join(['Seen in build:', str(build['build_id']), 'Bug:', str(build['bug_id'])]) + separator1)
+        finally:
+            yield log.finish()
 
     def ClassifyIssue(self):
         # get the title for the issue
-        text_issue_list = []
-        text_phase_list = []
-        for k, v in sorted(self.summary_log_dict.items()):
-            # get the issue error
-            if v['type'] == self.error_dict['phase'] and v['status'] == 'error':
-                text_issue_list.append(v['text'])
-        # add the issue error
-        if text_issue_list != []:
-            self.error_dict['title_issue'] = text_issue_list[0].replace('*', '').strip()
-        else:
-            self.error_dict['title_issue'] = 'title_issue : None'
+        self.error_dict['title_issue'] = getErrorTitle(self.summary_log_dict, self.error_dict['phase'])
         self.error_dict['title_phase'] = 'failed in '+ self.error_dict['phase']
         #set the error title
         self.error_dict['title'] = self.error_dict['title_phase'] + ' - ' + self.error_dict['title_issue']
 
+    @defer.inlineCallbacks
+    def setFingerprint(self):
+        # the same phase and error line (paths, versions, line numbers
+        # and addresses masked) in the same package is the same failure
+        self.error_dict['fingerprint'] = None
+        self.error_dict['fingerprint_bugs'] = []
+        self.fingerprint_builds = []
+        if self.error_dict['title_issue'] == NO_ERROR_TITLE:
+            return
+        fingerprint, error_line = getErrorFingerprint(self.error_dict['phase'], self.error_dict['title_issue'])
+        self.error_dict['fingerprint'] = fingerprint
+        self.fingerprint_builds = yield self.gentooci.db.builds.getBuildsByFingerprint(fingerprint, self.getProperty('version_data')['package_uuid'])
+        # GetBugs use the newest and only search bugzilla if we don't have one
+        for build in self.fingerprint_builds:
+            if build['bug_id'] is not None and build['bug_id'] not in self.error_dict['fingerprint_bugs']:
+                self.error_dict['fingerprint_bugs'].append(build['bug_id'])
+        project_build_data = self.getProperty('project_build_data')
+        yield self.gentooci.db.builds.addBuildFingerprint(project_build_data['id'], project_build_data['project_uuid'], fingerprint, self.error_dict['phase'], error_line)
+
     @defer.inlineCallbacks
     def run(self):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
-        self.summary_log_dict = self.getProperty('build_summery_output')['summary_log_dict']
+        self.summary_log_dict, pattern_stats = yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
         error = False
         warning = False
         self.summary_log_list = []
         self.error_dict = {}
         self.aftersteps_list = []
-        #self.error_dict['hash'] = hashlib.sha256()
         for k, v in sorted(self.summary_log_dict.items()):
             self.summary_log_list.append(v['text'])
-            #self.error_dict['hash'].update(v['text'].encode('utf-8'))
             if v['status'] == 'warning':
                 warning = True
             # check if the build did fail
-            if v['text'].startswith(' * ERROR:') and v['text'].endswith(' phase):'):
-                # get phase error
-                phase_error = v['text'].split(' (')[1].split(' phase')[0]
+            phase_error = getErrorPhase(v['text'])
+            if phase_error is not None:
                 self.error_dict['phase'] = phase_error
                 error = True
         # add build log
         # add issue/bug/pr report
         if error:
             yield self.ClassifyIssue()
+            yield self.setFingerprint()
             print(self.error_dict)
             yield self.logIssue()
             self.setProperty("status", 'failed', 'status')
@@ -383,11 +404,38 @@ class MakeIssue(BuildStep):
         if warning:
             self.setProperty("status", 'warning', 'status')
             self.setProperty("bgo", False, 'bgo')
-        self.setProperty("summary_log_list", self.summary_log_list, 'summary_log_list')
         if self.aftersteps_list is not []:
             yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
         return SUCCESS
 
+class setSearchIndex(BuildStep):
+
+    name = 'setSearchIndex'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        if self.gentooci.search_index is None:
+            return SKIPPED
+        summary_log_dict, pattern_stats = yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
+        log_lines = None
+        if self.gentooci.config.project['project'].get('search_index_logs', False):
+            log_cpv = self.getProperty('log_build_data')[self.getProperty('log_cpv')]
+            workdir = yield os.path.join(self.master.basedir, 'workers', self.getProperty('build_workername'), str(self.getProperty("project_build_data")['buildbot_build_id']))
+            # read in the log parser thread when the build is added
+            log_lines = getLogTextLines(os.path.join(workdir, log_cpv['full_logname']), os.path.join(self.master.basedir, 'zstd'))
+        project_build_data = self.getProperty('project_build_data')
+        yield self.gentooci.setSearchIndexBuild(project_build_data['id'], project_build_data['project_uuid'], self.getProperty('log_cpv'), summary_log_dict, log_lines=log_lines)
+        return SUCCESS
+
 class setBuildbotLog(BuildStep):
 
     name = 'setBuildbotLog'
@@ -403,12 +451,17 @@ class setBuildbotLog(BuildStep):
 
     @defer.inlineCallbacks
     def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        summary_log_dict, pattern_stats = yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
         #setup the log
-        log = yield self.addLog('summary')
-        # add line for line
-        for line in self.getProperty('summary_log_list'):
-            yield log.addStdout(line + '\n')
-        return SUCCESS
+        log = yield addBufferedLog(self, 'summary')
+        try:
+            # add line for line
+            for k, v in sorted(summary_log_dict.items()):
+                yield log.addStdout(v['text'] + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class ReadEmergeInfoLog(BuildStep):
 
@@ -459,12 +512,15 @@ class setEmergeInfoLog(BuildStep):
     @defer.inlineCallbacks
     def run(self):
         #setup the log
-        log = yield self.addLog('emerge_info')
-        #FIXME: add emerge info to db
-        # add line for line
-        for line in self.getProperty('emerge_info_output')['emerge_info']:
-            yield log.addStdout(line + '\n')
-        return SUCCESS
+        log = yield addBufferedLog(self, 'emerge_info')
+        try:
+            #FIXME: add emerge info to db
+            # add line for line
+            for line in self.getProperty('emerge_info_output')['emerge_info']:
+                yield log.addStdout(line + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class setPackageInfoLog(BuildStep):
 
@@ -482,12 +538,15 @@ class setPackageInfoLog(BuildStep):
     @defer.inlineCallbacks
     def run(self):
         #setup the log
-        log = yield self.addLog('package_info')
-        #FIXME: add package info to db
-        # add line for line
-        for line in self.getProperty('emerge_info_output')['emerge_package_info']:
-            yield log.addStdout(line + '\n')
-        return SUCCESS
+        log = yield addBufferedLog(self, 'package_info')
+        try:
+            #FIXME: add package info to db
+            # add line for line
+            for line in self.getProperty('emerge_info_output')['emerge_package_info']:
+                yield log.addStdout(line + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 
 class Upload(BuildStep):
@@ -505,11 +564,15 @@ class Upload(BuildStep):
 
     @defer.inlineCallbacks
     def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        # the build worker did upload the log with a presigned url
+        if self.gentooci.config.object_store.get('presigned', False):
+            return SKIPPED
         log_cpv = self.getProperty('log_build_data')[self.getProperty('log_cpv')]
         bucket = self.getProperty('project_data')['uuid'] + '-' + 'logs'
-        file_path = yield os.path.join(self.master.basedir, 'workers', self.getProperty('build_workername'), str(self.getProperty("project_build_data")['buildbot_build_id']) ,log_cpv['full_logname'])
+        file_path = yield getBuildLogFile(os.path.join(self.master.basedir, 'workers', self.getProperty('build_workername'), str(self.getProperty("project_build_data")['buildbot_build_id']) ,log_cpv['full_logname']))
         aftersteps_list = []
-        aftersteps_list.append(minio.putFileToMinio(file_path, log_cpv['full_logname'], bucket))
+        aftersteps_list.append(minio.putFileToMinio(file_path, os.path.basename(file_path), bucket))
         yield self.build.addStepsAfterCurrentStep(aftersteps_list)
         return SUCCESS
 
@@ -534,34 +597,120 @@ class ParserPkgCheckLog(BuildStep):
         returnstatus = SUCCESS
         error = False
         warning = False
-        log = yield self.addLog('Pkgcheck')
-        print(self.getProperty("pkg_check_log_data"))
-        for a in self.getProperty("pkg_check_log_data"):
-            status = ''
-            print(a)
-            if isinstance(a, dict):
-                for k, i in a.items():
-                    if k.startswith('_'):
-                        if k == '_info':
-                            status = 'INFO: '
-                        if k == '_error':
-                            status = 'ERROR: '
-                            error = True
-                        if k == '_warning':
-                            status = 'WARNING: '
-                            warning = True
-                        if k == '_style':
-                            status = 'STYLE: '
-                        if isinstance(i, dict):
-                            for b, c in i.items():
-                                yield log.addStdout(status + b + c + '\n')
-                    else:
-                        yield log.addStdout(i + '\n')
-        if error:
-            returnstatus = FAILURE
-        if warning and not error:
-            returnstatus = WARNINGS
-        return returnstatus
+        log = yield addBufferedLog(self, 'Pkgcheck')
+        try:
+            print(self.getProperty("pkg_check_log_data"))
+            for a in self.getProperty("pkg_check_log_data"):
+                status = ''
+                print(a)
+                if isinstance(a, dict):
+                    for k, i in a.items():
+                        if k.startswith('_'):
+                            if k == '_info':
+                                status = 'INFO: '
+                            if k == '_error':
+                                status = 'ERROR: '
+                                error = True
+                            if k == '_warning':
+                                status = 'WARNING: '
+                                warning = True
+                            if k == '_style':
+                                status = 'STYLE: '
+                            if isinstance(i, dict):
+                                for b, c in i.items():
+                                    yield log.addStdout(status + b + c + '\n')
+                        else:
+                            yield log.addStdout(i + '\n')
+            if error:
+                returnstatus = FAILURE
+            if warning and not error:
+                returnstatus = WARNINGS
+            return returnstatus
+        finally:
+            yield log.finish()
+
+class setPatternNoise(BuildStep):
+
+    name = 'setPatternNoise'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        # False, 'propose' or 'apply'
+        noise = self.gentooci.config.project['project'].get('log_parser_noise', False)
+        # we only learn from builds without errors and warnings
+        if not noise or self.getProperty('status') != 'completed':
+            return SKIPPED
+        summary_log_dict, pattern_stats = yield self.gentooci.getLogParserResult(self.getProperty('log_parser_result'))
+        template_dict = {}
+        for k, v in sorted(summary_log_dict.items()):
+            if v['search_pattern'] != 'auto':
+                continue
+            search = getNoiseSearch(v['text'])
+            if search is None:
+                continue
+            template_dict[hashlib.sha256(search.encode('utf-8')).hexdigest()] = (search, v['text'])
+        project_uuid = self.getProperty('project_build_data')['project_uuid']
+        yield self.gentooci.db.projects.addProjectNoiseBuild(project_uuid, template_dict)
+        noise_list = yield self.gentooci.db.projects.getProjectNoiseCandidates(project_uuid,
+                                    float(self.gentooci.config.project['project'].get('log_parser_noise_threshold', NOISE_THRESHOLD)),
+                                    int(self.gentooci.config.project['project'].get('log_parser_noise_builds', NOISE_BUILDS)))
+        if noise_list == []:
+            return SUCCESS
+        log = yield addBufferedLog(self, 'noise')
+        try:
+            applied = False
+            for noise_data in noise_list:
+                # the search is to long for the pattern so it need a hand
+                if noise == 'apply' and len(noise_data['search']) <= PATTERN_SEARCH_SIZE:
+                    pattern_id = yield self.gentooci.db.projects.addProjectPattern(project_uuid, noise_data['search'], 'search', 'ignore', 'ignore')
+                    yield self.gentooci.db.projects.setProjectNoiseStatus(noise_data['id'], 'applied', pattern_id=pattern_id)
+                    yield log.addStdout('Applied: ' + noise_data['search'] + '\n')
+                    applied = True
+                else:
+                    yield self.gentooci.db.projects.setProjectNoiseStatus(noise_data['id'], 'proposed')
+                    yield log.addStdout('Proposed: ' + noise_data['search'] + '\n')
+                yield log.addStdout('  ' + noise_data['example'] + '\n')
+            # make the master use the new ignore pattern, addProjectPattern
+            # did bump the version
+            if applied:
+                self.gentooci.setLogSearchPatternChanged()
+            return SUCCESS
+        finally:
+            yield log.finish()
+
+class CompressBuildLog(BuildStep):
+
+    name = 'CompressBuildLog'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = False
+    warnOnWarnings = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def run(self):
+        # recompress the build logs older then log_zstd_days with zstd,
+        # the log of this build stay a .log.gz so the url on the build
+        # and the log in the bug can be viewed
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        if self.gentooci.log_compressor is None:
+            return SKIPPED
+        if not self.gentooci.compressBuildLogs():
+            return SKIPPED
+        self.descriptionDone = 'Recompressing old build logs'
+        return SUCCESS
 
 class setBuildStatus(BuildStep):
 
@@ -1,22 +1,17 @@
 # Copyright 2021 Gentoo Authors
 # Distributed under the terms of the GNU General Public License v2
 
-from minio import Minio
-from minio.error import ResponseError, BucketAlreadyOwnedByYou, BucketAlreadyExists
-
 from twisted.internet import defer
 from twisted.python import log
 
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.results import SUCCESS
 from buildbot.process.results import FAILURE
+from buildbot.process.results import SKIPPED
+from buildbot.plugins import steps
 
-#FIXME:
-# get url, user from config
-# get password from secret
-url = ''
-user = ''
-password = ''
+# url, user and password for the object store is in c['object_store']
+# in gentooci.cfg and the client is owned by GentooCiService
 
 class putFileToMinio(BuildStep):
 
@@ -34,27 +29,62 @@ class putFileToMinio(BuildStep):
         self.target = target
         super().__init__(**kwargs)
 
-    def getMinioConnect(self, url, user, password):
-        minioclient = Minio(
-            url,
-            access_key = user,
-            secret_key = password,
-            secure = False
-            )
-        return minioclient
-
     @defer.inlineCallbacks
     def pushFileToMinio(self):
-        try:
-            yield self.minio_connect.fput_object(self.bucket, self.target, self.filename)
-        except ResponseError as err:
-            print(err)
-            return FAILURE
-        return True
+        # the upload run in the object store thread pool and don't
+        # block the reactor
+        success = yield self.gentooci.putFileToObjectStore(self.bucket, self.target, self.filename)
+        return success
 
     @defer.inlineCallbacks
     def run(self):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
-        self.minio_connect = yield self.getMinioConnect(url, user, password)
+        if self.gentooci.object_store is None:
+            return SKIPPED
         success = yield self.pushFileToMinio()
+        if not success:
+            return FAILURE
+        return SUCCESS
+
+class putFileToMinioFromWorker(BuildStep):
+
+    name = 'putFileToMinioFromWorker'
+    description = 'Running'
+    descriptionDone = 'Ran'
+    descriptionSuffix = None
+    haltOnFailure = False
+    flunkOnFailure = True
+    warnOnWarnings = True
+
+    def __init__(self, workersrc, target, bucket, **kwargs):
+        self.workersrc = workersrc
+        self.bucket = bucket
+        self.target = target
+        super().__init__(**kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        # the worker upload the file to the bucket with a presigned url
+        # so the file don't go over the master
+        self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
+        if self.gentooci.object_store is None:
+            return SKIPPED
+        try:
+            url = yield self.gentooci.getObjectStoreUploadUrl(self.bucket, self.target)
+        except Exception as e:
+            log.msg("Can't get a presigned url for {}: {}".format(self.target, e))
+            return FAILURE
+        aftersteps_list = []
+        # the url is a password for the file, we give it to curl in the
+        # env so it is not in the step log or the process list
+        aftersteps_list.append(steps.ShellCommand(
+                                                name = 'Upload ' + self.target + ' to the object store',
+                                                haltOnFailure = False,
+                                                flunkOnFailure = True,
+                                                command=['sh', '-c', 'curl --silent --show-error --fail --retry 3 --upload-file "$1" --url "$UPLOAD_URL"', 'sh', self.workersrc],
+                                                env={ 'UPLOAD_URL' : url },
+                                                logEnviron=False,
+                                                workdir='/'
+                                                ))
+        yield self.build.addStepsAfterCurrentStep(aftersteps_list)
         return SUCCESS
@@ -23,6 +23,7 @@ from buildbot.plugins import steps, util
 
 from buildbot_gentoo_ci.steps import portage as portage_steps
 from buildbot_gentoo_ci.steps import repos as repos_steps
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
 
 class SetupPropertys(BuildStep):
     name = 'Setup propertys for stage4 image'
@@ -66,154 +67,157 @@ class SetupStage4Steps(BuildStep):
         self.setProperty('portage_repos_path', self.gentooci.config.project['project']['worker_portage_repos_path'], 'portage_repos_path')
         aftersteps_list = []
         separator = '\n'
-        log = yield self.addLog('makeing_stage4')
-        if self.getProperty("type") == 'docker':
-            print('build this stage4 %s on %s for %s' % (self.getProperty('project_uuid'), self.getProperty('workername'), self.getProperty('project_data')['name']))
-            self.descriptionDone = ' '.join(['build this stage4', self.getProperty('project_uuid'), 'on', self.getProperty('workername'), 'for', self.getProperty('project_data')['name']])
-            #FIXME: package list should be in the db project
-            package_list = ['dev-vcs/git', 'app-text/ansifilter', 'dev-util/pkgcheck', 'dev-lang/rust-bin', 'app-admin/eclean-kernel', 'app-portage/gentoolkit', 'sys-kernel/gentoo-kernel-bin', 'app-editors/nano']
-            if 'systemd' or 'openrc' in self.getProperty('project_data')['image']:
-                workerdest = yield os.path.join(self.getProperty("workerbase"), self.getProperty('project_uuid'))
-                workerdest_etc = yield os.path.join(workerdest, 'etc')
-                print(workerdest_etc)
-                self.setProperty('rootworkdir', workerdest, 'rootworkdir')
-                # create dir
-                aftersteps_list.append(steps.ShellCommand(
+        log = yield addBufferedLog(self, 'makeing_stage4')
+        try:
+            if self.getProperty("type") == 'docker':
+                print('build this stage4 %s on %s for %s' % (self.getProperty('project_uuid'), self.getProperty('workername'), self.getProperty('project_data')['name']))
+                self.descriptionDone = ' '.join(['build this stage4', self.getProperty('project_uuid'), 'on', self.getProperty('workername'), 'for', self.getProperty('project_data')['name']])
+                #FIXME: package list should be in the db project
+                package_list = ['dev-vcs/git', 'app-text/ansifilter', 'dev-util/pkgcheck', 'dev-lang/rust-bin', 'app-admin/eclean-kernel', 'app-portage/gentoolkit', 'sys-kernel/gentoo-kernel-bin', 'app-editors/nano']
+                if 'systemd' or 'openrc' in self.getProperty('project_data')['image']:
+                    workerdest = yield os.path.join(self.getProperty("workerbase"), self.getProperty('project_uuid'))
+                    workerdest_etc = yield os.path.join(workerdest, 'etc')
+                    print(workerdest_etc)
+                    self.setProperty('rootworkdir', workerdest, 'rootworkdir')
+                    # create dir
+                    aftersteps_list.append(steps.ShellCommand(
+                            flunkOnFailure=True,
+                            name='Create stage4 dir',
+                            command=['mkdir', self.getProperty('project_uuid')],
+                            workdir=self.getProperty("workerbase")
+                            ))
+                    # download stage3
+                    aftersteps_list.append(GetSteg3())
+                    # setup portage
+                    aftersteps_list.append(repos_steps.UpdateRepos())
+                    aftersteps_list.append(portage_steps.SetReposConf())
+                    aftersteps_list.append(portage_steps.SetMakeConf())
+                    # add localegen
+                    #FIXME: set that in config
+                    locale_conf = []
+                    locale_conf.append('en_US.UTF-8 UTF-8')
+                    locale_conf.append('en_US ISO-8859-1')
+                    locale_conf.append('C.UTF8 UTF-8')
+                    locale_conf_string = separator.join(locale_conf)
+                    aftersteps_list.append(
+                        steps.StringDownload(locale_conf_string + separator,
+                                    workerdest="locale.gen",
+                                    workdir=self.getProperty("workerdest") + '/etc'
+                                    ))
+                    yield log.addStdout('File: ' + 'locale.gen' + '\n')
+                    for line in locale_conf:
+                        yield log.addStdout(line + '\n')
+                    aftersteps_list.append(
+                        steps.StringDownload('LANG="en_US.utf8"' + separator,
+                                    workerdest="locale.conf",
+                                    workdir=self.getProperty("workerdest") + '/etc'
+                                    ))
+                    yield log.addStdout('Setting LANG to: ' + 'en_US.utf8' + '\n')
+                    aftersteps_list.append(SetSystemdNspawnConf())
+                    # run localgen
+                    aftersteps_list.append(steps.ShellCommand(
                         flunkOnFailure=True,
-                        name='Create stage4 dir',
-                        command=['mkdir', self.getProperty('project_uuid')],
+                        name='Run locale-gen on the chroot',
+                        command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'locale-gen'],
                         workdir=self.getProperty("workerbase")
                         ))
-                # download stage3
-                aftersteps_list.append(GetSteg3())
-                # setup portage
-                aftersteps_list.append(repos_steps.UpdateRepos())
-                aftersteps_list.append(portage_steps.SetReposConf())
-                aftersteps_list.append(portage_steps.SetMakeConf())
-                # add localegen
-                #FIXME: set that in config
-                locale_conf = []
-                locale_conf.append('en_US.UTF-8 UTF-8')
-                locale_conf.append('en_US ISO-8859-1')
-                locale_conf.append('C.UTF8 UTF-8')
-                locale_conf_string = separator.join(locale_conf)
-                aftersteps_list.append(
-                    steps.StringDownload(locale_conf_string + separator,
-                                workerdest="locale.gen",
-                                workdir=self.getProperty("workerdest") + '/etc'
-                                ))
-                yield log.addStdout('File: ' + 'locale.gen' + '\n')
-                for line in locale_conf:
-                    yield log.addStdout(line + '\n')
-                aftersteps_list.append(
-                    steps.StringDownload('LANG="en_US.utf8"' + separator,
-                                workerdest="locale.conf",
-                                workdir=self.getProperty("workerdest") + '/etc'
-                                ))
-                yield log.addStdout('Setting LANG to: ' + 'en_US.utf8' + '\n')
-                aftersteps_list.append(SetSystemdNspawnConf())
-                # run localgen
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Run locale-gen on the chroot',
-                    command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'locale-gen'],
-                    workdir=self.getProperty("workerbase")
-                    ))
-                # update timezone
-                # add the world file
-                package_list_string = separator.join(package_list)
-                aftersteps_list.append(
-                    steps.StringDownload(package_list_string + separator,
-                                workerdest="var/lib/portage/world",
-                                workdir=self.getProperty("workerdest")
-                                ))
-                # update container
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Run update on the chroot',
-                    command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', '--update', '--deep', '--newuse', '@world'],
-                    workdir=self.getProperty("workerbase")
-                    ))
-                # install buildbot-worker
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Install buildbot worker on the chroot',
-                    command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', 'buildbot-worker'],
-                    workdir=self.getProperty("workerbase")
-                    ))
-                if self.getProperty("type") == 'docker':
-                    # copy docker_buildbot.tac to worker dir
-                    buildbot_worker_config_file = yield os.path.join(self.master.basedir, 'files', 'docker_buildbot_worker.tac')
-                    aftersteps_list.append(steps.FileDownload(
+                    # update timezone
+                    # add the world file
+                    package_list_string = separator.join(package_list)
+                    aftersteps_list.append(
+                        steps.StringDownload(package_list_string + separator,
+                                    workerdest="var/lib/portage/world",
+                                    workdir=self.getProperty("workerdest")
+                                    ))
+                    # update container
+                    aftersteps_list.append(steps.ShellCommand(
                         flunkOnFailure=True,
-                        name='Upload buildbot worker config to the stage4',
-                        mastersrc=buildbot_worker_config_file,
-                        workerdest='var/lib/buildbot_worker/buildbot.tac',
+                        name='Run update on the chroot',
+                        command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', '--update', '--deep', '--newuse', '@world'],
+                        workdir=self.getProperty("workerbase")
+                        ))
+                    # install buildbot-worker
+                    aftersteps_list.append(steps.ShellCommand(
+                        flunkOnFailure=True,
+                        name='Install buildbot worker on the chroot',
+                        command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', 'buildbot-worker'],
+                        workdir=self.getProperty("workerbase")
+                        ))
+                    if self.getProperty("type") == 'docker':
+                        # copy docker_buildbot.tac to worker dir
+                        buildbot_worker_config_file = yield os.path.join(self.master.basedir, 'files', 'docker_buildbot_worker.tac')
+                        aftersteps_list.append(steps.FileDownload(
+                            flunkOnFailure=True,
+                            name='Upload buildbot worker config to the stage4',
+                            mastersrc=buildbot_worker_config_file,
+                            workerdest='var/lib/buildbot_worker/buildbot.tac',
+                            workdir=self.getProperty("workerdest")
+                        ))
+                    # add info to the buildbot worker
+                    worker_info_list = []
+                    worker_info_list.append(self.getProperty('project_data')['name'])
+                    worker_info_list.append(self.getProperty("stage3"))
+                    #FIXME: worker name of self.getProperty('workername') from node table
+                    worker_info_list.append('node1')
+                    print(worker_info_list)
+                    worker_info = ' '.join(worker_info_list)
+                    aftersteps_list.append(steps.StringDownload(
+                        worker_info + separator,
+                        workerdest='var/lib/buildbot_worker/info/host',
                         workdir=self.getProperty("workerdest")
                     ))
-                # add info to the buildbot worker
-                worker_info_list = []
-                worker_info_list.append(self.getProperty('project_data')['name'])
-                worker_info_list.append(self.getProperty("stage3"))
-                #FIXME: worker name of self.getProperty('workername') from node table
-                worker_info_list.append('node1')
-                print(worker_info_list)
-                worker_info = ' '.join(worker_info_list)
-                aftersteps_list.append(steps.StringDownload(
-                    worker_info + separator,
-                    workerdest='var/lib/buildbot_worker/info/host',
-                    workdir=self.getProperty("workerdest")
-                ))
-                #FIXME: add admin info
-                # depclean
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Depclean on the chroot',
-                    command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', '--depclean'],
-                    workdir=self.getProperty("workerbase")
-                    ))
-                # remove the gentoo repo
-                #aftersteps_list.append(steps.ShellCommand(
-                #    flunkOnFailure=True,
-                #    name='Remove the repo dir',
-                #    command=['rm', '-R', self.getProperty('project_uuid') + '/var/db/repos/gentoo'],
-                #    workdir=self.getProperty("workerbase")
-                #))
-                # compress it
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Compress the stage4',
-                    command=['tar', '-cf', '../stage4-' + self.getProperty('project_uuid') + '.tar', '.'],
-                    workdir=self.getProperty("workerbase") + '/' + self.getProperty('project_uuid')
-                ))
-                # signing the stage4
-                # remove the dir
-                aftersteps_list.append(steps.ShellCommand(
-                    flunkOnFailure=True,
-                    name='Remove the stage4 dir',
-                    command=['rm', '-R', self.getProperty('project_uuid')],
-                    workdir=self.getProperty("workerbase")
-                ))
-                # build docker stage4 image and buildbot-worker image
-                # FIXME: Use the python docker api
-                # FIXME: add date tags
-                if self.getProperty("type") == 'docker':
+                    #FIXME: add admin info
+                    # depclean
                     aftersteps_list.append(steps.ShellCommand(
                         flunkOnFailure=True,
-                        name='Build docker stage4 image',
-                        command=['docker', 'import', 'stage4-' + self.getProperty('project_uuid') + '.tar', 'stage4-' + self.getProperty('project_uuid') + ':latest'],
+                        name='Depclean on the chroot',
+                        command=['systemd-nspawn', '-D', self.getProperty('project_uuid'), 'emerge', '--depclean'],
                         workdir=self.getProperty("workerbase")
+                        ))
+                    # remove the gentoo repo
+                    #aftersteps_list.append(steps.ShellCommand(
+                    #    flunkOnFailure=True,
+                    #    name='Remove the repo dir',
+                    #    command=['rm', '-R', self.getProperty('project_uuid') + '/var/db/repos/gentoo'],
+                    #    workdir=self.getProperty("workerbase")
+                    #))
+                    # compress it
+                    aftersteps_list.append(steps.ShellCommand(
+                        flunkOnFailure=True,
+                        name='Compress the stage4',
+                        command=['tar', '-cf', '../stage4-' + self.getProperty('project_uuid') + '.tar', '.'],
+                        workdir=self.getProperty("workerbase") + '/' + self.getProperty('project_uuid')
                     ))
-                    # gentoo docker buildbot-worker image
+                    # signing the stage4
+                    # remove the dir
                     aftersteps_list.append(steps.ShellCommand(
                         flunkOnFailure=True,
-                        name='Build docker buildbot-worker image',
-                        command=['docker', 'buildx', 'build', '--file', '../docker/GentooBuildbotWorker.Docker', '--build-arg', 'PROJECTUUID=' + self.getProperty('project_uuid'), '--tag', 'bb-worker-' +  self.getProperty('project_uuid') + ':latest', '.'],
+                        name='Remove the stage4 dir',
+                        command=['rm', '-R', self.getProperty('project_uuid')],
                         workdir=self.getProperty("workerbase")
                     ))
-        if aftersteps_list != []:
-            yield self.build.addStepsAfterCurrentStep(aftersteps_list)
-        return SUCCESS
+                    # build docker stage4 image and buildbot-worker image
+                    # FIXME: Use the python docker api
+                    # FIXME: add date tags
+                    if self.getProperty("type") == 'docker':
+                        aftersteps_list.append(steps.ShellCommand(
+                            flunkOnFailure=True,
+                            name='Build docker stage4 image',
+                            command=['docker', 'import', 'stage4-' + self.getProperty('project_uuid') + '.tar', 'stage4-' + self.getProperty('project_uuid') + ':latest'],
+                            workdir=self.getProperty("workerbase")
+                        ))
+                        # gentoo docker buildbot-worker image
+                        aftersteps_list.append(steps.ShellCommand(
+                            flunkOnFailure=True,
+                            name='Build docker buildbot-worker image',
+                            command=['docker', 'buildx', 'build', '--file', '../docker/GentooBuildbotWorker.Docker', '--build-arg', 'PROJECTUUID=' + self.getProperty('project_uuid'), '--tag', 'bb-worker-' +  self.getProperty('project_uuid') + ':latest', '.'],
+                            workdir=self.getProperty("workerbase")
+                        ))
+            if aftersteps_list != []:
+                yield self.build.addStepsAfterCurrentStep(aftersteps_list)
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class GetSteg3(BuildStep):
     name = 'Get the steg3 image'
@@ -300,28 +304,31 @@ class SetSystemdNspawnConf(BuildStep):
     def run(self):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
         nspawn_conf_path = '/etc/systemd/nspawn/'
-        log = yield self.addLog(self.getProperty('project_uuid') + '.nspawn')
-        #FIXME: set it in config
-        separator = '\n'
-        nspawn_conf = []
-        nspawn_conf.append('[Files]')
-        nspawn_conf.append('TemporaryFileSystem=/run/lock')
-        # db node config portage cache bind
-        src_dir = '/srv/gentoo/portage/' + self.getProperty('project_uuid')
-        dest_dir = '/var/cache/portage'
-        nspawn_conf.append('Bind=' + src_dir + '/distfiles' + ':' + dest_dir + '/distfiles')
-        nspawn_conf.append('Bind=' + src_dir + '/packages' + ':' + dest_dir + '/packages')
-        nspawn_conf.append('[Exec]')
-        nspawn_conf.append('Capability=CAP_NET_ADMIN')
-        nspawn_conf.append('[Network]')
-        nspawn_conf.append('VirtualEthernet=no')
-        nspawn_conf_string = separator.join(nspawn_conf)
-        yield self.build.addStepsAfterCurrentStep([
-            steps.StringDownload(nspawn_conf_string + separator,
-                                workerdest=self.getProperty('project_uuid') + '.nspawn',
-                                workdir=nspawn_conf_path)
-            ])
-        yield log.addStdout('File: ' + self.getProperty('project_uuid') + '.nspawn' + '\n')
-        for line in nspawn_conf:
-            yield log.addStdout(line + '\n')
-        return SUCCESS
+        log = yield addBufferedLog(self, self.getProperty('project_uuid') + '.nspawn')
+        try:
+            #FIXME: set it in config
+            separator = '\n'
+            nspawn_conf = []
+            nspawn_conf.append('[Files]')
+            nspawn_conf.append('TemporaryFileSystem=/run/lock')
+            # db node config portage cache bind
+            src_dir = '/srv/gentoo/portage/' + self.getProperty('project_uuid')
+            dest_dir = '/var/cache/portage'
+            nspawn_conf.append('Bind=' + src_dir + '/distfiles' + ':' + dest_dir + '/distfiles')
+            nspawn_conf.append('Bind=' + src_dir + '/packages' + ':' + dest_dir + '/packages')
+            nspawn_conf.append('[Exec]')
+            nspawn_conf.append('Capability=CAP_NET_ADMIN')
+            nspawn_conf.append('[Network]')
+            nspawn_conf.append('VirtualEthernet=no')
+            nspawn_conf_string = separator.join(nspawn_conf)
+            yield self.build.addStepsAfterCurrentStep([
+                steps.StringDownload(nspawn_conf_string + separator,
+                                    workerdest=self.getProperty('project_uuid') + '.nspawn',
+                                    workdir=nspawn_conf_path)
+                ])
+            yield log.addStdout('File: ' + self.getProperty('project_uuid') + '.nspawn' + '\n')
+            for line in nspawn_conf:
+                yield log.addStdout(line + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
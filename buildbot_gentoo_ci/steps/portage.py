@@ -25,6 +25,7 @@ from buildbot.plugins import steps
 
 from buildbot_gentoo_ci.steps import master as master_steps
 from buildbot_gentoo_ci.utils.use import getIUseValue
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
 
 @defer.inlineCallbacks
 def WriteTextToFile(path, text_list):
@@ -84,9 +85,12 @@ class SetMakeProfile(BuildStep):
                         workdir='/'
                 )
             ])
-        log = yield self.addLog('make.profile')
-        yield log.addStdout('Profile path: ' + makeprofile_path + '\n')
-        return SUCCESS
+        log = yield addBufferedLog(self, 'make.profile')
+        try:
+            yield log.addStdout('Profile path: ' + makeprofile_path + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class SetReposConf(BuildStep):
 
@@ -121,46 +125,49 @@ class SetReposConf(BuildStep):
         if cmd.didFail():
             self.aftersteps_list.append(steps.MakeDirectory(dir="repos.conf",
                                 workdir=portage_etc_path))
-        log = yield self.addLog('repos.conf')
-        # check if repos_conf_data['value'] is vaild repo name
-        separator = '\n'
-        default_conf = []
-        default_conf.append('[DEFAULT]')
-        default_conf.append('main-repo = ' + repos_conf_data['value'])
-        default_conf.append('auto-sync = no')
-        default_conf_string = separator.join(default_conf)
-        self.aftersteps_list.append(
-            steps.StringDownload(default_conf_string + separator,
-                                workerdest="repos.conf/default.conf",
-                                workdir=portage_etc_path)
-            )
-        # display the default.conf
-        yield log.addStdout('File: ' + 'default.conf' + '\n')
-        for line in default_conf:
-            yield log.addStdout(line + '\n')
-        # add all repos that project have in projects_repositorys to repos.conf/reponame.conf
-        projects_repositorys_data = yield self.gentooci.db.projects.getRepositorysByProjectUuid(project_data['uuid'])
-        for project_repository_data in projects_repositorys_data:
-            repository_data = yield self.gentooci.db.repositorys.getRepositoryByUuid(project_repository_data['repository_uuid'])
-            repository_path = yield os.path.join(portage_repos_path, repository_data['name'])
-            repository_conf = []
-            repository_conf.append('[' + repository_data['name'] + ']')
-            repository_conf.append('location = ' + repository_path)
-            repository_conf.append('sync-uri = ' + repository_data['url'])
-            repository_conf.append('sync-type = git')
-            repository_conf.append('auto-sync = no')
-            repository_conf_string = separator.join(repository_conf)
-            filename = repository_data['name'] + '.conf'
+        log = yield addBufferedLog(self, 'repos.conf')
+        try:
+            # check if repos_conf_data['value'] is vaild repo name
+            separator = '\n'
+            default_conf = []
+            default_conf.append('[DEFAULT]')
+            default_conf.append('main-repo = ' + repos_conf_data['value'])
+            default_conf.append('auto-sync = no')
+            default_conf_string = separator.join(default_conf)
             self.aftersteps_list.append(
-                steps.StringDownload(repository_conf_string + separator,
-                                workerdest='repos.conf/' + filename,
-                                workdir=portage_etc_path)
+                steps.StringDownload(default_conf_string + separator,
+                                    workerdest="repos.conf/default.conf",
+                                    workdir=portage_etc_path)
                 )
-            yield log.addStdout('File: ' + filename + '\n')
-            for line in repository_conf:
+            # display the default.conf
+            yield log.addStdout('File: ' + 'default.conf' + '\n')
+            for line in default_conf:
                 yield log.addStdout(line + '\n')
-        yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
-        return SUCCESS
+            # add all repos that project have in projects_repositorys to repos.conf/reponame.conf
+            projects_repositorys_data = yield self.gentooci.db.projects.getRepositorysByProjectUuid(project_data['uuid'])
+            for project_repository_data in projects_repositorys_data:
+                repository_data = yield self.gentooci.db.repositorys.getRepositoryByUuid(project_repository_data['repository_uuid'])
+                repository_path = yield os.path.join(portage_repos_path, repository_data['name'])
+                repository_conf = []
+                repository_conf.append('[' + repository_data['name'] + ']')
+                repository_conf.append('location = ' + repository_path)
+                repository_conf.append('sync-uri = ' + repository_data['url'])
+                repository_conf.append('sync-type = git')
+                repository_conf.append('auto-sync = no')
+                repository_conf_string = separator.join(repository_conf)
+                filename = repository_data['name'] + '.conf'
+                self.aftersteps_list.append(
+                    steps.StringDownload(repository_conf_string + separator,
+                                    workerdest='repos.conf/' + filename,
+                                    workdir=portage_etc_path)
+                    )
+                yield log.addStdout('File: ' + filename + '\n')
+                for line in repository_conf:
+                    yield log.addStdout(line + '\n')
+            yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class SetMakeConf(BuildStep):
 
@@ -188,61 +195,64 @@ class SetMakeConf(BuildStep):
         separator1 = '\n'
         separator2 = ' '
         makeconf_list = []
-        log = yield self.addLog('make.conf')
-        for k in makeconf_variables_data:
-            makeconf_variables_values_data = yield self.gentooci.db.projects.getProjectMakeConfById(project_data['uuid'], k['id'])
-            makeconf_variable_list = []
-            # CFLAGS
-            if k['variable'] == 'CFLAGS' or k['variable'] == 'FCFLAGS':
-                makeconf_variable_list.append('-O2')
-                makeconf_variable_list.append('-pipe')
-                makeconf_variable_list.append('-fno-diagnostics-color')
-                #FIXME:
-                # Depend on worker we may have to add a diffrent march
-                makeconf_variable_list.append('-march=native')
-            if k['variable'] == 'CXXFLAGS':
-                makeconf_variable_list.append('${CFLAGS}')
-            if k['variable'] == 'FFLAGS':
-                makeconf_variable_list.append('${FCFLAGS}')
-            # Add default setting if use_default
-            if project_data['use_default']:
-                default_project_data = yield self.gentooci.db.projects.getProjectByName(self.gentooci.config.project['project']['update_db'])
-                default_makeconf_variables_values_data = yield self.gentooci.db.projects.getProjectMakeConfById(default_project_data['uuid'], k['id'])
-                for v in default_makeconf_variables_values_data:
+        log = yield addBufferedLog(self, 'make.conf')
+        try:
+            for k in makeconf_variables_data:
+                makeconf_variables_values_data = yield self.gentooci.db.projects.getProjectMakeConfById(project_data['uuid'], k['id'])
+                makeconf_variable_list = []
+                # CFLAGS
+                if k['variable'] == 'CFLAGS' or k['variable'] == 'FCFLAGS':
+                    makeconf_variable_list.append('-O2')
+                    makeconf_variable_list.append('-pipe')
+                    makeconf_variable_list.append('-fno-diagnostics-color')
+                    #FIXME:
+                    # Depend on worker we may have to add a diffrent march
+                    makeconf_variable_list.append('-march=native')
+                if k['variable'] == 'CXXFLAGS':
+                    makeconf_variable_list.append('${CFLAGS}')
+                if k['variable'] == 'FFLAGS':
+                    makeconf_variable_list.append('${FCFLAGS}')
+                # Add default setting if use_default
+                if project_data['use_default']:
+                    default_project_data = yield self.gentooci.db.projects.getProjectByName(self.gentooci.config.project['project']['update_db'])
+                    default_makeconf_variables_values_data = yield self.gentooci.db.projects.getProjectMakeConfById(default_project_data['uuid'], k['id'])
+                    for v in default_makeconf_variables_values_data:
+                        if v['build_id'] == 0:
+                            makeconf_variable_list.append(v['value'])
+                for v in makeconf_variables_values_data:
                     if v['build_id'] == 0:
                         makeconf_variable_list.append(v['value'])
-            for v in makeconf_variables_values_data:
-                if v['build_id'] == 0:
-                    makeconf_variable_list.append(v['value'])
-            #NOTE: set it by project
-            #if k['variable'] == 'ACCEPT_LICENSE' and makeconf_variable_list != []:
-            #    makeconf_variable_list.append('ACCEPT_LICENSE="*"')
-            if makeconf_variable_list != []:
-                makeconf_variable_string = k['variable'] + '="' + separator2.join(makeconf_variable_list) + '"'
-                makeconf_list.append(makeconf_variable_string)
-        # add hardcoded variables from config file
-        config_makeconfig = self.gentooci.config.project['project']['config_makeconfig']
-        for v in config_makeconfig:
-            makeconf_list.append(v)
-        # add ACCEPT_KEYWORDS from the project_data info
-        keyword_data = yield self.gentooci.db.keywords.getKeywordById(project_data['keyword_id'])
-        if project_data['status'] == 'unstable':
-            makeconf_keyword = '~' + keyword_data['name']
-        else:
-            makeconf_keyword = keyword_data['name']
-        makeconf_list.append('ACCEPT_KEYWORDS="' + makeconf_keyword + '"')
-        makeconf_list.append('MAKEOPTS="-j14"')
-        makeconf_string = separator1.join(makeconf_list)
-        print(makeconf_string)
-        yield self.build.addStepsAfterCurrentStep([
-            steps.StringDownload(makeconf_string + separator1,
-                                workerdest="make.conf",
-                                workdir=portage_etc_path)
-            ])
-        # display the make.conf
-        for line in makeconf_list:
-            yield log.addStdout(line + '\n')
-        return SUCCESS
+                #NOTE: set it by project
+                #if k['variable'] == 'ACCEPT_LICENSE' and makeconf_variable_list != []:
+                #    makeconf_variable_list.append('ACCEPT_LICENSE="*"')
+                if makeconf_variable_list != []:
+                    makeconf_variable_string = k['variable'] + '="' + separator2.join(makeconf_variable_list) + '"'
+                    makeconf_list.append(makeconf_variable_string)
+            # add hardcoded variables from config file
+            config_makeconfig = self.gentooci.config.project['project']['config_makeconfig']
+            for v in config_makeconfig:
+                makeconf_list.append(v)
+            # add ACCEPT_KEYWORDS from the project_data info
+            keyword_data = yield self.gentooci.db.keywords.getKeywordById(project_data['keyword_id'])
+            if project_data['status'] == 'unstable':
+                makeconf_keyword = '~' + keyword_data['name']
+            else:
+                makeconf_keyword = keyword_data['name']
+            makeconf_list.append('ACCEPT_KEYWORDS="' + makeconf_keyword + '"')
+            makeconf_list.append('MAKEOPTS="-j14"')
+            makeconf_string = separator1.join(makeconf_list)
+            print(makeconf_string)
+            yield self.build.addStepsAfterCurrentStep([
+                steps.StringDownload(makeconf_string + separator1,
+                                    workerdest="make.conf",
+                                    workdir=portage_etc_path)
+                ])
+            # display the make.conf
+            for line in makeconf_list:
+                yield log.addStdout(line + '\n')
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class SetPackageDefault(BuildStep):
 
@@ -261,63 +271,66 @@ class SetPackageDefault(BuildStep):
         self.gentooci = self.master.namedServices['services'].namedServices['gentooci']
         separator1 = '\n'
         separator2 = ' '
-        log = yield self.addLog('package.*')
-        self.aftersteps_list = []
-        self.aftersteps_list.append(steps.MakeDirectory(dir='package.use',
-                                workdir='/etc/portage/'))
-        self.aftersteps_list.append(steps.MakeDirectory(dir='package.env',
-                                workdir='/etc/portage/'))
-        #FIXME: accept_keywords
-        # add the needed package.* settings from db
-        # add package use
-        package_conf_use_list = []
-        package_settings = yield self.gentooci.db.projects.getProjectPortagePackageByUuid(self.getProperty('project_data')['uuid'])
-        for package_setting in package_settings:
-            if package_setting['directory'] == 'use':
-                package_conf_use_list.append(separator2.join(package_setting['package'],package_setting['value']))
-        if self.getProperty('use_data') is not None:
-            for k, v in self.getProperty('use_data').items():
-                    for use, value in v.items():
-                        if value:
-                            package_conf_use_list.append(separator2.join([k, use]))
-                        else:
-                            package_conf_use_list.append(separator2.join([k, '-' + use]))
-        if package_conf_use_list != []:
-            package_conf_use_string = separator1.join(package_conf_use_list)
-            self.aftersteps_list.append(
-                        steps.StringDownload(package_conf_use_string + separator1,
-                            workerdest='default.conf',
-                            workdir='/etc/portage/package.use/'
+        log = yield addBufferedLog(self, 'package.*')
+        try:
+            self.aftersteps_list = []
+            self.aftersteps_list.append(steps.MakeDirectory(dir='package.use',
+                                    workdir='/etc/portage/'))
+            self.aftersteps_list.append(steps.MakeDirectory(dir='package.env',
+                                    workdir='/etc/portage/'))
+            #FIXME: accept_keywords
+            # add the needed package.* settings from db
+            # add package use
+            package_conf_use_list = []
+            package_settings = yield self.gentooci.db.projects.getProjectPortagePackageByUuid(self.getProperty('project_data')['uuid'])
+            for package_setting in package_settings:
+                if package_setting['directory'] == 'use':
+                    package_conf_use_list.append(separator2.join(package_setting['package'],package_setting['value']))
+            if self.getProperty('use_data') is not None:
+                for k, v in self.getProperty('use_data').items():
+                        for use, value in v.items():
+                            if value:
+                                package_conf_use_list.append(separator2.join([k, use]))
+                            else:
+                                package_conf_use_list.append(separator2.join([k, '-' + use]))
+            if package_conf_use_list != []:
+                package_conf_use_string = separator1.join(package_conf_use_list)
+                self.aftersteps_list.append(
+                            steps.StringDownload(package_conf_use_string + separator1,
+                                workerdest='default.conf',
+                                workdir='/etc/portage/package.use/'
+                                )
                             )
-                        )
-            yield log.addStdout('File: ' + 'package.use/default.conf' + separator1)
-            for line in package_conf_use_list:
-                yield log.addStdout(line + separator1)
-        # for test we need to add env and use
-        #FIXME: check restrictions, test use mask and required use
-        if self.getProperty('projectrepository_data')['test']:
-            auxdb_iuses = yield self.gentooci.db.versions.getMetadataByUuidAndMatadata(self.getProperty("version_data")['uuid'], 'iuse')
-            for auxdb_iuse in auxdb_iuses:
-                iuse, status = getIUseValue(auxdb_iuse['value'])
-                if iuse == 'test':
-                    self.aftersteps_list.append(
-                        steps.StringDownload(separator2.join(['=' + self.getProperty("cpv"),'test']) + separator1,
-                            workerdest='test.conf',
-                            workdir='/etc/portage/package.use/'
+                yield log.addStdout('File: ' + 'package.use/default.conf' + separator1)
+                for line in package_conf_use_list:
+                    yield log.addStdout(line + separator1)
+            # for test we need to add env and use
+            #FIXME: check restrictions, test use mask and required use
+            if self.getProperty('projectrepository_data')['test']:
+                auxdb_iuses = yield self.gentooci.db.versions.getMetadataByUuidAndMatadata(self.getProperty("version_data")['uuid'], 'iuse')
+                for auxdb_iuse in auxdb_iuses:
+                    iuse, status = getIUseValue(auxdb_iuse['value'])
+                    if iuse == 'test':
+                        self.aftersteps_list.append(
+                            steps.StringDownload(separator2.join(['=' + self.getProperty("cpv"),'test']) + separator1,
+                                workerdest='test.conf',
+                                workdir='/etc/portage/package.use/'
+                                )
                             )
-                        )
-                    yield log.addStdout('File: ' + 'package.use/test.conf' + separator1)
-                    yield log.addStdout(separator2.join(['=' + self.getProperty("cpv"),'test']) + separator1)
-            self.aftersteps_list.append(
-                        steps.StringDownload(separator2.join(['=' + self.getProperty("cpv"),'test.conf']) + separator1,
-                            workerdest='test.conf',
-                            workdir='/etc/portage/package.env/'
+                        yield log.addStdout('File: ' + 'package.use/test.conf' + separator1)
+                        yield log.addStdout(separator2.join(['=' + self.getProperty("cpv"),'test']) + separator1)
+                self.aftersteps_list.append(
+                            steps.StringDownload(separator2.join(['=' + self.getProperty("cpv"),'test.conf']) + separator1,
+                                workerdest='test.conf',
+                                workdir='/etc/portage/package.env/'
+                                )
                             )
-                        )
-            yield log.addStdout('File: ' + 'package.env/test.conf' + separator1)
-            yield log.addStdout(separator2.join(['=' + self.getProperty("cpv"),'test.conf']) + separator1)
-        yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
-        return SUCCESS
+                yield log.addStdout('File: ' + 'package.env/test.conf' + separator1)
+                yield log.addStdout(separator2.join(['=' + self.getProperty("cpv"),'test.conf']) + separator1)
+            yield self.build.addStepsAfterCurrentStep(self.aftersteps_list)
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class SetEnvDefault(BuildStep):
 
@@ -350,33 +363,36 @@ class SetEnvDefault(BuildStep):
         aftersteps_list = []
         separator1 = '\n'
         separator2 = ' '
-        log = yield self.addLog('env')
-        # create the dir
-        aftersteps_list.append(steps.MakeDirectory(dir='env',
-                                workdir='/etc/portage/'))
-        #FIXME:
-        # add env settings from the db
-        default_project_portage_env_data = yield self.gentooci.db.projects.getProjectPortageEnvByUuid(default_project_data['uuid'])
-        project_portage_env_data = yield self.gentooci.db.projects.getProjectPortageEnvByUuid(project_data['uuid'])
-        project_portage_env_dict = yield self.getPortageEnv(default_project_portage_env_data, portage_env_dict = {})
-        project_portage_env_dict = yield self.getPortageEnv(project_portage_env_data, portage_env_dict = project_portage_env_dict)
-        print(project_portage_env_dict)
-        for k, v in project_portage_env_dict.items():
-            env_strings = []
-            for a, b in v.items():
-                variable_data = yield self.gentooci.db.portages.getVariableById(a)
-                env_variable_string = variable_data['variable'] + '="' + separator2.join(b) + '"'
-                env_strings.append(env_variable_string)
-            yield self.build.addStepsAfterCurrentStep([
-            steps.StringDownload(separator1.join(env_strings) + separator1,
-                                workerdest=k + '.conf',
-                                workdir='/etc/portage/env/')
-            ])
-            yield log.addStdout('File: ' + k + '.conf' + '\n')
-            for line in env_strings:
-                yield log.addStdout(line + '\n')
-        yield self.build.addStepsAfterCurrentStep(aftersteps_list)
-        return SUCCESS
+        log = yield addBufferedLog(self, 'env')
+        try:
+            # create the dir
+            aftersteps_list.append(steps.MakeDirectory(dir='env',
+                                    workdir='/etc/portage/'))
+            #FIXME:
+            # add env settings from the db
+            default_project_portage_env_data = yield self.gentooci.db.projects.getProjectPortageEnvByUuid(default_project_data['uuid'])
+            project_portage_env_data = yield self.gentooci.db.projects.getProjectPortageEnvByUuid(project_data['uuid'])
+            project_portage_env_dict = yield self.getPortageEnv(default_project_portage_env_data, portage_env_dict = {})
+            project_portage_env_dict = yield self.getPortageEnv(project_portage_env_data, portage_env_dict = project_portage_env_dict)
+            print(project_portage_env_dict)
+            for k, v in project_portage_env_dict.items():
+                env_strings = []
+                for a, b in v.items():
+                    variable_data = yield self.gentooci.db.portages.getVariableById(a)
+                    env_variable_string = variable_data['variable'] + '="' + separator2.join(b) + '"'
+                    env_strings.append(env_variable_string)
+                yield self.build.addStepsAfterCurrentStep([
+                steps.StringDownload(separator1.join(env_strings) + separator1,
+                                    workerdest=k + '.conf',
+                                    workdir='/etc/portage/env/')
+                ])
+                yield log.addStdout('File: ' + k + '.conf' + '\n')
+                for line in env_strings:
+                    yield log.addStdout(line + '\n')
+            yield self.build.addStepsAfterCurrentStep(aftersteps_list)
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class CheckPathLocal(BuildStep):
 
@@ -399,24 +415,27 @@ class CheckPathLocal(BuildStep):
         self.repository_basedir_db = yield os.path.join(self.master.basedir, 'repositorys')
         self.build_repository_basedir_db = yield os.path.join(self.getProperty("builddir"), 'repositorys')
         #print(self.repository_basedir_db)
-        log = yield self.addLog('CheckPathLocal')
-        #print(os.getcwd())
-        print(self.getProperty("builddir"))
-        #yield os.chdir(self.getProperty("builddir"))
-        #print(os.getcwd())
-        for x in [
-                self.portage_path,
-                self.profile_path,
-                self.repos_path,
-                ]:
-            check_dir = yield os.path.join(self.getProperty("builddir"), x)
-            if not Path(check_dir).is_dir():
-                yield Path(check_dir).mkdir(parents=True)
-                yield log.addStdout(' '.join(['Makeing missing dir', x]))
-        if not Path(self.build_repository_basedir_db).is_dir():
-            yield Path(self.build_repository_basedir_db).symlink_to(self.repository_basedir_db)
-            yield log.addStdout(' '.join(['Makeing missing link', 'repositorys', 'to', self.repository_basedir_db]))
-        return SUCCESS
+        log = yield addBufferedLog(self, 'CheckPathLocal')
+        try:
+            #print(os.getcwd())
+            print(self.getProperty("builddir"))
+            #yield os.chdir(self.getProperty("builddir"))
+            #print(os.getcwd())
+            for x in [
+                    self.portage_path,
+                    self.profile_path,
+                    self.repos_path,
+                    ]:
+                check_dir = yield os.path.join(self.getProperty("builddir"), x)
+                if not Path(check_dir).is_dir():
+                    yield Path(check_dir).mkdir(parents=True)
+                    yield log.addStdout(' '.join(['Makeing missing dir', x]))
+            if not Path(self.build_repository_basedir_db).is_dir():
+                yield Path(self.build_repository_basedir_db).symlink_to(self.repository_basedir_db)
+                yield log.addStdout(' '.join(['Makeing missing link', 'repositorys', 'to', self.repository_basedir_db]))
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class SetMakeProfileLocal(BuildStep):
 
@@ -14,6 +14,8 @@ from buildbot.process.results import SKIPPED
 from buildbot.plugins import steps, util
 from buildbot.config import error as config_error
 
+from buildbot_gentoo_ci.utils.log_writer import addBufferedLog
+
 class CheckPathRepositoryLocal(BuildStep):
 
     name = 'CheckPathRepositoryLocal'
@@ -34,12 +36,15 @@ class CheckPathRepositoryLocal(BuildStep):
         print(self.gentooci.config.project['repository_basedir'])
         p = Path(self.repository_basedir_db)
         self.setProperty("repository_basedir_db", self.repository_basedir_db, 'repository_basedir_db')
-        log = yield self.addLog('CheckPathRepositoryLocal')
-        if not Path(self.repository_basedir_db).is_dir():
-            yield log.addStdout(' '.join(['Missing link', self.repository_basedir_db]))
-            p.symlink_to(self.gentooci.config.project['repository_basedir'])
-            yield log.addStdout(' '.join(['Makeing missing link', 'repositorys', 'to', self.gentooci.config.project['repository_basedir']]))
-        return SUCCESS
+        log = yield addBufferedLog(self, 'CheckPathRepositoryLocal')
+        try:
+            if not Path(self.repository_basedir_db).is_dir():
+                yield log.addStdout(' '.join(['Missing link', self.repository_basedir_db]))
+                p.symlink_to(self.gentooci.config.project['repository_basedir'])
+                yield log.addStdout(' '.join(['Makeing missing link', 'repositorys', 'to', self.gentooci.config.project['repository_basedir']]))
+            return SUCCESS
+        finally:
+            yield log.finish()
 
 class CheckRepository(BuildStep):
 
@@ -0,0 +1,102 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import os
+import json
+import hashlib
+
+# bytes we read at once when we hash a file
+READ_SIZE = 1024 * 1024
+# {file name : sha256} for the files in the build dir that is in the store
+MANIFEST_FILE = 'artifacts.json'
+# the blobs is read only, a write to a file in a build dir would change
+# it for all the builds that link to it
+BLOB_MODE = 0o444
+
+def getFileHash(file):
+    file_hash = hashlib.sha256()
+    with open(file, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if data == b'':
+                break
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+class ArtifactStore():
+    # Content addressed store for the files we upload from the builds.
+    # The file in the build dir is a hard link to the blob so the steps
+    # that read the files don't need to know about the store, and a blob
+    # with one link is not used by any build any more.
+
+    def __init__(self, path):
+        self.path = path
+
+    def getBlobPath(self, sha256):
+        return os.path.join(self.path, sha256[:2], sha256)
+
+    def addManifest(self, dest, sha256):
+        manifest_file = os.path.join(os.path.dirname(dest), MANIFEST_FILE)
+        manifest = {}
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, encoding='utf-8') as f:
+                manifest = json.load(f)
+        manifest[os.path.basename(dest)] = sha256
+        with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def linkBlob(self, sha256, dest):
+        # return False if we don't have the blob
+        blob = self.getBlobPath(sha256)
+        # a .tmp from a master that did stop here
+        try:
+            os.unlink(dest + '.tmp')
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(blob, dest + '.tmp')
+        except FileNotFoundError:
+            return False
+        # blobs from before they was read only
+        os.chmod(blob, BLOB_MODE)
+        os.replace(dest + '.tmp', dest)
+        self.addManifest(dest, sha256)
+        return True
+
+    def addFile(self, file):
+        # add the uploaded file to the store and return the sha256
+        # return None if we can't link it (not the same filesystem) or
+        # the upload did fail
+        if not os.path.isfile(file):
+            return None
+        sha256 = getFileHash(file)
+        blob = self.getBlobPath(sha256)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(file, blob)
+        except FileExistsError:
+            # we have it, use the blob and drop the upload
+            if not self.linkBlob(sha256, file):
+                return None
+            return sha256
+        except OSError as e:
+            print(f'Failed to add {file} to the artifact store: {e}')
+            return None
+        os.chmod(blob, BLOB_MODE)
+        self.addManifest(file, sha256)
+        return sha256
+
+    def removeUnused(self):
+        # remove the blobs that no build dir link to, return the number
+        # of blobs we did remove
+        removed = 0
+        if not os.path.isdir(self.path):
+            return removed
+        for blob_dir in os.listdir(self.path):
+            for blob in os.listdir(os.path.join(self.path, blob_dir)):
+                blob = os.path.join(self.path, blob_dir, blob)
+                if os.stat(blob).st_nlink == 1:
+                    os.unlink(blob)
+                    removed = removed + 1
+        return removed
@@ -0,0 +1,214 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import os
+import io
+import glob
+import gzip
+import hashlib
+import threading
+import time
+
+# The build logs older then ZSTD_LOG_DAYS is recompressed from .log.gz to
+# .log.zst with a zstd dictionary trained on our own build logs. The dictionary id is in the
+# zstd frame header so we can read a log with the dictionary it was
+# compressed with, the dictionarys is in dict_dir as <dict id>.dict and
+# the one we use now is in dict_dir/current.
+ZSTD_LEVEL = 10
+ZSTD_THREADS = 2
+# 110KB is the zstd cli default
+ZSTD_DICT_SIZE = 112640
+# logs we train the dictionary on and bytes from the start of every log
+ZSTD_DICT_SAMPLES = 200
+ZSTD_DICT_SAMPLE_SIZE = 1024 * 1024
+# days before we train a new dictionary
+ZSTD_DICT_DAYS = 30
+# seconds before we train again when zstd can't make a dictionary
+ZSTD_DICT_RETRY = 86400
+# days we keep the .log.gz, the url on the build and the log in the bug
+# is for it and a .log.zst with our dictionary can't be viewed
+ZSTD_LOG_DAYS = 14
+# logs we recompress in one compressOldLogs()
+ZSTD_COMPRESS_LOGS = 200
+# bytes we read at once
+READ_SIZE = 1024 * 1024
+
+def getZstdLogFile(log_file):
+    # foo:20210321-173525.log.gz -> foo:20210321-173525.log.zst
+    if log_file.endswith('.gz'):
+        return log_file[:-3] + '.zst'
+    return log_file + '.zst'
+
+def getBuildLogFile(log_file):
+    # the build log we have, full_logname is the .log.gz from portage
+    # and we remove it when we have recompressed it
+    if log_file.endswith('.log.gz') and not os.path.isfile(log_file) and os.path.isfile(getZstdLogFile(log_file)):
+        return getZstdLogFile(log_file)
+    return log_file
+
+def getStreamHash(f):
+    stream_hash = hashlib.sha256()
+    while True:
+        data = f.read(READ_SIZE)
+        if data == b'':
+            break
+        stream_hash.update(data)
+    return stream_hash.hexdigest()
+
+class LogCompressor():
+
+    def __init__(self, dict_dir, level=ZSTD_LEVEL, threads=ZSTD_THREADS, dict_days=ZSTD_DICT_DAYS):
+        # we only need zstandard if we use it
+        import zstandard
+        self.zstd = zstandard
+        self.dict_dir = dict_dir
+        self.level = level
+        self.threads = threads
+        self.dict_days = dict_days
+        self.dict_cache = {}
+        # one training at the time
+        self.lock = threading.Lock()
+        # time.time() of the last failed training
+        self.train_failed = None
+        # the logs where the gzip was smaller
+        self.kept_logs = set()
+
+    def getDictionary(self, dict_id):
+        if dict_id not in self.dict_cache:
+            with open(os.path.join(self.dict_dir, str(dict_id) + '.dict'), 'rb') as f:
+                self.dict_cache[dict_id] = self.zstd.ZstdCompressionDict(f.read())
+        return self.dict_cache[dict_id]
+
+    def getCurrentDictionary(self):
+        # return None if we don't have one or it is to old
+        current_file = os.path.join(self.dict_dir, 'current')
+        if not os.path.isfile(current_file):
+            return None
+        if time.time() - os.path.getmtime(current_file) > self.dict_days * 86400:
+            return None
+        with open(current_file, encoding='utf-8') as f:
+            return self.getDictionary(int(f.read().strip()))
+
+    def trainDictionary(self, log_files):
+        # train a dictionary on the start of the logs, return None if
+        # zstd can't make one from them
+        samples = []
+        for log_file in log_files:
+            try:
+                with gzip.open(log_file, 'rb') as f:
+                    samples.append(f.read(ZSTD_DICT_SAMPLE_SIZE))
+            except (OSError, EOFError):
+                continue
+        try:
+            zstd_dict = self.zstd.train_dictionary(ZSTD_DICT_SIZE, samples, level=self.level)
+        except self.zstd.ZstdError as e:
+            print(f'Failed to train a zstd dictionary on {len(samples)} logs: {e}')
+            return None
+        os.makedirs(self.dict_dir, exist_ok=True)
+        dict_file = os.path.join(self.dict_dir, str(zstd_dict.dict_id()) + '.dict')
+        with open(dict_file + '.tmp', 'wb') as f:
+            f.write(zstd_dict.as_bytes())
+        os.replace(dict_file + '.tmp', dict_file)
+        current_file = os.path.join(self.dict_dir, 'current')
+        with open(current_file + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(zstd_dict.dict_id()))
+        os.replace(current_file + '.tmp', current_file)
+        self.dict_cache[zstd_dict.dict_id()] = zstd_dict
+        return zstd_dict
+
+    def getTrainedDictionary(self, log_files):
+        # the current dictionary, or a new one trained on the last of the
+        # logs (oldest first), None if the training did fail less then
+        # ZSTD_DICT_RETRY ago
+        with self.lock:
+            zstd_dict = self.getCurrentDictionary()
+            if zstd_dict is not None:
+                return zstd_dict
+            if self.train_failed is not None and time.time() - self.train_failed < ZSTD_DICT_RETRY:
+                return None
+            zstd_dict = self.trainDictionary(log_files[-ZSTD_DICT_SAMPLES:])
+            if zstd_dict is None:
+                self.train_failed = time.time()
+            return zstd_dict
+
+    def compressOldLogs(self, workers_dir, log_days, max_logs=ZSTD_COMPRESS_LOGS):
+        # recompress the .log.gz in workers/<worker>/<build>/ older then
+        # log_days, max_logs of them and the oldest first, the dictionary
+        # is trained on the newest logs from the same glob
+        # return the number of logs we did recompress
+        log_mtimes = {}
+        for log_file in glob.glob(os.path.join(workers_dir, '*', '*', '*.log.gz')):
+            try:
+                log_mtimes[log_file] = os.path.getmtime(log_file)
+            except FileNotFoundError:
+                continue
+        log_files = sorted(log_mtimes, key=log_mtimes.get)
+        old_time = time.time() - log_days * 86400
+        old_logs = [log_file for log_file in log_files if log_mtimes[log_file] < old_time and log_file not in self.kept_logs][:max_logs]
+        if old_logs == []:
+            return 0
+        zstd_dict = self.getTrainedDictionary(log_files)
+        compressed = 0
+        for log_file in old_logs:
+            try:
+                if self.compressLog(log_file, zstd_dict) == log_file:
+                    self.kept_logs.add(log_file)
+                else:
+                    compressed = compressed + 1
+            except (OSError, EOFError, ValueError, self.zstd.ZstdError) as e:
+                print(f'Failed to recompress {log_file}: {e}')
+                self.kept_logs.add(log_file)
+        return compressed
+
+    def compressLog(self, log_file, zstd_dict):
+        # recompress the .log.gz and remove it when the .log.zst have the
+        # same text, return the log we keep
+        zst_file = getZstdLogFile(log_file)
+        cctx = self.zstd.ZstdCompressor(level=self.level, dict_data=zstd_dict, threads=self.threads, write_checksum=True)
+        with gzip.open(log_file, 'rb') as src, open(zst_file + '.tmp', 'wb') as dst:
+            cctx.copy_stream(src, dst, read_size=READ_SIZE, write_size=READ_SIZE)
+        with gzip.open(log_file, 'rb') as f:
+            gz_hash = getStreamHash(f)
+        with self.openLog(zst_file + '.tmp') as f:
+            zst_hash = getStreamHash(f)
+        if gz_hash != zst_hash:
+            os.unlink(zst_file + '.tmp')
+            raise ValueError('The zstd log is not the same as ' + log_file)
+        # we keep the gzip if it is smaller
+        if os.path.getsize(zst_file + '.tmp') >= os.path.getsize(log_file):
+            os.unlink(zst_file + '.tmp')
+            return log_file
+        os.replace(zst_file + '.tmp', zst_file)
+        os.unlink(log_file)
+        # the log index from older masters is for the gzip
+        if os.path.isfile(log_file + '.idx'):
+            os.unlink(log_file + '.idx')
+        return zst_file
+
+    def getDictionaryFile(self, file):
+        # the dictionary the zstd log was compressed with, None if it
+        # was compressed without one
+        with open(file, 'rb') as f:
+            dict_id = self.zstd.get_frame_parameters(f.read(18)).dict_id
+        if not dict_id:
+            return None
+        return os.path.join(self.dict_dir, str(dict_id) + '.dict')
+
+    def openLog(self, file):
+        # binary file object for the zstd log
+        f = open(file, 'rb')
+        try:
+            dict_id = self.zstd.get_frame_parameters(f.read(18)).dict_id
+            f.seek(0)
+            dctx = self.zstd.ZstdDecompressor(dict_data=self.getDictionary(dict_id) if dict_id else None)
+            return io.BufferedReader(dctx.stream_reader(f, read_size=READ_SIZE, read_across_frames=True, closefd=True), READ_SIZE)
+        except Exception:
+            f.close()
+            raise
+
+def openBuildLog(file, dict_dir):
+    # binary file object for the build log, .log.gz or .log.zst
+    file = getBuildLogFile(file)
+    if file.endswith('.zst'):
+        return LogCompressor(dict_dir).openLog(file)
+    return io.BufferedReader(gzip.open(file, 'rb'))
@@ -0,0 +1,46 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import hashlib
+import re
+
+# the parts of a error line that change from build to build
+# paths, we keep the file name
+PATH_RE = re.compile(r'(?:[\w.+-]*/)+(?=[^\s/:\'"`()\[\]]+)')
+# 0x7ffd4c2a1b30
+ADDRESS_RE = re.compile(r'\b0x[0-9a-fA-F]+\b')
+# 1.2.3, 1.2.3_rc1-r2
+VERSION_RE = re.compile(r'\b\d+(?:\.\d+)+[a-z]?(?:_(?:alpha|beta|pre|rc|p)\d*)*(?:-r\d+)?\b')
+# foo.c:12:5: and line 12
+LINE_RE = re.compile(r'(:|\bline )\d+\b')
+SPACE_RE = re.compile(r'\s+')
+# the title when we don't have a error line, all the builds like that
+# would have the same fingerprint so we don't make one for them
+NO_ERROR_TITLE = 'title_issue : None'
+
+def getNormalizedErrorLine(error_line):
+    error_line = PATH_RE.sub('', error_line)
+    error_line = ADDRESS_RE.sub('<address>', error_line)
+    error_line = VERSION_RE.sub('<version>', error_line)
+    error_line = LINE_RE.sub(r'\1<line>', error_line)
+    return SPACE_RE.sub(' ', error_line).strip()
+
+def getErrorFingerprint(phase, error_line):
+    # return the sha256 of the phase and the normalized error line
+    # and the normalized error line
+    normalized_line = getNormalizedErrorLine(error_line)
+    fingerprint = hashlib.sha256('\n'.join([phase, normalized_line]).encode('utf-8')).hexdigest()
+    return fingerprint, normalized_line
+
+def getErrorPhase(text):
+    # the phase from ' * ERROR: cat/pkg-1.0::gentoo failed (compile phase):'
+    if text.startswith(' * ERROR:') and text.endswith(' phase):'):
+        return text.split(' (')[1].split(' phase')[0]
+    return None
+
+def getErrorTitle(summary_log_dict, phase):
+    # the first error line in the phase that did fail
+    for k, v in sorted(summary_log_dict.items()):
+        if v['type'] == phase and v['status'] == 'error':
+            return v['text'].replace('*', '').strip()
+    return NO_ERROR_TITLE
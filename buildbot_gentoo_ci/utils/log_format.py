@@ -0,0 +1,39 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+# The formats log_parser.py and the master share. This file only use the
+# python stdlib as it is uploaded to the workers next to log_parser.py
+
+import re
+import struct
+
+# version of the pattern bundle the master make for log_parser.py
+PATTERN_BUNDLE_VERSION = 1
+
+# ansi escape sequences in colored build output
+# OSC and the other string sequences end with BEL or ESC \ (or the line),
+# CSI is ESC [ params intermediates final and the rest is ESC and
+# intermediates and a final byte
+ANSI_ESCAPE_RE = re.compile(rb'\x1b(?:[\]PX^_][^\x07\x1b\n]*(?:\x07|\x1b\\)?|\[[0-?]*[ -/]*[@-~]|[ -/]*[0-~])')
+
+# The result document log_parser.py write with -o, gzip of:
+# magic, version (B) and frames of kind (B), payload length (I) and payload
+# HEADER json with the type, status and source enum lists
+# LINE index (I), pattern id (I), type (B), status (B), source (B), text
+# PATTERN json {pattern id : search} for the pattern in the LINE frames
+# PATTERN_STATS json {pattern id : [evaluations, hits, match time]}
+# END number of LINE frames (I), a document without it is not complete
+RESULT_MAGIC = b'GCLPR'
+RESULT_VERSION = 1
+RESULT_FRAME = struct.Struct('<BI')
+RESULT_LINE = struct.Struct('<IIBBB')
+RESULT_END = struct.Struct('<I')
+RESULT_FRAME_HEADER = 1
+RESULT_FRAME_LINE = 2
+RESULT_FRAME_PATTERN = 3
+RESULT_FRAME_PATTERN_STATS = 4
+RESULT_FRAME_END = 5
+RESULT_TYPE = ['info', 'qa', 'compile', 'configure', 'install', 'postinst', 'prepare', 'pretend', 'setup', 'test', 'unpack', 'ignore', 'issues', 'misc', 'elog']
+RESULT_STATUS = ['info', 'warning', 'ignore', 'error']
+# search_pattern of the summary line, a match use the pattern search
+RESULT_SOURCE = ['match', 'context', 'auto']
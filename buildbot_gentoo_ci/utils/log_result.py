@@ -0,0 +1,66 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import gzip
+import json
+import struct
+
+from buildbot_gentoo_ci.utils.log_format import RESULT_MAGIC, RESULT_VERSION, RESULT_FRAME, RESULT_LINE, RESULT_END, \
+    RESULT_FRAME_HEADER, RESULT_FRAME_LINE, RESULT_FRAME_PATTERN, RESULT_FRAME_PATTERN_STATS, RESULT_FRAME_END
+
+def readResultFrame(f):
+    frame = f.read(RESULT_FRAME.size)
+    if len(frame) != RESULT_FRAME.size:
+        raise ValueError('Result document is truncated')
+    kind, size = RESULT_FRAME.unpack(frame)
+    payload = f.read(size)
+    if len(payload) != size:
+        raise ValueError('Result document is truncated')
+    return kind, payload
+
+def readLogParserResult(file):
+    # return the summary_log_dict in the same format as the json
+    # output and the pattern stats (None if the log parser did run
+    # without -s), raise ValueError if the document is not vaild
+    summary_log_dict = {}
+    pattern_stats = None
+    line_list = []
+    header = None
+    with gzip.open(file, 'rb') as f:
+        if f.read(len(RESULT_MAGIC)) != RESULT_MAGIC:
+            raise ValueError('Not a log parser result document')
+        version = f.read(1)
+        if version != struct.pack('<B', RESULT_VERSION):
+            raise ValueError('Unknown result document version')
+        while True:
+            kind, payload = readResultFrame(f)
+            if kind == RESULT_FRAME_HEADER:
+                header = json.loads(payload)
+            elif kind == RESULT_FRAME_LINE:
+                line_list.append((RESULT_LINE.unpack_from(payload), payload[RESULT_LINE.size:].decode('utf-8')))
+            elif kind == RESULT_FRAME_PATTERN:
+                pattern_dict = json.loads(payload)
+            elif kind == RESULT_FRAME_PATTERN_STATS:
+                pattern_stats = json.loads(payload)
+            elif kind == RESULT_FRAME_END:
+                lines = RESULT_END.unpack(payload)[0]
+                break
+            # we skip frames we don't know about
+    if header is None:
+        raise ValueError('Result document without header')
+    if lines != len(line_list):
+        raise ValueError('Result document have ' + str(len(line_list)) + ' lines and not ' + str(lines))
+    for (index, pattern_id, type_enum, status_enum, source_enum), text in line_list:
+        source = header['source'][source_enum]
+        if source == 'match':
+            search_pattern = pattern_dict[str(pattern_id)]
+        else:
+            search_pattern = source
+        summary_log_dict[index] = {
+                                'text' : text,
+                                'type' : header['type'][type_enum],
+                                'status' : header['status'][status_enum],
+                                'id' : pattern_id,
+                                'search_pattern' : search_pattern
+                                }
+    return summary_log_dict, pattern_stats
@@ -0,0 +1,46 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+from twisted.internet import defer
+
+# Every log.addStdout() is a log chunk write to the buildbot db, so we
+# buffer the text and write it in chunks of this size. buildbot split
+# the text it get in chunks of max 64KB and we write when we are over
+# the size, so we leave room for the last line.
+LOG_CHUNK_SIZE = 63 * 1024
+
+class BufferedLogWriter():
+    # Have the same addStdout() as the buildbot log so the steps can add
+    # the text line for line, finish() must be called before the step end,
+    # in a finally so a return or a error don't lose the last text.
+
+    def __init__(self, log, chunk_size=LOG_CHUNK_SIZE):
+        self.log = log
+        self.chunk_size = chunk_size
+        self.text_list = []
+        self.size = 0
+
+    def addStdout(self, text):
+        self.text_list.append(text)
+        self.size = self.size + len(text)
+        if self.size >= self.chunk_size:
+            return self.flush()
+        return defer.succeed(None)
+
+    def flush(self):
+        if self.text_list == []:
+            return defer.succeed(None)
+        text = ''.join(self.text_list)
+        self.text_list = []
+        self.size = 0
+        return self.log.addStdout(text)
+
+    @defer.inlineCallbacks
+    def finish(self):
+        yield self.flush()
+        yield self.log.finish()
+
+@defer.inlineCallbacks
+def addBufferedLog(step, name, chunk_size=LOG_CHUNK_SIZE):
+    log = yield step.addLog(name)
+    return BufferedLogWriter(log, chunk_size=chunk_size)
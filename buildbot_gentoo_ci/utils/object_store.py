@@ -0,0 +1,95 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import os
+import shutil
+import datetime
+
+# min part size for a s3 multipart upload is 5MB
+PART_SIZE = 16 * 1024 * 1024
+PART_THREADS = 2
+
+# The object stores have the same interface, putFile() and
+# getPresignedPutUrl() is blocking and is run in the object store thread
+# pool by GentooCiService.
+
+class MinioStore():
+
+    def __init__(self, url, user, password, secure=False, part_size=PART_SIZE, part_threads=PART_THREADS):
+        # we only need minio if we use it
+        from minio import Minio
+        from minio.error import S3Error
+        self.S3Error = S3Error
+        # the client keep a pool of connections and is thread safe so we
+        # use the same client for all the uploads
+        self.client = Minio(
+            url,
+            access_key = user,
+            secret_key = password,
+            secure = secure
+            )
+        self.part_size = part_size
+        self.part_threads = part_threads
+        self.buckets = set()
+
+    def makeBucket(self, bucket):
+        if bucket in self.buckets:
+            return
+        if not self.client.bucket_exists(bucket):
+            # a other upload thread can make it after bucket_exists
+            try:
+                self.client.make_bucket(bucket)
+            except self.S3Error as e:
+                if e.code != 'BucketAlreadyOwnedByYou':
+                    raise
+        self.buckets.add(bucket)
+
+    def putFile(self, bucket, target, filename):
+        self.makeBucket(bucket)
+        # fput_object use multipart upload for files bigger then
+        # part_size and send part_threads parts at the same time
+        self.client.fput_object(bucket, target, filename,
+                                part_size=self.part_size,
+                                num_parallel_uploads=self.part_threads)
+
+    def getPresignedPutUrl(self, bucket, target, expires):
+        # url the worker can PUT the file to without the password
+        self.makeBucket(bucket)
+        return self.client.presigned_put_object(bucket, target, expires=datetime.timedelta(seconds=expires))
+
+class LocalStore():
+    # a dir on the master with a dir for every bucket, for testing
+    # the workers can't write to it so it can't be used with presigned
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def getPath(self, bucket, target):
+        path = os.path.normpath(os.path.join(self.path, bucket, target))
+        if not path.startswith(self.path + os.sep):
+            raise ValueError('Object ' + bucket + '/' + target + ' is outside the store')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def putFile(self, bucket, target, filename):
+        path = self.getPath(bucket, target)
+        shutil.copyfile(filename, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def getPresignedPutUrl(self, bucket, target, expires):
+        # a file:// url would make the worker write to its own disk
+        raise ValueError('The local object store have no url the workers can upload to')
+
+def getObjectStore(object_store_config, basedir):
+    if object_store_config['type'] == 'minio':
+        return MinioStore(object_store_config['url'],
+                        object_store_config['user'],
+                        object_store_config['password'],
+                        secure=object_store_config.get('secure', False),
+                        part_size=int(object_store_config.get('part_size', PART_SIZE)),
+                        part_threads=int(object_store_config.get('part_threads', PART_THREADS)))
+    if object_store_config['type'] == 'local':
+        if object_store_config.get('presigned', False):
+            raise ValueError('The local object store can\'t be used with presigned')
+        return LocalStore(os.path.join(basedir, object_store_config.get('path', 'object_store')))
+    raise ValueError('Unknown object store type ' + object_store_config['type'])
@@ -0,0 +1,70 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import re
+
+def getSearchBytes(project_pattern):
+    # the pattern we match on the bytes of the log lines
+    # raise re.error if the regex is not vaild
+    search = project_pattern['search'].encode('utf-8')
+    if project_pattern['search_type'] == 'search':
+        return re.compile(search)
+    return search
+
+def getCompiledPattern(project_pattern_list):
+    # return a copy of the vaild pattern with the compiled search
+    # in search_bytes
+    compiled_pattern_list = []
+    for project_pattern in project_pattern_list:
+        try:
+            search_bytes = getSearchBytes(project_pattern)
+        except re.error:
+            print("Non valid regex pattern")
+            print(project_pattern)
+            continue
+        compiled_pattern = dict(project_pattern)
+        compiled_pattern['start'] = compiled_pattern['start'] or 0
+        compiled_pattern['end'] = compiled_pattern['end'] or 0
+        compiled_pattern['search_bytes'] = search_bytes
+        compiled_pattern_list.append(compiled_pattern)
+    return compiled_pattern_list
+
+def getPatternDict(compiled_pattern):
+    # the pattern without the compiled search so we can json it
+    pattern_dict = dict(compiled_pattern)
+    del pattern_dict['search_bytes']
+    return pattern_dict
+
+# the parts of a info line that change from build to build
+# paths, addresses, versions and numbers
+NOISE_VARIABLE_RE = re.compile(r'(?:[\w.+~@-]*/)+[\w.+~@-]*|\b0x[0-9a-fA-F]+\b|\b\d+(?:\.\d+)*[a-z]?(?:_(?:alpha|beta|pre|rc|p)\d*)*(?:-r\d+)?\b')
+# the template need this many chars that is not variable, ' * <path>'
+# would ignore every einfo line with one word
+NOISE_MIN_CONSTANT = 4
+# re.escape() escape spaces to and the search is only 50 chars in the db
+NOISE_ESCAPE_RE = re.compile(r'([.^$*+?{}\[\]\\|()])')
+
+def getNoiseSearch(text):
+    # return a regex for the line with the variable parts as \S+ that
+    # match the whole line or None if the line is to generic
+    search_list = ['^']
+    constant = 0
+    pos = 0
+    for variable_match in NOISE_VARIABLE_RE.finditer(text):
+        if variable_match.start() == variable_match.end():
+            continue
+        search_list.append(NOISE_ESCAPE_RE.sub(r'\\\1', text[pos:variable_match.start()]))
+        constant = constant + variable_match.start() - pos
+        if search_list[-1] != '' or search_list[-2] != r'\S+':
+            search_list.append(r'\S+')
+        pos = variable_match.end()
+    search_list.append(NOISE_ESCAPE_RE.sub(r'\\\1', text[pos:]))
+    constant = constant + len(text) - pos
+    search_list.append('$')
+    if constant < NOISE_MIN_CONSTANT:
+        return None
+    search = ''.join(search_list)
+    # \S+ can't match a variable part with spaces in it
+    if not re.search(search.encode('utf-8'), text.encode('utf-8')):
+        return None
+    return search
@@ -0,0 +1,121 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+import sqlite3
+import threading
+import time
+
+# The full-text index of the build summaries (and the build logs if we
+# want) in a local SQLite db with FTS5. The rowid of a line is the build
+# id << 32 | line index so we can remove a build with a rowid range.
+# The summaries use the trigram tokenizer so a search is a substring
+# search like grep, the logs use unicode61 to keep the index smaller.
+SEARCH_INDEX_TABLES = [
+    'CREATE TABLE IF NOT EXISTS builds (build_id INTEGER PRIMARY KEY, project_uuid TEXT NOT NULL, cpv TEXT NOT NULL, created_at INTEGER NOT NULL, log INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS builds_created_at ON builds (created_at)',
+    'CREATE INDEX IF NOT EXISTS builds_project_uuid ON builds (project_uuid, created_at)',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS summary_fts USING fts5(text, type UNINDEXED, status UNINDEXED, tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(text, tokenize=\"unicode61 tokenchars '_'\")",
+    ]
+
+def getRowid(build_id, line_index):
+    return build_id << 32 | line_index
+
+def getPhraseQuery(text):
+    # search for the text as it is and not as a fts5 query
+    return '"' + text.replace('"', '""') + '"'
+
+class SearchIndex():
+
+    def __init__(self, path):
+        self.path = path
+        # one writer at the time, sqlite would only make us wait
+        self.lock = threading.Lock()
+        conn = sqlite3.connect(self.path, timeout=60)
+        # must be set before the db is made, we give the pages from
+        # expired builds back in expire()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # the search don't wait on the writer
+        conn.execute('PRAGMA journal_mode = WAL')
+        with conn:
+            for sql in SEARCH_INDEX_TABLES:
+                conn.execute(sql)
+        conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def removeBuild(self, conn, build_id):
+        for table in ['summary_fts', 'log_fts']:
+            conn.execute('DELETE FROM ' + table + ' WHERE rowid BETWEEN ? AND ?', (getRowid(build_id, 0), getRowid(build_id + 1, 0) - 1))
+        conn.execute('DELETE FROM builds WHERE build_id = ?', (build_id,))
+
+    def addBuild(self, build_id, project_uuid, cpv, summary_log_dict, log_lines=None, created_at=None):
+        # add or replace the build, log_lines is (index, text) for the
+        # whole log if we index it
+        if created_at is None:
+            created_at = int(time.time())
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                self.removeBuild(conn, build_id)
+                conn.execute('INSERT INTO builds VALUES (?, ?, ?, ?, ?)', (build_id, project_uuid, cpv, created_at, log_lines is not None))
+                conn.executemany('INSERT INTO summary_fts (rowid, text, type, status) VALUES (?, ?, ?, ?)',
+                                ((getRowid(build_id, k), v['text'], v['type'], v['status']) for k, v in summary_log_dict.items()))
+                if log_lines is not None:
+                    conn.executemany('INSERT INTO log_fts (rowid, text) VALUES (?, ?)',
+                                    ((getRowid(build_id, k), text) for k, text in log_lines))
+            conn.close()
+
+    def expire(self, days):
+        # remove the builds older then days and give the pages back
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                build_list = conn.execute('SELECT build_id FROM builds WHERE created_at < ?', (int(time.time()) - days * 86400,)).fetchall()
+                for row in build_list:
+                    self.removeBuild(conn, row[0])
+                # fts5 only mark the rows as deleted until the
+                # segments is merged
+                if build_list != []:
+                    for table in ['summary_fts', 'log_fts']:
+                        conn.execute('INSERT INTO ' + table + ' (' + table + ") VALUES ('optimize')")
+            # execute() only step it once and free one page
+            conn.executescript('PRAGMA incremental_vacuum')
+            conn.close()
+            return len(build_list)
+
+    def search(self, text, project_uuid=None, days=None, log=False, limit=100, raw=False):
+        # the lines that match the text, newest build first
+        # text is a fts5 query if raw
+        table = 'log_fts' if log else 'summary_fts'
+        fields = ', s.type, s.status' if not log else ''
+        sql = 'SELECT b.build_id, b.project_uuid, b.cpv, b.created_at, s.rowid & 4294967295, s.text' + fields + ' FROM ' + table + ' s JOIN builds b ON b.build_id = s.rowid >> 32 WHERE ' + table + ' MATCH ?'
+        args = [text if raw else getPhraseQuery(text)]
+        if project_uuid is not None:
+            sql = sql + ' AND b.project_uuid = ?'
+            args.append(project_uuid)
+        if days is not None:
+            sql = sql + ' AND b.created_at >= ?'
+            args.append(int(time.time()) - days * 86400)
+        sql = sql + ' ORDER BY b.created_at DESC, s.rowid LIMIT ?'
+        args.append(limit)
+        conn = self.connect()
+        try:
+            result = []
+            for row in conn.execute(sql, args):
+                line = dict(
+                    build_id=row[0],
+                    project_uuid=row[1],
+                    cpv=row[2],
+                    created_at=row[3],
+                    line_index=row[4],
+                    text=row[5]
+                    )
+                if not log:
+                    line['type'] = row[6]
+                    line['status'] = row[7]
+                result.append(line)
+            return result
+        finally:
+            conn.close()
@@ -3,27 +3,84 @@
 
 import sys
 from multiprocessing import Pool, cpu_count
+from collections import deque
 import re
 import io
 import gzip
 import json
 import os
-from sqlalchemy.ext.declarative import declarative_base
-import sqlalchemy as sa
+import hashlib
 import argparse
+import socket
+import socketserver
+import struct
+import bisect
+import ctypes
+import ctypes.util
+import fcntl
+import threading
+import time
+import zlib
 
-Base = declarative_base()
+# the formats we share with the master, log_format.py is uploaded next
+# to us, on the master it is in the buildbot_gentoo_ci package
+try:
+    from log_format import *
+except ImportError:
+    from buildbot_gentoo_ci.utils.log_format import *
 
-class ProjectsPattern(Base):
-    __tablename__ = "projects_pattern"
-    id = sa.Column(sa.Integer, primary_key=True)
-    project_uuid = sa.Column(sa.String(36), nullable=False)
-    search = sa.Column(sa.String(50), nullable=False)
-    start = sa.Column(sa.Integer, default=0)
-    end = sa.Column(sa.Integer, default=0)
-    status = sa.Column(sa.Enum('info', 'warning', 'ignore', 'error'), default='info')
-    type = sa.Column(sa.Enum('info', 'qa', 'compile', 'configure', 'install', 'postinst', 'prepare', 'pretend', 'setup', 'test', 'unpack', 'ignore', 'issues', 'misc', 'elog'), default='info')
-    search_type = sa.Column(sa.Enum('in', 'startswith', 'endswith', 'search'), default='in')
+# bytes we read from the log at once
+READ_SIZE = 1024 * 1024
+
+# The log index we write with -i, zran style points in the gzip so we can
+# start the inflate near a line and not at the start of the log:
+# magic, version (B), number of points (I) and the points with
+# uncompressed offset (Q), compressed offset (Q), bits (B), window size (I)
+# and the zlib compressed window, number of lines (I) and the lines with
+# line index (Q) and uncompressed offset (Q) of the line
+INDEX_MAGIC = b'GCLPI'
+INDEX_VERSION = 1
+INDEX_POINT = struct.Struct('<QQBI')
+INDEX_LINE = struct.Struct('<QQ')
+INDEX_COUNT = struct.Struct('<I')
+# uncompressed bytes between the points and the inflate window we need
+INDEX_SPAN = 4 * 1024 * 1024
+INDEX_WINDOW = 32768
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+# how often we look for new data in the followed build logs
+FOLLOW_POLL = 1
+
+# the zstd dictionarys for the .log.zst logs the master recompress the
+# .log.gz to, <dict id>.dict, the dict id is in the zstd frame header.
+# The master have them in basedir/zstd and download the one a log need
+# to zstd/ next to us, we don't use the cwd as we run from any dir
+ZSTD_DICT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zstd')
+
+# The result document we write with -o is RESULT_* in log_format.py
+
+def getProjectsPatternModel():
+    # sqlalchemy is only needed when we get the pattern from the db
+    from sqlalchemy.ext.declarative import declarative_base
+    import sqlalchemy as sa
+
+    Base = declarative_base()
+
+    class ProjectsPattern(Base):
+        __tablename__ = "projects_pattern"
+        id = sa.Column(sa.Integer, primary_key=True)
+        project_uuid = sa.Column(sa.String(36), nullable=False)
+        search = sa.Column(sa.String(50), nullable=False)
+        start = sa.Column(sa.Integer, default=0)
+        end = sa.Column(sa.Integer, default=0)
+        status = sa.Column(sa.Enum('info', 'warning', 'ignore', 'error'), default='info')
+        type = sa.Column(sa.Enum('info', 'qa', 'compile', 'configure', 'install', 'postinst', 'prepare', 'pretend', 'setup', 'test', 'unpack', 'ignore', 'issues', 'misc', 'elog'), default='info')
+        search_type = sa.Column(sa.Enum('in', 'startswith', 'endswith', 'search'), default='in')
+
+    return ProjectsPattern
 
 def get_pattern_dict(project_pattern):
     patten_dict = {}
@@ -32,14 +89,21 @@ def get_pattern_dict(project_pattern):
     patten_dict['search'] = project_pattern.search
     patten_dict['status'] = project_pattern.status
     patten_dict['type'] = project_pattern.type
+    patten_dict['search_type'] = project_pattern.search_type
+    patten_dict['start'] = project_pattern.start or 0
+    patten_dict['end'] = project_pattern.end or 0
     return patten_dict
 
-def addPatternToList(Session, log_search_pattern, uuid):
+def addPatternToList(Session, ProjectsPattern, log_search_pattern, uuid, ignore_set=set()):
     for project_pattern in Session.query(ProjectsPattern).filter_by(project_uuid=uuid).all():
+        # the default project pattern the project ignore
+        if project_pattern.search in ignore_set:
+            continue
         # check if the search pattern is vaild
         project_pattern_search = project_pattern.search
         try:
-            re.compile(project_pattern_search)
+            # we match the pattern on the bytes of the log lines
+            re.compile(project_pattern_search.encode('utf-8'))
         except re.error:
             print("Non valid regex pattern")
             print(project_pattern.search)
@@ -59,42 +123,259 @@ def get_log_search_pattern(Session, uuid, default_uuid):
     log_search_pattern['ignore'] = []
     log_search_pattern['default'] = []
     log_search_pattern['test'] = []
-    log_search_pattern = addPatternToList(Session, log_search_pattern, uuid)
-    log_search_pattern = addPatternToList(Session, log_search_pattern, default_uuid)
+    ProjectsPattern = getProjectsPatternModel()
+    log_search_pattern = addPatternToList(Session, ProjectsPattern, log_search_pattern, uuid)
+    ignore_set = set(project_pattern.search for project_pattern in Session.query(ProjectsPattern).filter_by(project_uuid=uuid, status='ignore').all())
+    log_search_pattern = addPatternToList(Session, ProjectsPattern, log_search_pattern, default_uuid, ignore_set)
     return log_search_pattern
 
-def get_search_pattern_match(log_search_pattern, text_line):
-    for search_pattern in log_search_pattern:
-        if re.search(search_pattern['search'], text_line):
-            return search_pattern
-    return False
+def get_log_search_pattern_bundle(file):
+    # the bundle is made by the master, named after the sha256 of it
+    # and have the pattern checked and sorted as get_log_search_pattern()
+    with open(file, 'rb') as f:
+        bundle_data = f.read()
+    if hashlib.sha256(bundle_data).hexdigest() != os.path.basename(file).split('.')[0]:
+        print(f'Pattern bundle {file} don\'t match the hash')
+        sys.exit(1)
+    bundle = json.loads(bundle_data)
+    if bundle['version'] != PATTERN_BUNDLE_VERSION:
+        print(f"Pattern bundle version {bundle['version']} is not supported")
+        sys.exit(1)
+    return bundle['log_search_pattern']
 
-def search_buildlog(log_search_pattern, text_line, index):
-    summary = {}
+# sre_parse is deprecated from python 3.11
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL
+except ImportError:
+    import sre_parse
+    from sre_constants import LITERAL
+
+WORD_RE = re.compile(rb'\w+')
+
+# shortest literal we use in the prefilter
+MIN_LITERAL_SIZE = 3
+# longest line we walk with the literal automaton, on longer lines the
+# str 'in' for every literal is faster then the python loop over the
+# bytes (about 11us against 20us on 70 byte lines and 180us against
+# 135us on 1300 byte compiler lines with the 172 literals of
+# search_pattern.sql)
+AUTOMATON_MAX_LINE = 128
+
+class LiteralAutomaton():
+    # Aho-Corasick automaton for the literals of the prefilter, search()
+    # give the priority of all the literals in the line in one walk
+    # over the bytes and not one 'in' for every literal.
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, literal, priority):
+        state = 0
+        for char in literal:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(priority)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                fail_state = self.goto[fail_state].get(char, 0)
+                self.fail[next_state] = fail_state
+                self.output[next_state] = self.output[next_state] + self.output[fail_state]
+
+    def search(self, text_line):
+        # set of priority of the literals in the text line
+        priority_set = set()
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for char in text_line:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                priority_set.update(output[state])
+        return priority_set
+
+def getRequiredLiterals(search):
+    # return the literal runs a regex need on the top level to match
+    try:
+        parsed = sre_parse.parse(search)
+    except (re.error, RecursionError):
+        return []
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+    literal_list = []
+    literal = bytearray()
+    for op, av in parsed:
+        if op is LITERAL:
+            literal.append(av)
+            continue
+        literal_list.append(bytes(literal))
+        literal = bytearray()
+    literal_list.append(bytes(literal))
+    return [literal for literal in literal_list if literal != b'']
+
+def getRequiredWord(literal_list):
+    # a word inside a literal with non word chars on both sides will be
+    # a whole word in the text line to
+    best = None
+    for literal in literal_list:
+        for word_match in WORD_RE.finditer(literal):
+            if word_match.start() == 0 or word_match.end() == len(literal):
+                continue
+            if best is None or len(word_match.group()) > len(best):
+                best = word_match.group()
+    return best
+
+class PatternMatcher():
+    # Compile a list of pattern dicts once and return the first pattern,
+    # in list order, that match a text line. The pattern are compiled to
+    # bytes and match on the undecoded text line.
+    # The regex are only run when the literal they need is in the line.
+    def __init__(self, search_pattern_list):
+        self.search_pattern_list = search_pattern_list
+        # priority -> compiled regex
+        self.regex_dict = {}
+        # word -> [priority] for regex that need a whole word
+        self.word_dict = {}
+        # [(priority, literal)] for regex that need a literal and the
+        # same literals in the automaton for the short lines
+        self.literal_list = []
+        self.automaton = LiteralAutomaton()
+        # regex we can't prefilter
+        self.unfiltered_list = []
+        for priority, search_pattern in enumerate(search_pattern_list):
+            search_type = search_pattern.get('search_type', 'search')
+            search = search_pattern['search'].encode('utf-8')
+            # make a regex of the text pattern so they use the prefilter to
+            if search_type == 'in':
+                search = re.escape(search)
+            if search_type == 'startswith':
+                search = rb'\A' + re.escape(search)
+            if search_type == 'endswith':
+                search = re.escape(search) + rb'\Z'
+            self.regex_dict[priority] = re.compile(search)
+            required_literals = getRequiredLiterals(search)
+            word = getRequiredWord(required_literals)
+            if word is not None:
+                self.word_dict.setdefault(word, []).append(priority)
+                continue
+            required_literals = [literal for literal in required_literals if len(literal) >= MIN_LITERAL_SIZE]
+            if required_literals != []:
+                literal = max(required_literals, key=len)
+                self.automaton.add(literal, priority)
+                # latin-1 map every byte to one char
+                self.literal_list.append((priority, literal.decode('latin-1')))
+            else:
+                self.unfiltered_list.append(priority)
+        self.automaton.build()
+
+    def get_candidates(self, text_line):
+        # priority of the regex that can match the text line
+        candidates = list(self.unfiltered_list)
+        if len(text_line) <= AUTOMATON_MAX_LINE:
+            candidates.extend(self.automaton.search(text_line))
+        else:
+            # str in is a lot faster then bytes in, the latin-1 text has
+            # the same substrings as the bytes
+            latin_text_line = text_line.decode('latin-1')
+            for priority, literal in self.literal_list:
+                if literal in latin_text_line:
+                    candidates.append(priority)
+        for word in self.word_dict.keys() & set(WORD_RE.findall(text_line)):
+            candidates.extend(self.word_dict[word])
+        candidates.sort()
+        return candidates
+
+    def match_priority(self, text_line):
+        for priority in self.get_candidates(text_line):
+            if self.regex_dict[priority].search(text_line):
+                return priority
+        return None
+
+    def match_priority_stats(self, text_line, pattern_stats):
+        # same as match_priority() but add evaluations, hits and match
+        # time by pattern id to pattern_stats
+        for priority in self.get_candidates(text_line):
+            start_time = time.perf_counter()
+            search_match = self.regex_dict[priority].search(text_line)
+            match_time = time.perf_counter() - start_time
+            stats = pattern_stats.setdefault(self.search_pattern_list[priority]['id'], [0, 0, 0.0])
+            stats[0] = stats[0] + 1
+            stats[2] = stats[2] + match_time
+            if search_match:
+                stats[1] = stats[1] + 1
+                return priority
+        return None
+
+    def match(self, text_line, pattern_stats=None):
+        if pattern_stats is None:
+            priority = self.match_priority(text_line)
+        else:
+            priority = self.match_priority_stats(text_line, pattern_stats)
+        if priority is None:
+            return False
+        return self.search_pattern_list[priority]
+
+def compile_log_search_pattern(log_search_pattern):
+    compiled_search_pattern = {}
+    for k, v in log_search_pattern.items():
+        compiled_search_pattern[k] = PatternMatcher(v)
+    return compiled_search_pattern
+
+def get_search_pattern_match(log_search_pattern, text_line, pattern_stats=None):
+    return log_search_pattern.match(text_line, pattern_stats)
+
+def decode_text_line(text_line):
+    # we only decode the lines we add to the summary
+    return text_line.decode('utf-8', errors='ignore')
+
+def get_line_summary(log_search_pattern, text_line, pattern_stats=None):
+    # return the summary for the line and the pattern that match
     #FIXME: add check for test
     # don't log ignore lines
-    if get_search_pattern_match(log_search_pattern['ignore'], text_line):
-        return False
+    if get_search_pattern_match(log_search_pattern['ignore'], text_line, pattern_stats):
+        return False, False
     # search default pattern
-    search_pattern_match = get_search_pattern_match(log_search_pattern['default'], text_line)
+    search_pattern_match = get_search_pattern_match(log_search_pattern['default'], text_line, pattern_stats)
     if search_pattern_match:
-        summary[index] = dict(
-            text = text_line,
+        return dict(
+            text = decode_text_line(text_line),
             type = search_pattern_match['type'],
             status = search_pattern_match['status'],
             id = search_pattern_match['id'],
             search_pattern = search_pattern_match['search']
-            )
-        return summary
+            ), search_pattern_match
     # we add all line that start with ' * ' or '>>>' as info
-    if text_line.startswith(' * ') or text_line.startswith('>>>'):
-        summary[index] = dict(
-            text = text_line,
+    if text_line.startswith(b' * ') or text_line.startswith(b'>>>'):
+        return dict(
+            text = decode_text_line(text_line),
             type = 'info',
             status = 'info',
             id = 0,
             search_pattern = 'auto'
-            )
+            ), False
+    return False, False
+
+def search_buildlog(log_search_pattern, text_line, index):
+    summary = {}
+    line_summary, search_pattern_match = get_line_summary(log_search_pattern, text_line)
+    if line_summary:
+        summary[index] = line_summary
         return summary
     return False
 
@@ -105,53 +386,931 @@ def getConfigSettings():
     return config
 
 def getDBSession(config):
+    import sqlalchemy as sa
+    import sqlalchemy.orm
     engine = sa.create_engine(config['database'])
     Session = sa.orm.sessionmaker(bind = engine)
     return Session()
 
-def getMultiprocessingPool(config):
-    return Pool(processes = int(config['core']))
+# compiled search pattern in the pool workers, set by init_worker()
+worker_search_pattern = None
+# compiled search pattern by pattern bundle in the log parser daemon
+bundle_search_pattern_cache = {}
+# max lines before a match we add to the summary
+MAX_CONTEXT_START = 9
+
+def init_worker(log_search_pattern):
+    # compile the pattern once in every pool worker
+    global worker_search_pattern
+    worker_search_pattern = compile_log_search_pattern(log_search_pattern)
+
+def get_context_size(search_pattern_list):
+    # max lines before and after a match the pattern want in the summary
+    max_start = 0
+    max_end = 0
+    for search_pattern in search_pattern_list:
+        max_start = max(max_start, min(search_pattern['start'], MAX_CONTEXT_START))
+        max_end = max(max_end, search_pattern['end'])
+    return max_start, max_end
+
+def add_context_line(log_search_pattern, summary, text_dict, line_index, first, last):
+    if line_index in summary or line_index not in text_dict:
+        return
+    # lines outside the chunk is added by the chunk that have them
+    # if they match
+    if line_index < first or line_index > last:
+        if get_line_summary(log_search_pattern, text_dict[line_index])[0]:
+            return
+    summary[line_index] = dict(
+        text = decode_text_line(text_dict[line_index]),
+        type = 'info',
+        status = 'info',
+        id = 0,
+        search_pattern = 'context'
+        )
+
+def search_text_chunk(log_search_pattern, text_chunk, pattern_stats=None):
+    # search the lines first to last in the text window and only
+    # return the matches and the context lines for them
+    # and the pattern stats if we collect them
+    text_window, first, last = text_chunk
+    text_dict = dict(text_window)
+    summary = {}
+    for line_index in range(first, last + 1):
+        line_summary, search_pattern_match = get_line_summary(log_search_pattern, text_dict[line_index], pattern_stats)
+        if not line_summary:
+            continue
+        # a match replace a context line
+        summary[line_index] = line_summary
+        if not search_pattern_match:
+            continue
+        # add upper text lines if requested
+        for i in range(line_index - min(search_pattern_match['start'], MAX_CONTEXT_START), line_index):
+            add_context_line(log_search_pattern, summary, text_dict, i, first, last)
+        # add lower text lines if requested
+        for i in range(line_index + 1, line_index + search_pattern_match['end'] + 1):
+            add_context_line(log_search_pattern, summary, text_dict, i, first, last)
+    summary_list = []
+    for line_index, line_summary in sorted(summary.items()):
+        summary_list.append({line_index : line_summary})
+    if pattern_stats is not None:
+        summary_list.append({'pattern_stats' : pattern_stats})
+    return summary_list
+
+def get_pattern_stats(stats):
+    # a new pattern stats dict for the chunk if we collect them
+    if stats:
+        return {}
+    return None
+
+def search_buildlog_chunk(text_chunk, stats=False):
+    return search_text_chunk(worker_search_pattern, text_chunk, get_pattern_stats(stats))
+
+def get_bundle_search_pattern(bundle_file):
+    # compiled pattern by bundle, the name of the bundle is the hash
+    # so it is safe to keep them as long as we run
+    if bundle_file not in bundle_search_pattern_cache:
+        bundle_search_pattern_cache[bundle_file] = compile_log_search_pattern(get_log_search_pattern_bundle(bundle_file))
+    return bundle_search_pattern_cache[bundle_file]
 
-def getJsonResult(results):
-    for r in results:
+def search_buildlog_bundle_chunk(bundle_file, text_chunk, stats=False):
+    return search_text_chunk(get_bundle_search_pattern(bundle_file), text_chunk, get_pattern_stats(stats))
+
+def ansi_filter(text):
+    # remove the ansi escape sequences from the bytes
+    if b'\x1b' not in text:
+        return text
+    return ANSI_ESCAPE_RE.sub(b'', text)
+
+def read_text_lines(f, index, gzip_index=None):
+    # We filter READ_SIZE of whole lines at once and splitlines() split
+    # on '\r' like the text mode did. A ansi escape sequence or '\r\n'
+    # can't span a '\n' so we can start at any whole line
+    offset = 0
+    while True:
+        text_lines = f.readlines(READ_SIZE)
+        if text_lines == []:
+            break
+        text = b''.join(text_lines)
+        if gzip_index is not None:
+            gzip_index.lines.append((index, offset))
+        offset = offset + len(text)
+        for line in ansi_filter(text).splitlines():
+            yield index, line
+            index = index + 1
+
+def get_build_log_file(file):
+    # the master remove the .log.gz when it have recompressed it
+    if file.endswith('.log.gz') and not os.path.isfile(file) and os.path.isfile(file[:-3] + '.zst'):
+        return file[:-3] + '.zst'
+    return file
+
+def open_zstd_log(file, dict_dir=ZSTD_DICT_DIR):
+    # we only need zstandard for the logs the master did recompress
+    import zstandard
+    f = open(file, 'rb')
+    try:
+        dict_id = zstandard.get_frame_parameters(f.read(18)).dict_id
+        f.seek(0)
+        zstd_dict = None
+        if dict_id:
+            with open(os.path.join(dict_dir, str(dict_id) + '.dict'), 'rb') as dict_f:
+                zstd_dict = zstandard.ZstdCompressionDict(dict_f.read())
+        dctx = zstandard.ZstdDecompressor(dict_data=zstd_dict)
+        return io.BufferedReader(dctx.stream_reader(f, read_size=READ_SIZE, read_across_frames=True, closefd=True), READ_SIZE)
+    except Exception:
+        f.close()
+        raise
+
+def open_build_log(file, dict_dir=ZSTD_DICT_DIR):
+    # the build log is .log.gz from portage or .log.zst
+    file = get_build_log_file(file)
+    if file.endswith('.zst'):
+        return open_zstd_log(file, dict_dir)
+    return io.BufferedReader(gzip.open(file, 'rb'))
+
+def get_text_lines(file, index_file=None, dict_dir=ZSTD_DICT_DIR):
+    # stream the lines from the log as bytes, we never hold the
+    # whole log. We make the log index while we read it if we have
+    # a index_file and can load libz, the index is only for gzip
+    file = get_build_log_file(file)
+    if index_file is None or getLibz() is None or file.endswith('.zst'):
+        with open_build_log(file, dict_dir) as f:
+            yield from read_text_lines(f, 1)
+        return
+    gzip_index = GzipIndex()
+    with io.BufferedReader(GzipIndexReader(file, gzip_index), READ_SIZE) as f:
+        yield from read_text_lines(f, 1, gzip_index)
+    gzip_index.write(index_file)
+
+class ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+        ]
+
+# libz by getLibz(), None if we can't load it
+libz = False
+
+def getLibz():
+    # the zlib module don't have Z_BLOCK and inflatePrime so we use
+    # libz, without it we don't make or use the log index
+    global libz
+    if libz is False:
+        libz = None
         try:
-            value = r.get()
-        except Exception as e:
-            print(f'Failed with: {e}')
+            lib = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.inflateInit2_.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int]
+            lib.inflateEnd.argtypes = [ctypes.POINTER(ZStream)]
+            lib.inflateReset.argtypes = [ctypes.POINTER(ZStream)]
+            lib.inflatePrime.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int, ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [ctypes.POINTER(ZStream), ctypes.c_char_p, ctypes.c_uint]
+        except (OSError, AttributeError):
+            return None
+        libz = lib
+    return libz
+
+class GzipIndex():
+
+    def __init__(self):
+        # (uncompressed offset, compressed offset, bits, window)
+        self.points = []
+        # (line index, uncompressed offset)
+        self.lines = []
+        # we only index logs with one gzip member
+        self.ok = True
+
+    def write(self, index_file):
+        if not self.ok:
+            return
+        with open(index_file + '.tmp', 'wb') as f:
+            f.write(INDEX_MAGIC + struct.pack('<B', INDEX_VERSION))
+            f.write(INDEX_COUNT.pack(len(self.points)))
+            for uoffset, coffset, bits, window in self.points:
+                window = zlib.compress(window)
+                f.write(INDEX_POINT.pack(uoffset, coffset, bits, len(window)))
+                f.write(window)
+            f.write(INDEX_COUNT.pack(len(self.lines)))
+            for line_index, uoffset in self.lines:
+                f.write(INDEX_LINE.pack(line_index, uoffset))
+        os.replace(index_file + '.tmp', index_file)
+
+    def read(self, index_file):
+        with open(index_file, 'rb') as f:
+            if f.read(len(INDEX_MAGIC) + 1) != INDEX_MAGIC + struct.pack('<B', INDEX_VERSION):
+                raise ValueError('Not a log index')
+            for i in range(INDEX_COUNT.unpack(f.read(INDEX_COUNT.size))[0]):
+                uoffset, coffset, bits, size = INDEX_POINT.unpack(f.read(INDEX_POINT.size))
+                self.points.append((uoffset, coffset, bits, zlib.decompress(f.read(size))))
+            for i in range(INDEX_COUNT.unpack(f.read(INDEX_COUNT.size))[0]):
+                self.lines.append(INDEX_LINE.unpack(f.read(INDEX_LINE.size)))
+        return self
+
+class GzipIndexReader(io.RawIOBase):
+
+    # inflate the gzip log with libz, we stop after every deflate block
+    # and add a point to the gzip_index every INDEX_SPAN. With a point
+    # we start at it and skip to the uncompressed offset
+    def __init__(self, file, gzip_index=None, point=None, offset=0):
+        self.f = open(file, 'rb')
+        self.gzip_index = gzip_index
+        self.libz = getLibz()
+        self.strm = ZStream()
+        self.output = ctypes.create_string_buffer(READ_SIZE)
+        self.input = None
+        self.window = b''
+        self.pending = memoryview(b'')
+        self.eof = False
+        self.last = None
+        self.raw = point is not None
+        if point is None:
+            # gzip header
+            self.init(15 + 16)
+            self.totin = 0
+            self.totout = 0
         else:
-            if value:
-                print(json.dumps(value), flush=True)
+            uoffset, coffset, bits, window = point
+            # raw deflate from the point
+            self.init(-15)
+            self.f.seek(coffset - (1 if bits else 0))
+            if bits:
+                self.libz.inflatePrime(ctypes.byref(self.strm), bits, self.f.read(1)[0] >> (8 - bits))
+            self.libz.inflateSetDictionary(ctypes.byref(self.strm), window, len(window))
+            self.totin = coffset
+            self.totout = uoffset
+        self.skip = offset - self.totout
 
-def runLogParser(args):
+    def init(self, wbits):
+        if self.libz.inflateInit2_(ctypes.byref(self.strm), wbits, self.libz.zlibVersion(), ctypes.sizeof(ZStream)) != Z_OK:
+            raise zlib.error('inflateInit2 failed')
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.libz.inflateEnd(ctypes.byref(self.strm))
+            self.f.close()
+        super().close()
+
+    def inflate_block(self):
+        if self.strm.avail_in == 0:
+            data = self.f.read(READ_SIZE)
+            if data == b'':
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self.input = ctypes.create_string_buffer(data, len(data))
+            self.strm.next_in = ctypes.addressof(self.input)
+            self.strm.avail_in = len(data)
+        avail_in = self.strm.avail_in
+        self.strm.next_out = ctypes.addressof(self.output)
+        self.strm.avail_out = len(self.output)
+        ret = self.libz.inflate(ctypes.byref(self.strm), Z_BLOCK)
+        if ret not in [Z_OK, Z_STREAM_END, Z_BUF_ERROR]:
+            raise zlib.error('Error ' + str(ret) + ' while decompressing data')
+        text = ctypes.string_at(self.output, len(self.output) - self.strm.avail_out)
+        self.totin = self.totin + avail_in - self.strm.avail_in
+        self.totout = self.totout + len(text)
+        if ret == Z_STREAM_END:
+            # the gzip trailer is after the raw deflate
+            if self.raw or (self.strm.avail_in == 0 and self.f.peek(1) == b''):
+                self.eof = True
+            else:
+                # a new gzip member, we can't index it
+                if self.gzip_index is not None:
+                    self.gzip_index.ok = False
+                self.libz.inflateReset(ctypes.byref(self.strm))
+        elif self.gzip_index is not None:
+            self.window = (self.window + text)[-INDEX_WINDOW:]
+            # at the end of a deflate block that is not the last one
+            if self.strm.data_type & 128 and not self.strm.data_type & 64 and (self.last is None or self.totout - self.last > INDEX_SPAN):
+                self.gzip_index.points.append((self.totout, self.totin, self.strm.data_type & 7, self.window))
+                self.last = self.totout
+        return text
+
+    def readinto(self, b):
+        while len(self.pending) == 0:
+            if self.eof:
+                return 0
+            text = self.inflate_block()
+            if self.skip > 0:
+                skip = min(self.skip, len(text))
+                text = text[skip:]
+                self.skip = self.skip - skip
+            self.pending = memoryview(text)
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+def get_index_text_lines(file, index_file, first):
+    # the lines from the last whole line before first, we start the
+    # inflate at the point before it
+    gzip_index = GzipIndex().read(index_file)
+    i = bisect.bisect_right(gzip_index.lines, (first, float('inf'))) - 1
+    if i < 0:
+        yield from get_text_lines(file)
+        return
+    line_index, offset = gzip_index.lines[i]
+    j = bisect.bisect_right(gzip_index.points, (offset, float('inf'))) - 1
+    if j < 0:
+        point = None
+    else:
+        point = gzip_index.points[j]
+    with io.BufferedReader(GzipIndexReader(file, point=point, offset=offset), READ_SIZE) as f:
+        yield from read_text_lines(f, line_index)
+
+def get_text_chunks(text_lines, chunk_size, max_start, max_end):
+    # the ring buffer hold the chunk and the context lines before
+    # and after it, a chunk is (text window, first, last)
+    ring_buffer = deque(maxlen = max_start + chunk_size + max_end)
+    first = 1
+    last = 0
+    for line_index, text in text_lines:
+        ring_buffer.append((line_index, text))
+        last = line_index
+        if line_index == first + chunk_size - 1 + max_end:
+            yield list(ring_buffer), first, first + chunk_size - 1
+            first = first + chunk_size
+    while first <= last:
+        text_window = [text_line for text_line in ring_buffer if text_line[0] >= first - max_start]
+        yield text_window, first, min(first + chunk_size - 1, last)
+        first = first + chunk_size
+
+def get_pool_results(pool, text_chunks, max_pending, bundle_file=None, stats=False):
+    # only have max_pending chunks in the pool so we don't read
+    # the whole log in to the pool queue
+    pending = deque()
+    for text_chunk in text_chunks:
+        if bundle_file is None:
+            pending.append(pool.apply_async(search_buildlog_chunk, args=(text_chunk, stats,)))
+        else:
+            pending.append(pool.apply_async(search_buildlog_bundle_chunk, args=(bundle_file, text_chunk, stats,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def getMultiprocessingPool(config, log_search_pattern):
+    return Pool(processes = int(config['core']), initializer = init_worker, initargs = (log_search_pattern,))
+
+def addPatternStats(pattern_stats, chunk_pattern_stats):
+    # sum up the pattern stats from the chunks
+    if pattern_stats is None:
+        pattern_stats = {}
+    for pattern_id, stats in chunk_pattern_stats.items():
+        total_stats = pattern_stats.setdefault(pattern_id, [0, 0, 0.0])
+        for i in range(len(stats)):
+            total_stats[i] = total_stats[i] + stats[i]
+    return pattern_stats
+
+def get_unique_results(results):
+    # a context line in the overlap between two chunks can be in the
+    # summary from both chunks, we only give out a line once. A line
+    # is only a context line in a other chunk if it don't match so it
+    # is the same summary from both
+    done_lines = set()
+    for summary_list in results:
+        unique_list = []
+        for value in summary_list:
+            if 'pattern_stats' not in value:
+                line_index = next(iter(value))
+                if line_index in done_lines:
+                    continue
+                done_lines.add(line_index)
+            unique_list.append(value)
+        yield unique_list
+
+def getJsonResult(results, out=sys.stdout):
+    # the pattern stats from the chunks is summed up and printed last
+    # as {"pattern_stats": {id: [evaluations, hits, match time]}}
+    # return False if we did fail
+    pattern_stats = None
+    try:
+        for summary_list in get_unique_results(results):
+            for value in summary_list:
+                if 'pattern_stats' in value:
+                    pattern_stats = addPatternStats(pattern_stats, value['pattern_stats'])
+                    continue
+                print(json.dumps(value), file=out, flush=True)
+        if pattern_stats is not None:
+            print(json.dumps({'pattern_stats' : pattern_stats}), file=out, flush=True)
+    except Exception as e:
+        print(f'Failed with: {e}', file=out, flush=True)
+        return False
+    return True
+
+def writeResultFrame(f, kind, payload):
+    f.write(RESULT_FRAME.pack(kind, len(payload)))
+    f.write(payload)
+
+def writeResultDocument(results, output_file, out=sys.stdout):
+    # write the result document, we write to a tmp file and move it
+    # in place when it is done so we never have a half document
+    # return False if we did fail
+    pattern_stats = None
+    pattern_dict = {}
+    lines = 0
+    try:
+        with gzip.open(output_file + '.tmp', 'wb') as f:
+            f.write(RESULT_MAGIC + struct.pack('<B', RESULT_VERSION))
+            header = {}
+            header['type'] = RESULT_TYPE
+            header['status'] = RESULT_STATUS
+            header['source'] = RESULT_SOURCE
+            writeResultFrame(f, RESULT_FRAME_HEADER, json.dumps(header).encode('utf-8'))
+            for summary_list in get_unique_results(results):
+                for value in summary_list:
+                    if 'pattern_stats' in value:
+                        pattern_stats = addPatternStats(pattern_stats, value['pattern_stats'])
+                        continue
+                    for line_index, line_summary in value.items():
+                        if line_summary['search_pattern'] in ['context', 'auto']:
+                            source = line_summary['search_pattern']
+                        else:
+                            source = 'match'
+                            pattern_dict[line_summary['id']] = line_summary['search_pattern']
+                        payload = RESULT_LINE.pack(
+                            line_index,
+                            line_summary['id'],
+                            RESULT_TYPE.index(line_summary['type']),
+                            RESULT_STATUS.index(line_summary['status']),
+                            RESULT_SOURCE.index(source)
+                            )
+                        writeResultFrame(f, RESULT_FRAME_LINE, payload + line_summary['text'].encode('utf-8'))
+                        lines = lines + 1
+            writeResultFrame(f, RESULT_FRAME_PATTERN, json.dumps(pattern_dict).encode('utf-8'))
+            if pattern_stats is not None:
+                writeResultFrame(f, RESULT_FRAME_PATTERN_STATS, json.dumps(pattern_stats).encode('utf-8'))
+            writeResultFrame(f, RESULT_FRAME_END, RESULT_END.pack(lines))
+        os.replace(output_file + '.tmp', output_file)
+    except Exception as e:
+        print(f'Failed with: {e}', file=out, flush=True)
+        if os.path.exists(output_file + '.tmp'):
+            os.remove(output_file + '.tmp')
+        return False
+    return True
+
+def getResult(results, output_file=None, out=sys.stdout):
+    # json lines on out or the result document in output_file
+    if output_file is None:
+        return getJsonResult(results, out)
+    return writeResultDocument(results, output_file, out)
+
+def getCodeHash():
+    # the daemon and the client must run the same log_parser.py
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class LogParserHandler(socketserver.StreamRequestHandler):
+    # one request is a json line with version, file, pattern, stats
+    # and output, we answer with lines that start with # and the json
+    # result if we don't write it to output
+    def handle(self):
+        with self.server.active_lock:
+            self.server.active = self.server.active + 1
+            self.server.last_request = time.monotonic()
+        try:
+            request = json.loads(self.rfile.readline())
+            out = self.connection.makefile('w', encoding='utf-8')
+            if request['version'] != self.server.code_hash:
+                # we have a new log_parser.py, let the new one take over
+                self.server.stop()
+                out.write('#restart\n')
+                out.close()
+                return
+            out.write('#ok\n')
+            if 'file' in request:
+                if self.server.parse(request['file'], request['pattern'], out, request.get('stats', False), request.get('output'), request.get('index'), request.get('zstd_dict_dir', ZSTD_DICT_DIR)):
+                    out.write('#done\n')
+                else:
+                    out.write('#failed\n')
+            out.close()
+        finally:
+            with self.server.active_lock:
+                self.server.active = self.server.active - 1
+                self.server.last_request = time.monotonic()
+
+class LogParserDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    # wait on running requests when we stop
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, config, socket_path):
+        self.config = config
+        self.socket_path = socket_path
+        self.code_hash = getCodeHash()
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.running = True
+        # exit if we have been idle this long
+        self.idle_timeout = int(config.get('daemon_timeout', 600))
+        self.last_request = time.monotonic()
+        # how often we check if we should stop
+        self.timeout = 1
+        self.chunk_size = int(config.get('chunk', 1000))
+        self.core = int(config['core'])
+        self.pool = None
+        super().__init__(socket_path, LogParserHandler)
+        # a other daemon can have the socket path when we stop
+        self.socket_ino = os.stat(socket_path).st_ino
+
+    def parse(self, file, bundle_file, out, stats=False, output_file=None, index_file=None, dict_dir=ZSTD_DICT_DIR):
+        log_search_pattern = get_bundle_search_pattern(bundle_file)
+        max_start, max_end = get_context_size(log_search_pattern['default'].search_pattern_list)
+        text_chunks = get_text_chunks(get_text_lines(file, index_file, dict_dir), self.chunk_size, max_start, max_end)
+        if self.pool is None:
+            return getResult((search_text_chunk(log_search_pattern, text_chunk, get_pattern_stats(stats)) for text_chunk in text_chunks), output_file, out)
+        return getResult(get_pool_results(self.pool, text_chunks, self.core * 2, bundle_file, stats), output_file, out)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            # only remove the socket if it is our
+            try:
+                if os.stat(self.socket_path).st_ino == self.socket_ino:
+                    os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def handle_timeout(self):
+        if self.active == 0 and time.monotonic() - self.last_request > self.idle_timeout:
+            self.stop()
+
+    def run(self):
+        if self.core > 1:
+            self.pool = Pool(processes = self.core)
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if self.pool is not None:
+                self.pool.terminate()
+
+def getDaemonSocket(config):
+    return os.path.abspath(config.get('socket', 'log_parser.sock'))
+
+def sendLogParserRequest(socket_path, request, out=sys.stdout):
+    # return True if the daemon did the request
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return False
+    with client, client.makefile('rw', encoding='utf-8') as f:
+        f.write(json.dumps(request) + '\n')
+        f.flush()
+        if f.readline() != '#ok\n':
+            return False
+        if 'file' not in request:
+            return True
+        for line in f:
+            if line == '#done\n':
+                return True
+            if line == '#failed\n':
+                sys.exit(1)
+            out.write(line)
+    # the daemon did die on us
+    print('Failed with: log parser daemon did stop')
+    sys.exit(1)
+
+def startLogParserDaemon(config):
+    socket_path = getDaemonSocket(config)
+    request = {}
+    request['version'] = getCodeHash()
+    # one build at the time check and start the daemon, the lock is
+    # held until the new daemon is listening on the socket
+    with open(socket_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if sendLogParserRequest(socket_path, request):
+            print('Log parser daemon is running')
+            return
+        # remove a old socket from a daemon that is not running
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = LogParserDaemon(config, socket_path)
+        if os.fork() != 0:
+            print('Log parser daemon started')
+            return
+        # the lock is on the open file, close it so the daemon don't
+        # keep it
+        lock.close()
+    detachProcess()
+    server.run()
+    os._exit(0)
+
+def detachProcess():
+    # detach so the buildbot step don't wait on us
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in [0, 1, 2]:
+        os.dup2(devnull, fd)
+
+class BuildLogFollower():
+
+    # tail a build log while emerge write it. We only give out whole
+    # lines until the log is done and filter them the same way as
+    # get_text_lines so the line index is the same as when we parse
+    # the log after the build
+    def __init__(self, file):
+        self.file = file
+        self.f = None
+        self.buffer = b''
+        self.decompress = None
+        if file.endswith('.gz'):
+            # compress-build-logs write the gzip while the build run
+            self.decompress = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def read(self, done):
+        # we keep the log open so we can read the rest of it if portage
+        # compress it and remove the .log when the build is done
+        if self.f is None:
+            try:
+                self.f = open(self.file, 'rb', buffering=0)
+            except FileNotFoundError:
+                pass
+        data = b''
+        if self.f is not None:
+            data = self.f.read(READ_SIZE)
+        more = data != b''
+        if self.decompress is not None:
+            data = self.decompress.decompress(data)
+        self.buffer = self.buffer + data
+        if done and not more:
+            text, self.buffer = self.buffer, b''
+        else:
+            end = self.buffer.rfind(b'\n') + 1
+            text, self.buffer = self.buffer[:end], self.buffer[end:]
+        return ansi_filter(text).splitlines(), more
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def getFinalLogName(file):
+    # portage can write the .log and compress it to .log.gz when the
+    # build is done, the master look for the summary of the .log.gz
+    if file.endswith('.log') and not os.path.exists(file) and os.path.exists(file + '.gz'):
+        return os.path.basename(file) + '.gz'
+    return os.path.basename(file)
+
+def get_follow_lines(follower, done):
+    # yield the lines as they get written, done is set when
+    # emerge have stopped and we read the rest of the log
     index = 1
-    logfile_text_dict = {}
+    while True:
+        build_done = done.is_set()
+        text_lines, more = follower.read(build_done)
+        for line in text_lines:
+            yield index, line
+            index = index + 1
+        if more:
+            continue
+        if build_done:
+            follower.close()
+            return
+        done.wait(FOLLOW_POLL)
+
+class BuildLogFollow():
+
+    # follow the build logs emerge make in log_dir and parse them while
+    # the build is running. Matches is written to the live log, that
+    # buildbot stream to the master, and the result document for each
+    # log is written to output_dir when the build log is done
+    def __init__(self, config, log_dir, bundle_file, output_dir, stats=False):
+        self.log_dir = log_dir
+        self.bundle_file = bundle_file
+        self.output_dir = output_dir
+        self.stats = stats
+        self.chunk_size = int(config.get('follow_chunk', 100))
+        self.done = threading.Event()
+        self.live_lock = threading.Lock()
+        self.threads = []
+        # logs from before we did start is not from this build
+        self.known_logs = set(self.get_logs())
+
+    def get_logs(self):
+        for dirpath, dirnames, filenames in os.walk(self.log_dir):
+            for filename in filenames:
+                if filename.endswith('.log') or filename.endswith('.log.gz'):
+                    yield os.path.join(dirpath, filename)
+
+    def add_live_lines(self, log_name, summary_list):
+        with self.live_lock:
+            with open(os.path.join(self.output_dir, 'live.log'), 'a', encoding='utf-8') as f:
+                for value in summary_list:
+                    for line_index, line_summary in value.items():
+                        if line_index == 'pattern_stats' or line_summary['search_pattern'] == 'context':
+                            continue
+                        f.write(' '.join([log_name, str(line_index), line_summary['status'], line_summary['text']]) + '\n')
+
+    def follow_log(self, file):
+        log_search_pattern = get_bundle_search_pattern(self.bundle_file)
+        max_start, max_end = get_context_size(log_search_pattern['default'].search_pattern_list)
+        log_name = os.path.basename(file)
+        text_chunks = get_text_chunks(get_follow_lines(BuildLogFollower(file), self.done), self.chunk_size, max_start, max_end)
+        results = []
+        for text_chunk in text_chunks:
+            summary_list = search_text_chunk(log_search_pattern, text_chunk, get_pattern_stats(self.stats))
+            self.add_live_lines(log_name, summary_list)
+            results.append(summary_list)
+        writeResultDocument(results, os.path.join(self.output_dir, getFinalLogName(file) + '.summary.gz'))
+
+    def check_logs(self):
+        for file in self.get_logs():
+            if file in self.known_logs:
+                continue
+            self.known_logs.add(file)
+            # the .log we follow compressed by portage
+            if file.endswith('.log.gz') and file[:-3] in self.known_logs:
+                continue
+            thread = threading.Thread(target=self.follow_log, args=(file,))
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        stop_file = os.path.join(self.output_dir, 'follow.stop')
+        while not os.path.exists(stop_file):
+            self.check_logs()
+            time.sleep(FOLLOW_POLL)
+        # emerge is done, take the logs we have not seen and read
+        # the rest of all logs
+        self.check_logs()
+        self.done.set()
+        for thread in self.threads:
+            thread.join()
+
+def getFollowFiles(output_dir):
+    return os.path.join(output_dir, 'follow.pid'), os.path.join(output_dir, 'follow.stop')
+
+def stopBuildLogFollow(config, output_dir):
+    # tell the follower that emerge is done and wait on the result
+    # documents, return False if it did time out
+    pid_file, stop_file = getFollowFiles(output_dir)
+    try:
+        with open(pid_file) as f:
+            os.kill(int(f.read()), 0)
+    except FileNotFoundError:
+        print('Log parser follow is not running')
+        return True
+    except (ProcessLookupError, ValueError):
+        # the follower did die on us
+        print('Log parser follow is not running')
+        os.remove(pid_file)
+        return True
+    open(stop_file, 'w').close()
+    timeout = time.monotonic() + int(config.get('follow_timeout', 600))
+    while os.path.exists(pid_file):
+        if time.monotonic() > timeout:
+            print('Failed with: log parser follow did not stop')
+            return False
+        time.sleep(0.1)
+    print('Log parser follow stopped')
+    return True
+
+def startBuildLogFollow(config, args):
+    output_dir = os.path.abspath(args.output)
+    # stop the follower from the last build
+    if not stopBuildLogFollow(config, output_dir):
+        sys.exit(1)
+    os.makedirs(output_dir, exist_ok=True)
+    pid_file, stop_file = getFollowFiles(output_dir)
+    # remove the stop file, the live log and the result documents
+    # from the last build
+    for file in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, file))
+    follow = BuildLogFollow(config, os.path.abspath(args.follow), os.path.abspath(args.pattern), output_dir, args.stats)
+    open(os.path.join(output_dir, 'live.log'), 'w').close()
+    pid = os.fork()
+    if pid != 0:
+        with open(pid_file + '.tmp', 'w') as f:
+            f.write(str(pid))
+        os.replace(pid_file + '.tmp', pid_file)
+        print('Log parser follow started')
+        return
+    detachProcess()
+    try:
+        follow.run()
+    finally:
+        os.remove(pid_file)
+    os._exit(0)
+
+def runLogParser(args):
     config = getConfigSettings()
-    Session = getDBSession(config)
-    #mp_pool = getMultiprocessingPool(config)
-    summary = {}
+    # use the log parser daemon if it is running
+    if args.pattern:
+        request = {}
+        request['version'] = getCodeHash()
+        request['file'] = os.path.abspath(args.file)
+        request['pattern'] = os.path.abspath(args.pattern)
+        request['stats'] = args.stats
+        if args.output:
+            request['output'] = os.path.abspath(args.output)
+        if args.index:
+            request['index'] = os.path.abspath(args.index)
+        request['zstd_dict_dir'] = os.path.abspath(args.zstd_dict_dir)
+        if sendLogParserRequest(getDaemonSocket(config), request):
+            sys.stdout.flush()
+            return
     #NOTE: The patten is from https://github.com/toralf/tinderbox/tree/master/data files.
     # Is stored in a db instead of files.
-    log_search_pattern = get_log_search_pattern(Session, args.uuid, config['default_uuid'])
-    Session.close()
-    # read the log file to dict
-    for text_line in io.TextIOWrapper(io.BufferedReader(gzip.open(args.file)), encoding='utf8', errors='ignore'):
-        logfile_text_dict[index] = text_line.strip('\n')
-        index = index + 1
-    # run the search parse pattern on the text lines
-    #params = [(log_search_pattern, text, line_index,) for line_index, text in logfile_text_dict.items()]
-    with getMultiprocessingPool(config) as pool:
-        results = list(pool.apply_async(search_buildlog, args=(log_search_pattern, text, line_index,)) for line_index, text in logfile_text_dict.items())
-        #results = pool.starmap(search_buildlog, params)
-        getJsonResult(results)
+    if args.pattern:
+        log_search_pattern = get_log_search_pattern_bundle(args.pattern)
+    else:
+        # the workers get the pattern in the bundle and a logparser.json
+        # without the db
+        if 'database' not in config:
+            print('No database in logparser.json, use -p with the pattern bundle')
+            sys.exit(1)
+        Session = getDBSession(config)
+        log_search_pattern = get_log_search_pattern(Session, args.uuid, config['default_uuid'])
+        Session.close()
+    # run the search parse pattern on chunks of text lines
+    # read from the log file
+    max_start, max_end = get_context_size(log_search_pattern['default'])
+    text_chunks = get_text_chunks(get_text_lines(args.file, args.index, args.zstd_dict_dir), int(config.get('chunk', 1000)), max_start, max_end)
+    if int(config['core']) <= 1:
+        init_worker(log_search_pattern)
+        if not getResult((search_buildlog_chunk(text_chunk, args.stats) for text_chunk in text_chunks), args.output):
+            sys.exit(1)
+        return
+    with getMultiprocessingPool(config, log_search_pattern) as pool:
+        result_ok = getResult(get_pool_results(pool, text_chunks, int(config['core']) * 2, stats=args.stats), args.output)
         pool.close()
         pool.join()
+    if not result_ok:
+        sys.exit(1)
+
+def printLogLines(args):
+    # print the lines first to last, with the log index we only inflate
+    # from the point before the first line
+    first, last = [int(line_index) for line_index in args.lines.split('-')]
+    if args.index and os.path.isfile(args.index):
+        text_lines = get_index_text_lines(args.file, args.index, first)
+    else:
+        text_lines = get_text_lines(args.file, dict_dir=args.zstd_dict_dir)
+    for line_index, text_line in text_lines:
+        if line_index > last:
+            break
+        if line_index >= first:
+            print(str(line_index) + ' ' + decode_text_line(text_line))
 
 def main():
 # get filename, project_uuid default_project_uuid
     parser = argparse.ArgumentParser()
-    parser.add_argument("-f", "--file", required=True)
-    parser.add_argument("-u", "--uuid", required=True)
+    parser.add_argument("-f", "--file")
+    parser.add_argument("-u", "--uuid")
+    parser.add_argument("-p", "--pattern")
+    parser.add_argument("-d", "--daemon", action="store_true")
+    # print evaluations, hits and match time for the pattern
+    parser.add_argument("-s", "--stats", action="store_true")
+    # write the result document to the file and not json to stdout
+    parser.add_argument("-o", "--output")
+    # parse the build logs in the dir while emerge is running and write
+    # the result documents to -o
+    parser.add_argument("--follow")
+    parser.add_argument("--follow-stop", action="store_true")
+    # write the log index to the file when we parse, with --lines we
+    # use it to get the lines
+    parser.add_argument("-i", "--index")
+    # print the lines first-last of the log
+    parser.add_argument("--lines")
+    # the dir with the zstd dictionarys for a .log.zst log
+    parser.add_argument("--zstd-dict-dir", default=ZSTD_DICT_DIR)
     args = parser.parse_args()
+    if args.daemon:
+        startLogParserDaemon(getConfigSettings())
+        sys.exit()
+    if args.follow or args.follow_stop:
+        if args.output is None or (args.follow and args.pattern is None):
+            parser.error("the following arguments are required: -o/--output and -p/--pattern with --follow")
+        if args.follow:
+            startBuildLogFollow(getConfigSettings(), args)
+        elif not stopBuildLogFollow(getConfigSettings(), os.path.abspath(args.output)):
+            sys.exit(1)
+        sys.exit()
+    if args.lines and args.file:
+        printLogLines(args)
+        sys.exit()
+    if args.file is None or args.uuid is None:
+        parser.error("the following arguments are required: -f/--file, -u/--uuid")
     runLogParser(args)
     sys.exit()
 
@@ -0,0 +1,345 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+# Benchmark for log_parser.py
+# The pattern from sql/search_pattern.sql is loaded in a local SQLite db
+# and the log parser is run on synthetic emerge logs or on a
+# directory of real .log.gz files.
+#
+# python3 log_parser_bench.py synthetic --lines 100000 --error-density 0.01
+# python3 log_parser_bench.py replay /path/to/logs
+# python3 log_parser_bench.py --parser ansifilter --pattern-cost 0 synthetic --color-density 0.5
+
+import sys
+import os
+import io
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import traceback
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, bench_dir)
+import log_parser
+
+# default project in sql/search_pattern.sql
+DEFAULT_UUID = 'e89c2c1a-46e0-4ded-81dd-c51afeb7fcff'
+
+def loadPatternToSqlite(sql_file, db_file):
+    # the column order of the pg dump, the insert don't have column names
+    connection = sqlite3.connect(db_file)
+    connection.execute('DROP TABLE IF EXISTS projects_pattern')
+    connection.execute('CREATE TABLE projects_pattern (id INTEGER PRIMARY KEY, project_uuid VARCHAR(36) NOT NULL, search VARCHAR(50) NOT NULL, start INTEGER, "end" INTEGER, type VARCHAR(9), status VARCHAR(7), search_type VARCHAR(10))')
+    with open(sql_file, encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith('INSERT INTO public.projects_pattern '):
+                continue
+            # the dump have some id more then one time, keep the first
+            connection.execute(line.replace('INSERT INTO public.projects_pattern ', 'INSERT OR IGNORE INTO projects_pattern ', 1))
+    connection.commit()
+    pattern_count = connection.execute('SELECT count(*) FROM projects_pattern').fetchone()[0]
+    connection.close()
+    return pattern_count
+
+def getLogSearchPattern(db_file, uuid, default_uuid):
+    # same pattern as log_parser.py get from the db
+    Session = log_parser.getDBSession({ 'database' : 'sqlite:///' + db_file })
+    log_search_pattern = log_parser.get_log_search_pattern(Session, uuid, default_uuid)
+    Session.close()
+    return log_search_pattern
+
+def writePatternBundle(log_search_pattern, uuid, default_uuid, bundle_dir):
+    # same as SetupParserBuildLoger.getPatternBundle() on the master
+    bundle = {}
+    bundle['version'] = log_parser.PATTERN_BUNDLE_VERSION
+    bundle['project_uuid'] = uuid
+    bundle['default_uuid'] = default_uuid
+    bundle['log_search_pattern'] = log_search_pattern
+    bundle_data = json.dumps(bundle, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    bundle_file = os.path.join(bundle_dir, hashlib.sha256(bundle_data).hexdigest() + '.json')
+    with open(bundle_file, 'wb') as f:
+        f.write(bundle_data)
+    return bundle_file
+
+# text for the synthetic emerge logs
+SYNTHETIC_INFO_LINES = [
+    ">>> Unpacking source...",
+    ">>> Source unpacked in /var/tmp/portage/dev-libs/foo-1.0/work",
+    ">>> Preparing source in /var/tmp/portage/dev-libs/foo-1.0/work/foo-1.0 ...",
+    ">>> Configuring source in /var/tmp/portage/dev-libs/foo-1.0/work/foo-1.0 ...",
+    ">>> Compiling source in /var/tmp/portage/dev-libs/foo-1.0/work/foo-1.0 ...",
+    " * Applying foo-1.0-fix-build.patch ...",
+    " * econf: updating foo-1.0/config.sub with /usr/share/gnuconfig/config.sub",
+    ]
+SYNTHETIC_BUILD_LINES = [
+    "checking for {name}.h... yes",
+    "checking whether {name} works... yes",
+    "checking for {name} in -l{name}... no",
+    "make[{level}]: Entering directory '/var/tmp/portage/dev-libs/foo-1.0/work/foo-1.0/src/{name}'",
+    "make[{level}]: Leaving directory '/var/tmp/portage/dev-libs/foo-1.0/work/foo-1.0/src/{name}'",
+    "x86_64-pc-linux-gnu-gcc -DHAVE_CONFIG_H -I. -I.. -I../include -DNDEBUG -O2 -pipe -march=native -fno-strict-aliasing -Wall -Wextra -fPIC -c {name}.c -o {name}.o",
+    "/bin/sh ../libtool  --tag=CC   --mode=link x86_64-pc-linux-gnu-gcc  -O2 -pipe -version-info 3:0:0 -Wl,-O1 -Wl,--as-needed -o lib{name}.la -rpath /usr/lib64 {name}.lo",
+    "{name}.c:{line}:{column}: warning: unused variable '{name}' [-Wunused-variable]",
+    "  CC       {name}.o",
+    "  CCLD     lib{name}.la",
+    ]
+SYNTHETIC_ERROR_LINES = [
+    "{name}.c:{line}:{column}: error: '{name}' undeclared (first use in this function)",
+    "/usr/lib/gcc/x86_64-pc-linux-gnu/11.2.0/../../../../x86_64-pc-linux-gnu/bin/ld: {name}.o: undefined reference to `{name}_init'",
+    "make[{level}]: *** [Makefile:{line}: {name}.o] Error 1",
+    "collect2: error: ld returned 1 exit status",
+    "Traceback (most recent call last):",
+    "ModuleNotFoundError: No module named '{name}'",
+    " * ERROR: dev-libs/foo-1.0::gentoo failed (compile phase):",
+    "Segmentation fault (core dumped)",
+    ]
+SYNTHETIC_NAMES = ['foo', 'bar', 'baz', 'parser', 'buffer', 'socket', 'thread', 'zlib', 'xml', 'crypto']
+
+def getSyntheticLine(rng, error_density, color_density):
+    if rng.random() < error_density:
+        text_line = rng.choice(SYNTHETIC_ERROR_LINES)
+    elif rng.random() < 0.02:
+        text_line = rng.choice(SYNTHETIC_INFO_LINES)
+    else:
+        text_line = rng.choice(SYNTHETIC_BUILD_LINES)
+    text_line = text_line.format(name = rng.choice(SYNTHETIC_NAMES), level = rng.randint(1, 4), line = rng.randint(1, 2000), column = rng.randint(1, 80))
+    # colored compiler output
+    if rng.random() < color_density:
+        text_line = '\x1b[01m\x1b[K' + text_line + '\x1b[m\x1b[K'
+    return text_line
+
+def writeSyntheticLog(log_file, lines, error_density, color_density, seed):
+    rng = random.Random(seed)
+    with gzip.open(log_file, 'wt', encoding='utf-8') as f:
+        for i in range(lines):
+            f.write(getSyntheticLine(rng, error_density, color_density) + '\n')
+
+def getLogSize(log_file):
+    text_lines = 0
+    text_size = 0
+    with io.BufferedReader(gzip.open(log_file, 'rb')) as f:
+        for text_line in f:
+            text_lines = text_lines + 1
+            text_size = text_size + len(text_line)
+    return text_lines, text_size
+
+def runForked(function, *args):
+    # run function in a child so we get the peak RSS of this run only
+    # return (result, seconds, peak rss in KB)
+    read_fd, write_fd = os.pipe()
+    start_time = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        result = None
+        try:
+            # the parser print a lot
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            result = function(*args)
+        except Exception:
+            traceback.print_exc()
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result_data = f.read()
+    pid, status, rusage = os.wait4(pid, 0)
+    seconds = time.perf_counter() - start_time
+    return json.loads(result_data or 'null'), seconds, rusage.ru_maxrss
+
+def runLogParser(log_file, bundle_file, core, chunk, work_dir):
+    # run log_parser.py as the worker do, in the bench dir so it don't
+    # use a running log parser daemon
+    config = {}
+    config['core'] = str(core)
+    config['chunk'] = str(chunk)
+    config['socket'] = os.path.join(work_dir, 'log_parser.sock')
+    with open(os.path.join(work_dir, 'logparser.json'), 'w') as f:
+        json.dump(config, f)
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'log_parser.py'), '-f', log_file, '-u', 'bench', '-p', bundle_file], cwd=work_dir, stdout=subprocess.PIPE)
+    summary_lines = 0
+    for text_line in process.stdout:
+        if text_line.startswith(b'{'):
+            summary_lines = summary_lines + 1
+    process.stdout.close()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start_time
+    if status != 0:
+        print("log_parser.py failed on " + log_file)
+    return summary_lines, seconds, rusage.ru_maxrss
+
+def writePlainLog(log_file, work_dir):
+    # the filters is run on the uncompressed log so we only time the
+    # filter and not the inflate
+    plain_file = os.path.join(work_dir, os.path.basename(log_file)[:-3])
+    with gzip.open(log_file, 'rb') as src, open(plain_file, 'wb') as dst:
+        shutil.copyfileobj(src, dst, log_parser.READ_SIZE)
+    return plain_file
+
+def runAnsiFilter(plain_file):
+    # the ansifilter binary the worker can run from
+    # PORTAGE_LOG_FILTER_FILE_CMD, return the bytes it write
+    start_time = time.perf_counter()
+    process = subprocess.Popen(['ansifilter', plain_file], stdout=subprocess.PIPE)
+    text_size = 0
+    while True:
+        data = process.stdout.read(log_parser.READ_SIZE)
+        if data == b'':
+            break
+        text_size = text_size + len(data)
+    process.stdout.close()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start_time
+    if status != 0:
+        print("ansifilter failed on " + plain_file)
+    return text_size, seconds, rusage.ru_maxrss
+
+def runAnsiFilterPython(plain_file):
+    # the ansi filter in log_parser.py, with the line split we need
+    # for the pattern, return the bytes of the lines
+    text_size = 0
+    with open(plain_file, 'rb') as f:
+        for line_index, text_line in log_parser.read_text_lines(f, 1):
+            text_size = text_size + len(text_line) + 1
+    return text_size
+
+def hasAnsiFilter():
+    if shutil.which('ansifilter') is None:
+        print("Skip ansifilter: the ansifilter binary is not in PATH")
+        return False
+    return True
+
+def printFilterResult(name, log_file, text_lines, text_size, filtered_size, seconds, peak_rss):
+    print("%-28s %-30s %9d lines %8.0f lines/s %7.2f MB/s %8.1f MB rss %9d bytes out" % (
+        name,
+        os.path.basename(log_file),
+        text_lines,
+        text_lines / seconds,
+        text_size / seconds / 1024 / 1024,
+        peak_rss / 1024,
+        filtered_size,
+        ))
+
+def getPatternCost(log_search_pattern, log_files, max_lines):
+    # run every pattern alone on the lines, with and without the
+    # literal prefilter in log_parser.PatternMatcher
+    text_lines = []
+    for log_file in log_files:
+        for line_index, text_line in log_parser.get_text_lines(log_file):
+            if len(text_lines) >= max_lines:
+                break
+            text_lines.append(text_line)
+    pattern_cost_list = []
+    for search_pattern in log_search_pattern['ignore'] + log_search_pattern['default']:
+        pattern_matcher = log_parser.PatternMatcher([search_pattern])
+        regex = pattern_matcher.regex_dict[0]
+        hits = 0
+        start_time = time.perf_counter()
+        for text_line in text_lines:
+            if regex.search(text_line):
+                hits = hits + 1
+        seconds = time.perf_counter() - start_time
+        evaluations = 0
+        for text_line in text_lines:
+            if pattern_matcher.get_candidates(text_line) != []:
+                evaluations = evaluations + 1
+        pattern_cost_list.append((seconds, hits, evaluations, search_pattern))
+    pattern_cost_list.sort(key=lambda pattern_cost: pattern_cost[0], reverse=True)
+    return len(text_lines), pattern_cost_list
+
+def printResult(name, log_file, text_lines, text_size, summary_lines, seconds, peak_rss):
+    print("%-28s %-30s %9d lines %8.0f lines/s %7.2f MB/s %8.1f MB rss %6d summary" % (
+        name,
+        os.path.basename(log_file),
+        text_lines,
+        text_lines / seconds,
+        text_size / seconds / 1024 / 1024,
+        peak_rss / 1024,
+        summary_lines,
+        ))
+
+def runBench(args, log_files, work_dir):
+    db_file = args.db or os.path.join(work_dir, 'search_pattern.db')
+    if not args.db:
+        print("Loaded %d pattern from %s" % (loadPatternToSqlite(args.sql, db_file), args.sql))
+    start_time = time.perf_counter()
+    # a project without pattern of its own
+    log_search_pattern = getLogSearchPattern(db_file, 'bench', args.uuid)
+    bundle_file = writePatternBundle(log_search_pattern, 'bench', args.uuid, work_dir)
+    print("Got the pattern in %.3f s" % (time.perf_counter() - start_time))
+    start_time = time.perf_counter()
+    log_parser.compile_log_search_pattern(log_search_pattern)
+    print("Compiled the pattern in %.3f s" % (time.perf_counter() - start_time))
+    ansifilter = 'ansifilter' in args.parser and hasAnsiFilter()
+    for log_file in log_files:
+        text_lines, text_size = getLogSize(log_file)
+        if 'log_parser' in args.parser:
+            for core in args.core:
+                summary_lines, seconds, peak_rss = runLogParser(log_file, bundle_file, core, args.chunk, work_dir)
+                printResult('log_parser.py core=%d' % core, log_file, text_lines, text_size, summary_lines, seconds, peak_rss)
+        if ansifilter:
+            # the ansifilter binary and the filter in log_parser.py
+            # on the same uncompressed log
+            plain_file = writePlainLog(log_file, work_dir)
+            filtered_size, seconds, peak_rss = runAnsiFilter(plain_file)
+            printFilterResult('ansifilter', log_file, text_lines, text_size, filtered_size, seconds, peak_rss)
+            filtered_size, seconds, peak_rss = runForked(runAnsiFilterPython, plain_file)
+            printFilterResult('log_parser.py ansi_filter', log_file, text_lines, text_size, filtered_size or 0, seconds, peak_rss)
+            os.unlink(plain_file)
+    if args.pattern_cost:
+        cost_lines, pattern_cost_list = getPatternCost(log_search_pattern, log_files, args.cost_lines)
+        print("Most expensive pattern on %d lines" % cost_lines)
+        print("%8s %10s %8s %8s %11s  %s" % ('id', 'us/line', 'hits', 'evals', 'total ms', 'search'))
+        for seconds, hits, evaluations, search_pattern in pattern_cost_list[:args.pattern_cost]:
+            print("%8d %10.3f %8d %8d %11.2f  %s" % (
+                search_pattern['id'],
+                seconds / max(cost_lines, 1) * 1000000,
+                hits,
+                evaluations,
+                seconds * 1000,
+                search_pattern['search'],
+                ))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark log_parser.py')
+    parser.add_argument("--sql", default=os.path.join(os.path.dirname(bench_dir), 'sql', 'search_pattern.sql'))
+    parser.add_argument("--db", help="SQLite db with projects_pattern, made from --sql if not set")
+    parser.add_argument("-u", "--uuid", default=DEFAULT_UUID)
+    parser.add_argument("--parser", nargs='+', default=['log_parser', 'ansifilter'], choices=['log_parser', 'ansifilter'])
+    parser.add_argument("--core", nargs='+', type=int, default=[1, 2])
+    parser.add_argument("--chunk", type=int, default=1000)
+    parser.add_argument("--pattern-cost", type=int, default=20, help="show the N most expensive pattern, 0 to skip")
+    parser.add_argument("--cost-lines", type=int, default=20000)
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    synthetic_parser = subparsers.add_parser('synthetic', help='generate a emerge log')
+    synthetic_parser.add_argument("--lines", type=int, default=100000)
+    synthetic_parser.add_argument("--error-density", type=float, default=0.01)
+    synthetic_parser.add_argument("--color-density", type=float, default=0.0)
+    synthetic_parser.add_argument("--seed", type=int, default=0)
+    replay_parser = subparsers.add_parser('replay', help='run on the .log.gz files in a dir')
+    replay_parser.add_argument("dir")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='log_parser_bench.') as work_dir:
+        if args.mode == 'synthetic':
+            log_file = os.path.join(work_dir, 'synthetic-%d-%s.log.gz' % (args.lines, args.error_density))
+            writeSyntheticLog(log_file, args.lines, args.error_density, args.color_density, args.seed)
+            log_files = [log_file]
+        else:
+            log_files = sorted(os.path.join(args.dir, log_file) for log_file in os.listdir(args.dir) if log_file.endswith('.log.gz'))
+            if log_files == []:
+                print("No .log.gz files in " + args.dir)
+                sys.exit(1)
+        runBench(args, log_files, work_dir)
+
+if __name__ == "__main__":
+    main()
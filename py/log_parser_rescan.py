@@ -0,0 +1,251 @@
+# Copyright 2022 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+# Parse the build logs on the master again with the pattern we have now
+# The summary (result document) next to the log is written when a log is
+# done and the error fingerprint for the build when all the logs of the
+# build is done, the logs that is done is saved in the state file so we
+# can stop and start again.
+# Run it in the master basedir with log_parser.py and logparser.json
+#
+# python3 log_parser_rescan.py
+# python3 log_parser_rescan.py --project uuid --core 8
+
+import sys
+import os
+import json
+import hashlib
+import argparse
+import time
+from multiprocessing import Pool
+
+rescan_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, rescan_dir)
+import log_parser
+
+from buildbot_gentoo_ci.utils.fingerprint import getErrorFingerprint, getErrorPhase, getErrorTitle, NO_ERROR_TITLE
+
+def getBuildsTables():
+    # sqlalchemy tables for the builds and the error fingerprints
+    import sqlalchemy as sa
+
+    metadata = sa.MetaData()
+    projects_builds = sa.Table(
+        "projects_builds", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_uuid', sa.String(36), nullable=False),
+        sa.Column('buildbot_build_id', sa.Integer),
+    )
+    projects_builds_fingerprint = sa.Table(
+        "projects_builds_fingerprint", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('build_id', sa.Integer, nullable=False),
+        sa.Column('project_uuid', sa.String(36), nullable=False),
+        sa.Column('fingerprint', sa.String(64), nullable=False),
+        sa.Column('phase', sa.String(50), nullable=False),
+        sa.Column('error_line', sa.Text, nullable=True),
+        sa.Column('bug_id', sa.Integer, nullable=True),
+        sa.Column('created_at', sa.Integer, nullable=True),
+    )
+    return projects_builds, projects_builds_fingerprint
+
+def getBuilds(Session, projects_builds, project_uuid):
+    # {buildbot_build_id : (build id, project uuid)}
+    q = projects_builds.select()
+    if project_uuid is not None:
+        q = q.where(projects_builds.c.project_uuid == project_uuid)
+    builds = {}
+    for row in Session.execute(q):
+        if row.buildbot_build_id:
+            builds[row.buildbot_build_id] = (row.id, row.project_uuid)
+    return builds
+
+def getBuildLogs(workers_dir, builds):
+    # workers/<worker>/<buildbot build id>/<full_logname>
+    for worker in sorted(os.listdir(workers_dir)):
+        worker_dir = os.path.join(workers_dir, worker)
+        if not os.path.isdir(worker_dir):
+            continue
+        for build in sorted(os.listdir(worker_dir)):
+            if not build.isdigit() or int(build) not in builds:
+                continue
+            build_dir = os.path.join(worker_dir, build)
+            for file in sorted(os.listdir(build_dir)):
+                # .log.zst if the master did recompress it
+                if file.endswith('.log.gz') or file.endswith('.log.zst'):
+                    yield os.path.join(build_dir, file), builds[int(build)]
+
+def getSummaryFile(log_file):
+    # the master look for <full_logname>.summary.gz and full_logname is
+    # the .log.gz from portage
+    if log_file.endswith('.log.zst'):
+        return log_file[:-4] + '.gz.summary.gz'
+    return log_file + '.summary.gz'
+
+def writePatternBundle(Session, uuid, default_uuid, bundle_dir):
+    # the same bundle as the master make for log_parser.py, the name is
+    # the sha256 so a new pattern give a new bundle
+    bundle = {}
+    bundle['version'] = log_parser.PATTERN_BUNDLE_VERSION
+    bundle['project_uuid'] = uuid
+    bundle['default_uuid'] = default_uuid
+    bundle['log_search_pattern'] = log_parser.get_log_search_pattern(Session, uuid, default_uuid)
+    bundle_data = json.dumps(bundle, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    bundle_file = os.path.join(bundle_dir, hashlib.sha256(bundle_data).hexdigest() + '.json')
+    if not os.path.isfile(bundle_file):
+        with open(bundle_file + '.tmp', 'wb') as f:
+            f.write(bundle_data)
+        os.replace(bundle_file + '.tmp', bundle_file)
+    return bundle_file
+
+def readState(state_file):
+    # the logs we have done, {log : bundle}
+    state = {}
+    if os.path.isfile(state_file):
+        with open(state_file, encoding='utf-8') as f:
+            for line in f:
+                # the last line can be half written if we did get killed
+                try:
+                    done = json.loads(line)
+                except ValueError:
+                    continue
+                state[done['log']] = done['bundle']
+    return state
+
+def rescanLog(log_file, bundle_file, chunk_size, dict_dir):
+    # run in the pool, parse the log, write the result document and
+    # return the phase and error line if the build did fail
+    log_search_pattern = log_parser.get_bundle_search_pattern(bundle_file)
+    max_start, max_end = log_parser.get_context_size(log_search_pattern['default'].search_pattern_list)
+    text_chunks = log_parser.get_text_chunks(log_parser.get_text_lines(log_file, dict_dir=dict_dir), chunk_size, max_start, max_end)
+    results = []
+    summary_log_dict = {}
+    try:
+        for text_chunk in text_chunks:
+            summary_list = log_parser.search_text_chunk(log_search_pattern, text_chunk)
+            results.append(summary_list)
+            for value in summary_list:
+                summary_log_dict.update(value)
+    except Exception as e:
+        # a broken log, we don't stop the rescan for it
+        print(f'Failed with: {e} on {log_file}', flush=True)
+        return log_file, False, None
+    if not log_parser.writeResultDocument(results, getSummaryFile(log_file)):
+        return log_file, False, None
+    # the last error phase like MakeIssue
+    phase = None
+    for k, v in sorted(summary_log_dict.items()):
+        if getErrorPhase(v['text']) is not None:
+            phase = getErrorPhase(v['text'])
+    if phase is None:
+        return log_file, True, None
+    return log_file, True, (phase, getErrorTitle(summary_log_dict, phase))
+
+def rescanLogArgs(args):
+    return rescanLog(*args)
+
+def removeBuildFingerprint(Session, projects_builds_fingerprint, build_id):
+    # the new patterns don't find a failing phase or error line for the build
+    tbl = projects_builds_fingerprint
+    Session.execute(tbl.delete().where(tbl.c.build_id == build_id))
+    Session.commit()
+
+def setBuildFingerprint(Session, projects_builds_fingerprint, build_id, project_uuid, phase, error_title):
+    # we don't make a fingerprint without a error line, like MakeIssue
+    if error_title == NO_ERROR_TITLE:
+        removeBuildFingerprint(Session, projects_builds_fingerprint, build_id)
+        return
+    fingerprint, error_line = getErrorFingerprint(phase, error_title)
+    tbl = projects_builds_fingerprint
+    row = Session.execute(tbl.select().where(tbl.c.build_id == build_id)).first()
+    if row is None:
+        Session.execute(tbl.insert().values(build_id=build_id,
+                                            project_uuid=project_uuid,
+                                            fingerprint=fingerprint,
+                                            phase=phase,
+                                            error_line=error_line,
+                                            created_at=int(time.time())))
+    elif row.fingerprint != fingerprint:
+        # the bug was for the old fingerprint
+        Session.execute(tbl.update().where(tbl.c.build_id == build_id).values(fingerprint=fingerprint,
+                                                                            phase=phase,
+                                                                            error_line=error_line,
+                                                                            bug_id=None))
+    Session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse the build logs on the master again with the pattern in the db')
+    parser.add_argument("--basedir", default=os.getcwd(), help="master basedir with the workers dir")
+    parser.add_argument("-u", "--project", help="only the builds for the project uuid")
+    parser.add_argument("--core", type=int, default=os.cpu_count())
+    parser.add_argument("--state", default='log_parser_rescan.state', help="logs that is done, remove it to start over")
+    args = parser.parse_args()
+    config = log_parser.getConfigSettings()
+    chunk_size = int(config.get('chunk', 1000))
+    Session = log_parser.getDBSession(config)
+    projects_builds, projects_builds_fingerprint = getBuildsTables()
+    builds = getBuilds(Session, projects_builds, args.project)
+    bundle_dir = os.path.join(args.basedir, 'patterns')
+    os.makedirs(bundle_dir, exist_ok=True)
+    bundles = {}
+    for build_id, project_uuid in builds.values():
+        if project_uuid not in bundles:
+            bundles[project_uuid] = writePatternBundle(Session, project_uuid, config['default_uuid'], bundle_dir)
+    state = readState(args.state)
+    # a build can have more then one log (the cpv and the faild_cpv) and
+    # we only know the fingerprint when all of them is done, so we parse
+    # all the logs of a build with a old bundle or a log that is not done
+    build_logs = {}
+    for log_file, build in getBuildLogs(os.path.join(args.basedir, 'workers'), builds):
+        build_logs.setdefault(build, []).append(log_file)
+    log_list = []
+    for build, log_files in build_logs.items():
+        if any(state.get(log_file) != bundles[build[1]] for log_file in log_files):
+            log_list.extend((log_file, build) for log_file in log_files)
+    print('Logs to parse: ' + str(len(log_list)) + ' done: ' + str(len(state)))
+    log_builds = dict(log_list)
+    # the logs we wait on and the errors we have for the build
+    build_pending = {}
+    build_errors = {}
+    for log_file, build in log_list:
+        build_pending[build] = build_pending.get(build, 0) + 1
+        build_errors[build] = {}
+    start = time.monotonic()
+    done = 0
+    failed = 0
+    with Pool(processes = args.core) as pool, open(args.state, 'a', encoding='utf-8') as state_f:
+        dict_dir = os.path.join(args.basedir, 'zstd')
+        results = pool.imap_unordered(rescanLogArgs, ((log_file, bundles[build[1]], chunk_size, dict_dir) for log_file, build in log_list))
+        for log_file, result_ok, error in results:
+            build = log_builds[log_file]
+            build_id, project_uuid = build
+            build_pending[build] = build_pending[build] - 1
+            if not result_ok:
+                failed = failed + 1
+                # we don't know the error for the build, keep the fingerprint
+                build_errors[build] = None
+            elif build_errors[build] is not None:
+                build_errors[build][log_file] = error
+            if build_pending[build] > 0 or build_errors[build] is None:
+                continue
+            # the first failing log by name, a log without error in the
+            # same build don't remove the fingerprint
+            error_list = [error for log_file, error in sorted(build_errors[build].items()) if error is not None]
+            if error_list != []:
+                setBuildFingerprint(Session, projects_builds_fingerprint, build_id, project_uuid, error_list[0][0], error_list[0][1])
+            else:
+                removeBuildFingerprint(Session, projects_builds_fingerprint, build_id)
+            for log_file in build_errors[build]:
+                state_f.write(json.dumps({ 'log' : log_file, 'bundle' : bundles[project_uuid] }) + '\n')
+                done = done + 1
+                if done % 100 == 0:
+                    print('Done: ' + str(done) + '/' + str(len(log_list)) + ' ' + str(round(done / (time.monotonic() - start), 1)) + ' logs/s')
+            state_f.flush()
+            del build_errors[build]
+    Session.close()
+    print('Done: ' + str(done) + ' failed: ' + str(failed))
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()